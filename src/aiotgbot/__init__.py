@@ -52,6 +52,7 @@ from .filters import (
     UpdateTypeFilter,
 )
 from .handler_table import HandlerTable
+from .priority import RequestPriority, request_priority
 from .storage import StorageProtocol
 
 __all__ = (
@@ -94,6 +95,7 @@ __all__ = (
     "PrivateChatFilter",
     "ReplyKeyboardMarkup",
     "ReplyKeyboardRemove",
+    "RequestPriority",
     "RestartingTelegram",
     "RetryAfter",
     "ShippingQuery",
@@ -105,4 +107,5 @@ __all__ = (
     "UpdateTypeFilter",
     "User",
     "__version__",
+    "request_priority",
 )
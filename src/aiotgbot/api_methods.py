@@ -306,6 +306,7 @@ class ApiMethods(ABC):
         link_preview_options: LinkPreviewOptions | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -327,6 +328,7 @@ class ApiMethods(ABC):
             link_preview_options=_encode_json(link_preview_options),
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -396,6 +398,7 @@ class ApiMethods(ABC):
         caption_entities: Sequence[MessageEntity] | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
     ) -> ResponseMessageId:
@@ -418,6 +421,7 @@ class ApiMethods(ABC):
             caption=caption,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
         )
@@ -430,6 +434,7 @@ class ApiMethods(ABC):
         message_thread_id: MessageThreadId | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         remove_caption: bool | None = None,
     ) -> tuple[ResponseMessageId, ...]:
         api_logger.debug(
@@ -447,6 +452,7 @@ class ApiMethods(ABC):
             message_thread_id=message_thread_id,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             remove_caption=remove_caption,
         )
 
@@ -461,6 +467,7 @@ class ApiMethods(ABC):
         has_spoiler: bool | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -482,6 +489,7 @@ class ApiMethods(ABC):
             has_spoiler=has_spoiler,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -497,6 +505,7 @@ class ApiMethods(ABC):
         caption_entities: Sequence[MessageEntity] | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         duration: int | None = None,
         performer: str | None = None,
@@ -521,6 +530,7 @@ class ApiMethods(ABC):
             caption_entities=_encode_json(caption_entities),
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             duration=duration,
             performer=performer,
@@ -542,6 +552,7 @@ class ApiMethods(ABC):
         disable_content_type_detection: bool | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         duration: int | None = None,
         performer: str | None = None,
@@ -567,6 +578,7 @@ class ApiMethods(ABC):
             disable_content_type_detection=disable_content_type_detection,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             duration=duration,
             performer=performer,
@@ -591,6 +603,7 @@ class ApiMethods(ABC):
         supports_streaming: bool | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -617,6 +630,7 @@ class ApiMethods(ABC):
             supports_streaming=supports_streaming,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -637,6 +651,7 @@ class ApiMethods(ABC):
         has_spoiler: bool | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -662,6 +677,7 @@ class ApiMethods(ABC):
             has_spoiler=has_spoiler,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -678,6 +694,7 @@ class ApiMethods(ABC):
         duration: int | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -699,6 +716,7 @@ class ApiMethods(ABC):
             duration=duration,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -714,6 +732,7 @@ class ApiMethods(ABC):
         thumbnail: InputFile | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -734,6 +753,7 @@ class ApiMethods(ABC):
             thumbnail=thumbnail,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -748,6 +768,7 @@ class ApiMethods(ABC):
         message_thread_id: MessageThreadId | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
     ) -> tuple[Message, ...]:
@@ -787,6 +808,7 @@ class ApiMethods(ABC):
             message_thread_id=message_thread_id,
             disable_notification=disable_notification,
             protect_content=_encode_json(protect_content),
+            allow_paid_broadcast=_encode_json(allow_paid_broadcast),
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             **attachments,
@@ -805,6 +827,7 @@ class ApiMethods(ABC):
         length: int | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -828,6 +851,7 @@ class ApiMethods(ABC):
             length=length,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -935,6 +959,7 @@ class ApiMethods(ABC):
         foursquare_type: str | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -957,6 +982,7 @@ class ApiMethods(ABC):
             foursquare_type=foursquare_type,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -972,6 +998,7 @@ class ApiMethods(ABC):
         vcard: str | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -992,6 +1019,7 @@ class ApiMethods(ABC):
             vcard=vcard,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -1015,6 +1043,7 @@ class ApiMethods(ABC):
         close_date: int | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -1043,6 +1072,7 @@ class ApiMethods(ABC):
             close_date=close_date,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -1055,6 +1085,7 @@ class ApiMethods(ABC):
         emoji: DiceEmoji | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -1073,6 +1104,7 @@ class ApiMethods(ABC):
             emoji=emoji,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -2399,6 +2431,7 @@ class ApiMethods(ABC):
         message_thread_id: MessageThreadId | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         business_connection_id: str | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: ReplyMarkup | None = None,
@@ -2417,6 +2450,7 @@ class ApiMethods(ABC):
             message_thread_id=message_thread_id,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             business_connection_id=business_connection_id,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
@@ -2771,6 +2805,7 @@ class ApiMethods(ABC):
         is_flexible: bool | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: InlineKeyboardMarkup | None = None,
     ) -> Message:
@@ -2807,6 +2842,7 @@ class ApiMethods(ABC):
             is_flexible=is_flexible,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
         )
@@ -2929,6 +2965,7 @@ class ApiMethods(ABC):
         message_thread_id: MessageThreadId | None = None,
         disable_notification: bool | None = None,
         protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
         reply_parameters: ReplyParameters | None = None,
         reply_markup: InlineKeyboardMarkup | None = None,
     ) -> Message:
@@ -2946,6 +2983,7 @@ class ApiMethods(ABC):
             message_thread_id=message_thread_id,
             disable_notification=disable_notification,
             protect_content=protect_content,
+            allow_paid_broadcast=allow_paid_broadcast,
             reply_parameters=_encode_json(reply_parameters),
             reply_markup=_encode_json(reply_markup),
         )
@@ -11,7 +11,12 @@ from collections.abc import (
     Mapping,
     MutableMapping,
 )
-from contextlib import asynccontextmanager
+from contextlib import (
+    AbstractAsyncContextManager,
+    asynccontextmanager,
+    nullcontext,
+    suppress,
+)
 from dataclasses import dataclass
 from functools import partial
 from http import HTTPStatus
@@ -28,28 +33,62 @@ from typing import (
 
 import aiojobs
 import msgspec
-from aiofreqlimit import FreqLimit, FreqLimitParams
-from aiofreqlimit.backends.memory import InMemoryBackend
+from aiofreqlimit import FreqLimitBackend
 from aiohttp import ClientError, ClientSession, FormData, TCPConnector
 from tenacity import retry, retry_if_exception_type, wait_exponential
 from typing_extensions import override  # Python 3.11 compatibility
 
 from .api_methods import ApiMethods, ParamType
-from .api_types import APIResponse, ChatId, InputFile, Update, User, UserId
+from .api_types import (
+    APIResponse,
+    ChatId,
+    ChatMemberBanned,
+    ChatMemberLeft,
+    ChatMemberRestricted,
+    ChatMemberUpdated,
+    InputFile,
+    Update,
+    User,
+    UserId,
+)
 from .bot_update import BotUpdate, Context, StateContext
+from .broadcast import Broadcast, BroadcastSend, ChatIds
+from .coalescing import CoalescingApi
 from .constants import ChatType, RequestMethod
 from .exceptions import (
     BadGateway,
     BotBlocked,
     BotKicked,
     ChatNotFound,
+    MessageNotModified,
     MigrateToChat,
     RestartingTelegram,
     RetryAfter,
     TelegramError,
 )
-from .helpers import BotKey, KeyLock, get_software
-from .storage import StorageProtocol
+from .helpers import BotKey, Json, KeyLock, get_software
+from .limiter import (
+    DEFAULT_LIMIT_PROFILE,
+    AdaptiveLimit,
+    LimitProfile,
+    MemoryLimitBackend,
+)
+from .lock import LockProviderProtocol
+from .outbox import Outbox
+from .priority import (
+    PriorityLane,
+    RequestPriority,
+    current_priority,
+    request_priority,
+)
+from .storage import (
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
+from .storage_queue import StorageQueue
 
 __all__ = (
     "Bot",
@@ -66,18 +105,12 @@ TG_FILE_URL: Final[str] = "https://api.telegram.org/file/bot{token}/{path}"
 TG_GET_UPDATES_TIMEOUT: Final[int] = 60
 STATE_PREFIX: Final[str] = "state"
 CONTEXT_PREFIX: Final[str] = "context"
-MESSAGE_LIMIT_PARAMS: Final[FreqLimitParams] = FreqLimitParams(
-    limit=30,
-    period=1.0,
-)
-CHAT_LIMIT_PARAMS: Final[FreqLimitParams] = FreqLimitParams(
-    limit=1,
-    period=1.0,
-)
-GROUP_LIMIT_PARAMS: Final[FreqLimitParams] = FreqLimitParams(
-    limit=20,
-    period=60.0,
-)
+STATE_INDEX_PREFIX: Final[str] = "state_index"
+STATE_INDEX_PAGE_SIZE: Final[int] = 1000
+FENCE_PREFIX: Final[str] = "fence"
+UNREACHABLE_PREFIX: Final[str] = "unreachable"
+REAP_INTERVAL: Final[float] = 60.0
+REAP_BATCH_SIZE: Final[int] = 1000
 
 bot_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.bot")
 response_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.response")
@@ -103,12 +136,51 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
         handler_table: HandlerTableProtocol,
         storage: StorageProtocol,
         client_session: ClientSession | None = None,
+        *,
+        state_ttl: float | None = None,
+        state_index: bool = False,
+        lock_provider: LockProviderProtocol | None = None,
+        outbox: StorageQueue | None = None,
+        outbox_workers: int = 4,
+        limit_profile: LimitProfile = DEFAULT_LIMIT_PROFILE,
+        limit_backend: FreqLimitBackend | None = None,
+        unreachable_cache: bool = False,
+        unreachable_ttl: float | None = None,
     ) -> None:
         if not handler_table.frozen:
             raise RuntimeError("Can't use unfrozen handler table")
+        if state_ttl is not None and state_ttl <= 0:
+            raise ValueError("state_ttl must be positive")
+        if unreachable_ttl is not None and unreachable_ttl <= 0:
+            raise ValueError("unreachable_ttl must be positive")
         self._token: Final[str] = token
         self._handler_table: Final[HandlerTableProtocol] = handler_table
         self._storage: Final[StorageProtocol] = storage
+        self._state_ttl: Final[float | None] = state_ttl
+        self._state_index: Final[bool] = state_index
+        self._unreachable_cache: Final[bool] = unreachable_cache
+        self._unreachable_ttl: Final[float | None] = unreachable_ttl
+        self._reap_task: asyncio.Task[None] | None = None
+        # Storages with state or queue keys that expire
+        self._expiring: Final[list[StorageProtocol]] = []
+        if state_ttl is not None or unreachable_ttl is not None:
+            self._expiring.append(storage)
+        if outbox is not None:
+            self._expiring.append(outbox.storage)
+        self._outbox: Final[Outbox | None] = (
+            Outbox(
+                outbox,
+                self._request,
+                self._deliver,
+                self._telegram_exception,
+                workers=outbox_workers,
+            )
+            if outbox is not None
+            else None
+        )
+        self._coalescing: Final[CoalescingApi] = CoalescingApi(
+            self._request, self._safe_request
+        )
         if client_session is not None:
             _ = client_session.headers.setdefault("User-Agent", SOFTWARE)
         else:
@@ -117,19 +189,30 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
                 headers={"User-Agent": SOFTWARE},
             )
         self._client_session: Final[ClientSession] = client_session
-        self._user_chat_lock: Final[KeyLock] = KeyLock()
-        self._message_limit: Final[FreqLimit] = FreqLimit(
-            MESSAGE_LIMIT_PARAMS,
-            backend=InMemoryBackend(),
+        self._user_chat_lock: Final[LockProviderProtocol] = (
+            lock_provider if lock_provider is not None else KeyLock()
+        )
+        self._limit_profile: Final[LimitProfile] = limit_profile
+        if limit_backend is None:
+            limit_backend = MemoryLimitBackend()
+        self._message_limit: Final[AdaptiveLimit] = AdaptiveLimit(
+            limit_profile.message,
+            backend=limit_backend,
+            name="message",
         )
-        self._chat_limit: Final[FreqLimit] = FreqLimit(
-            CHAT_LIMIT_PARAMS,
-            backend=InMemoryBackend(),
+        self._chat_limit: Final[AdaptiveLimit] = AdaptiveLimit(
+            limit_profile.chat,
+            backend=limit_backend,
+            name="chat",
         )
-        self._group_limit: Final[FreqLimit] = FreqLimit(
-            GROUP_LIMIT_PARAMS,
-            backend=InMemoryBackend(),
+        self._group_limit: Final[AdaptiveLimit] = AdaptiveLimit(
+            limit_profile.group,
+            backend=limit_backend,
+            name="group",
         )
+        # Chat and end of the last RetryAfter pause, see _backoff
+        self._flood: tuple[ChatId, float] | None = None
+        self._priority_lane: Final[PriorityLane] = PriorityLane()
         self._scheduler: aiojobs.Scheduler | None = None
         self._started: bool = False
         self._stopped = False
@@ -196,6 +279,17 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
     def client(self) -> ClientSession:
         return self._client_session
 
+    @property
+    def outbox(self) -> Outbox:
+        if self._outbox is None:
+            raise RuntimeError("Outbox is disabled")
+        return self._outbox
+
+    @property
+    def coalescing(self) -> CoalescingApi:
+        """API methods merging single message calls into bulk calls."""
+        return self._coalescing
+
     def file_url(self, path: str) -> str:
         return TG_FILE_URL.format(token=self._token, path=path)
 
@@ -243,6 +337,8 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
             return ChatNotFound(error_code, description)
         if BotKicked.match(description):
             return BotKicked(error_code, description)
+        if MessageNotModified.match(description):
+            return MessageNotModified(error_code, description)
         return TelegramError(error_code, description)
 
     @override
@@ -310,6 +406,62 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
         chat_id: ChatId | str,
         type_: type[V],
         **params: ParamType,
+    ) -> V:
+        async with self._reachable(chat_id):
+            chat = await self.get_chat(chat_id)
+            return await self._limited_request(
+                http_method,
+                api_method,
+                chat_id,
+                chat.id,
+                chat.type in (ChatType.GROUP, ChatType.SUPERGROUP),
+                type_,
+                **params,
+            )
+
+    @asynccontextmanager
+    async def _reachable(self, chat_id: ChatId | str) -> AsyncIterator[None]:
+        # Fail fast for chats that blocked, kicked or never knew the bot
+        if not self._unreachable_cache or isinstance(chat_id, str):
+            yield
+            return
+        key = f"{UNREACHABLE_PREFIX}|{chat_id}"
+        stored = await self._storage.get(key)
+        if stored is not None:
+            raise self._telegram_exception(msgspec.convert(stored, APIResponse))
+        try:
+            yield
+        except (BotBlocked, BotKicked, ChatNotFound) as exception:
+            response = APIResponse(
+                ok=False,
+                error_code=exception.error_code,
+                description=exception.description,
+            )
+            value = cast(Json, msgspec.to_builtins(response))
+            if self._unreachable_ttl is not None:
+                await self._storage.set(key, value, ttl=self._unreachable_ttl)
+            else:
+                await self._storage.set(key, value)
+            raise
+
+    async def _update_reachable(self, chat_member: ChatMemberUpdated) -> None:
+        member = chat_member.new_chat_member
+        if isinstance(member, ChatMemberLeft | ChatMemberBanned) or (
+            isinstance(member, ChatMemberRestricted) and not member.is_member
+        ):
+            return
+        # Unblocked by the user or added to the chat again
+        await self._storage.delete(f"{UNREACHABLE_PREFIX}|{chat_member.chat.id}")
+
+    async def _limited_request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        limit_key: ChatId,
+        group: bool,
+        type_: type[V],
+        **params: ParamType,
     ) -> V:
         retry_allowed = all(
             not isinstance(param, InputFile) for param in params.values()
@@ -324,26 +476,107 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
                 **params,
             )
 
-        chat = await self.get_chat(chat_id)
+        scope_limit = self._group_limit if group else self._chat_limit
         while True:
             try:
-                message_limit = self._message_limit.resource()
-                if chat.type in (ChatType.GROUP, ChatType.SUPERGROUP):
-                    group_limit = self._group_limit.resource(chat.id)
-                    async with message_limit, group_limit:
-                        return await perform_request()
-                else:
-                    chat_limit = self._chat_limit.resource(chat.id)
-                    async with message_limit, chat_limit:
-                        return await perform_request()
+                async with (
+                    self._message_slot(),
+                    scope_limit.resource(limit_key),
+                ):
+                    result = await perform_request()
             except RetryAfter as retry_after:
-                if retry_allowed:
-                    await asyncio.sleep(retry_after.retry_after)
-                else:
+                self._backoff(scope_limit, limit_key, retry_after.retry_after)
+                if not retry_allowed:
                     bot_logger.error(
                         "RetryAfter error during retry not allowed",
                     )
                     raise
+            else:
+                self._message_limit.success()
+                scope_limit.success()
+                return result
+
+    def _backoff(
+        self, scope_limit: AdaptiveLimit, limit_key: ChatId, retry_after: float
+    ) -> None:
+        # Pending calls to the chat wait out the pause, the retry too.
+        # RetryAfter from two chats within one pause means the global
+        # limit is hit, then every call waits.
+        scope_limit.backoff(limit_key, retry_after)
+        now = asyncio.get_running_loop().time()
+        if self._flood is not None:
+            flood_key, flood_until = self._flood
+            if flood_key != limit_key and now < flood_until:
+                self._message_limit.backoff(None, retry_after)
+        self._flood = limit_key, now + retry_after
+
+    @asynccontextmanager
+    async def _message_slot(self) -> AsyncIterator[None]:
+        # Reserve global limiter slots one caller at a time in priority
+        # order, so interactive calls don't queue behind bulk ones
+        async with (
+            self._priority_lane.resource(current_priority()),
+            self._message_limit.resource(),
+        ):
+            pass
+        yield
+
+    async def _broadcast_request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        type_: type[V],
+        **params: ParamType,
+    ) -> V:
+        if isinstance(chat_id, str):
+            return await self._safe_request(
+                http_method, api_method, chat_id, type_, **params
+            )
+        # Group and channel ids are negative, no getChat per recipient
+        async with self._reachable(chat_id):
+            return await self._limited_request(
+                http_method, api_method, chat_id, chat_id, chat_id < 0, type_, **params
+            )
+
+    def broadcast(
+        self,
+        name: str,
+        chat_ids: ChatIds,
+        send: BroadcastSend,
+        *,
+        total: int | None = None,
+        workers: int | None = None,
+        checkpoint_size: int = 100,
+    ) -> Broadcast:
+        """Create a resumable broadcast, see ``Broadcast``.
+
+        ``workers`` defaults to the message rate of the limit profile.
+        """
+        if workers is None:
+            workers = self._limit_profile.message.limit
+        return Broadcast(
+            self._request,
+            self._broadcast_request,
+            self._storage,
+            name,
+            chat_ids,
+            send,
+            total=total,
+            workers=workers,
+            checkpoint_size=checkpoint_size,
+        )
+
+    async def _deliver(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        params: dict[str, ParamType],
+    ) -> msgspec.Raw:
+        return await self._safe_request(
+            http_method, api_method, chat_id, msgspec.Raw, **params
+        )
 
     @staticmethod
     def _update_user_chat_key(
@@ -400,27 +633,30 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
             'Dispatch update "%s"',
             update.update_id,
         )
+        if self._unreachable_cache and update.my_chat_member is not None:
+            await self._update_reachable(update.my_chat_member)
         user_id, chat_id = self._update_user_chat_key(update)
-        async with self.state_context(user_id, chat_id) as state_context:
-            bot_update = BotUpdate(
-                state_context.state,
-                state_context.context,
-                update,
-            )
-            handler = await self._handler_table.get_handler(self, bot_update)
-            if handler is not None:
-                bot_logger.debug(
-                    'Dispatched update "%s" to "%s"',
-                    update.update_id,
-                    handler.__name__,
-                )
-                await handler(self, bot_update)
-                state_context.state = bot_update.state
-            else:
-                bot_logger.debug(
-                    'Not found handler for update "%s". Skip.',
-                    update.update_id,
+        with request_priority(RequestPriority.INTERACTIVE):
+            async with self.state_context(user_id, chat_id) as state_context:
+                bot_update = BotUpdate(
+                    state_context.state,
+                    state_context.context,
+                    update,
                 )
+                handler = await self._handler_table.get_handler(self, bot_update)
+                if handler is not None:
+                    bot_logger.debug(
+                        'Dispatched update "%s" to "%s"',
+                        update.update_id,
+                        handler.__name__,
+                    )
+                    await handler(self, bot_update)
+                    state_context.state = bot_update.state
+                else:
+                    bot_logger.debug(
+                        'Not found handler for update "%s". Skip.',
+                        update.update_id,
+                    )
 
     @staticmethod
     def _user_chat_key(
@@ -442,6 +678,45 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
     def _context_key(user_chat_key: UserChatKey) -> ContextKey:
         return ContextKey(f"{CONTEXT_PREFIX}|{user_chat_key}")
 
+    @staticmethod
+    def _state_index_key(state: str, user_chat_key: UserChatKey) -> str:
+        return f"{STATE_INDEX_PREFIX}|{state}|{user_chat_key}"
+
+    def _storage_transaction(self) -> AbstractAsyncContextManager[None]:
+        if isinstance(self._storage, TransactionalStorageProtocol):
+            return self._storage.transaction()
+        return nullcontext()
+
+    async def _get_state_values(
+        self, state_key: StateKey, context_key: ContextKey
+    ) -> tuple[Json, Json]:
+        if isinstance(self._storage, BatchStorageProtocol):
+            values = await self._storage.get_many((state_key, context_key))
+            return values[state_key], values[context_key]
+        async with self._storage_transaction():
+            return (
+                await self._storage.get(state_key),
+                await self._storage.get(context_key),
+            )
+
+    async def _set_state_value(self, key: str, value: Json) -> None:
+        if self._state_ttl is not None:
+            await self._storage.set(key, value, ttl=self._state_ttl)
+        else:
+            await self._storage.set(key, value)
+
+    async def _reap_expired(self, storages: list[ExpiringStorageProtocol]) -> None:
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            for storage in storages:
+                try:
+                    deleted = REAP_BATCH_SIZE
+                    while deleted >= REAP_BATCH_SIZE:
+                        deleted = await storage.delete_expired(REAP_BATCH_SIZE)
+                        await asyncio.sleep(0)
+                except Exception as exception:
+                    bot_logger.exception("Expired keys reap error", exc_info=exception)
+
     @asynccontextmanager
     async def state_context(
         self,
@@ -456,25 +731,108 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
             user_id,
             chat_id,
         )
-        async with self._user_chat_lock.resource(user_chat_key):
-            state = await self._storage.get(state_key)
+        async with self._user_chat_lock.resource(user_chat_key) as fencing_token:
+            if fencing_token is not None and not isinstance(
+                self._storage, FencedStorageProtocol
+            ):
+                raise TypeError(
+                    f"{type(self._storage).__name__} can't enforce fencing tokens"
+                )
+            state, context_dict = await self._get_state_values(state_key, context_key)
             assert isinstance(state, str) or state is None
-            context_dict = await self._storage.get(context_key)
             assert isinstance(context_dict, dict) or context_dict is None
             context = Context(context_dict if context_dict is not None else {})
             state_context = StateContext(state, context)
             yield state_context
-            await self._storage.set(state_key, state_context.state)
-            await self._storage.set(
-                context_key,
-                state_context.context.to_dict(),
-            )
+            items: list[tuple[str, Json]] = [
+                (state_key, state_context.state),
+                (context_key, state_context.context.to_dict()),
+            ]
+            if fencing_token is not None:
+                assert isinstance(self._storage, FencedStorageProtocol)
+                if not await self._storage.set_many_fenced(
+                    f"{FENCE_PREFIX}|{user_chat_key}",
+                    fencing_token,
+                    items,
+                    ttl=self._state_ttl,
+                ):
+                    raise RuntimeError("Lock lost, state was written by a newer holder")
+                items = []
+            async with self._storage_transaction():
+                for key, value in items:
+                    await self._set_state_value(key, value)
+                if self._state_index:
+                    await self._update_state_index(
+                        user_chat_key, state, state_context.state
+                    )
             bot_logger.debug(
                 'Set state and context for user "%s" and chat %s',
                 user_id,
                 chat_id,
             )
 
+    async def _update_state_index(
+        self,
+        user_chat_key: UserChatKey,
+        old_state: str | None,
+        new_state: str | None,
+    ) -> None:
+        if old_state is not None and old_state != new_state:
+            await self._storage.delete(self._state_index_key(old_state, user_chat_key))
+        if new_state is not None:
+            await self._set_state_value(
+                self._state_index_key(new_state, user_chat_key), None
+            )
+
+    async def iterate_state(
+        self, state: str
+    ) -> AsyncIterator[tuple[UserId | None, ChatId | None]]:
+        if not self._state_index:
+            raise RuntimeError("State index is disabled")
+        prefix = f"{STATE_INDEX_PREFIX}|{state}|"
+        async for key, _ in self._storage.iterate(prefix):
+            key_state, user_id, chat_id = key[len(STATE_INDEX_PREFIX) + 1 :].rsplit(
+                "|", 2
+            )
+            if key_state != state:
+                continue
+            yield (
+                UserId(int(user_id)) if user_id != "" else None,
+                ChatId(int(chat_id)) if chat_id != "" else None,
+            )
+
+    async def _iterate_pages(
+        self, prefix: str
+    ) -> AsyncIterator[list[tuple[str, Json]]]:
+        start_after: str | None = None
+        while True:
+            page = [
+                item
+                async for item in self._storage.iterate(
+                    prefix, start_after=start_after, limit=STATE_INDEX_PAGE_SIZE
+                )
+            ]
+            if len(page) == 0:
+                return
+            yield page
+            start_after = page[-1][0]
+
+    async def rebuild_state_index(self) -> None:
+        if not self._state_index:
+            raise RuntimeError("State index is disabled")
+        async for page in self._iterate_pages(f"{STATE_INDEX_PREFIX}|"):
+            async with self._storage_transaction():
+                for key, _ in page:
+                    await self._storage.delete(key)
+        async for page in self._iterate_pages(f"{STATE_PREFIX}|"):
+            async with self._storage_transaction():
+                for key, state in page:
+                    if isinstance(state, str):
+                        user_chat_key = UserChatKey(key[len(STATE_PREFIX) + 1 :])
+                        await self._set_state_value(
+                            self._state_index_key(state, user_chat_key), None
+                        )
+
     async def _start(self) -> None:
         self._started = True
 
@@ -482,11 +840,30 @@ class Bot(MutableMapping[StorageKey, StoredValue], ApiMethods, ABC):
         self._scheduler = aiojobs.Scheduler(
             exception_handler=self._scheduler_exception_handler
         )
+        expiring = {
+            id(storage): storage
+            for storage in self._expiring
+            if isinstance(storage, ExpiringStorageProtocol)
+        }
+        if len(expiring) > 0:
+            self._reap_task = asyncio.create_task(
+                self._reap_expired(list(expiring.values()))
+            )
+        if self._outbox is not None:
+            await self._outbox.start()
 
     async def _cleanup(self) -> None:
         assert self._client_session is not None
         assert self._scheduler is not None
+        if self._reap_task is not None:
+            _ = self._reap_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._reap_task
+            self._reap_task = None
+        if self._outbox is not None:
+            await self._outbox.stop()
         await self._scheduler.close()
+        await self._coalescing.flush()
         await self._client_session.close()
         await self._message_limit.clear()
         await self._chat_limit.clear()
@@ -509,12 +886,31 @@ class PollBot(Bot):
         handler_table: HandlerTableProtocol,
         storage: StorageProtocol,
         client_session: ClientSession | None = None,
+        *,
+        state_ttl: float | None = None,
+        state_index: bool = False,
+        lock_provider: LockProviderProtocol | None = None,
+        outbox: StorageQueue | None = None,
+        outbox_workers: int = 4,
+        limit_profile: LimitProfile = DEFAULT_LIMIT_PROFILE,
+        limit_backend: FreqLimitBackend | None = None,
+        unreachable_cache: bool = False,
+        unreachable_ttl: float | None = None,
     ) -> None:
         super().__init__(
             token,
             handler_table,
             storage,
             client_session,
+            state_ttl=state_ttl,
+            state_index=state_index,
+            lock_provider=lock_provider,
+            outbox=outbox,
+            outbox_workers=outbox_workers,
+            limit_profile=limit_profile,
+            limit_backend=limit_backend,
+            unreachable_cache=unreachable_cache,
+            unreachable_ttl=unreachable_ttl,
         )
         self._poll_task: asyncio.Task[None] | None = None
 
@@ -0,0 +1,366 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterable, Awaitable, Callable, Iterable
+from contextlib import AbstractAsyncContextManager, nullcontext
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import Final, TypeVar, cast
+
+import msgspec
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .api_methods import ApiMethods, ParamType
+from .api_types import ChatId, MessageId, ReplyMarkup
+from .constants import ParseMode, RequestMethod
+from .exceptions import (
+    BotBlocked,
+    BotKicked,
+    ChatNotFound,
+    MigrateToChat,
+    TelegramError,
+)
+from .helpers import Json
+from .priority import RequestPriority, request_priority
+from .storage import (
+    BatchStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
+
+__all__ = (
+    "Broadcast",
+    "BroadcastOutcome",
+    "BroadcastSend",
+    "BroadcastStats",
+    "copy_message",
+    "send_text",
+)
+
+BROADCAST_PREFIX: Final[str] = "broadcast"
+BROADCAST_PROGRESS_PREFIX: Final[str] = "broadcast_progress"
+
+broadcast_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.broadcast")
+
+T = TypeVar("T")
+
+BroadcastSend = Callable[[ApiMethods, ChatId], Awaitable[object]]
+ChatIds = AsyncIterable[ChatId] | Iterable[ChatId]
+RequestCallable = Callable[..., Awaitable[T]]
+
+
+class BroadcastOutcome(StrEnum):
+    SENT = "sent"
+    BLOCKED = "blocked"
+    KICKED = "kicked"
+    NOT_FOUND = "not_found"
+    FAILED = "failed"
+
+
+def send_text(
+    text: str,
+    *,
+    parse_mode: ParseMode | None = None,
+    reply_markup: ReplyMarkup | None = None,
+    allow_paid_broadcast: bool | None = None,
+) -> BroadcastSend:
+    async def send(api: ApiMethods, chat_id: ChatId) -> object:
+        return await api.send_message(
+            chat_id,
+            text,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup,
+            allow_paid_broadcast=allow_paid_broadcast,
+        )
+
+    return send
+
+
+def copy_message(
+    from_chat_id: ChatId | str,
+    message_id: MessageId,
+    *,
+    reply_markup: ReplyMarkup | None = None,
+    allow_paid_broadcast: bool | None = None,
+) -> BroadcastSend:
+    async def send(api: ApiMethods, chat_id: ChatId) -> object:
+        return await api.copy_message(
+            chat_id,
+            from_chat_id,
+            message_id,
+            reply_markup=reply_markup,
+            allow_paid_broadcast=allow_paid_broadcast,
+        )
+
+    return send
+
+
+class _BroadcastApi(ApiMethods):
+    def __init__(
+        self, request: RequestCallable[object], safe_request: RequestCallable[object]
+    ) -> None:
+        self._request_callable: Final[RequestCallable[object]] = request
+        self._safe_request_callable: Final[RequestCallable[object]] = safe_request
+
+    @override
+    async def _request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        type_: type[T],
+        **params: ParamType,
+    ) -> T:
+        return cast(
+            T, await self._request_callable(http_method, api_method, type_, **params)
+        )
+
+    @override
+    async def _safe_request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        type_: type[T],
+        **params: ParamType,
+    ) -> T:
+        return cast(
+            T,
+            await self._safe_request_callable(
+                http_method, api_method, chat_id, type_, **params
+            ),
+        )
+
+
+class _Progress(msgspec.Struct, frozen=True):
+    # Items before offset are done, done items up to end are recorded
+    offset: int
+    end: int
+    outcomes: dict[BroadcastOutcome, int]
+
+
+@dataclass
+class BroadcastStats:
+    total: int | None
+    outcomes: dict[BroadcastOutcome, int] = field(
+        default_factory=lambda: dict.fromkeys(BroadcastOutcome, 0)
+    )
+    processed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def done(self) -> int:
+        return sum(self.outcomes.values())
+
+    @property
+    def rate(self) -> float:
+        """Recipients processed per second by this run."""
+        elapsed = time.monotonic() - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float | None:
+        """Seconds left at the current rate, None if unknown."""
+        if self.total is None or self.rate == 0:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+
+class Broadcast:
+    """Send one message to a stream of chats with a pool of workers.
+
+    Outcomes are recorded under ``broadcast|<name>|<chat id>`` and the
+    progress under ``broadcast_progress|<name>`` every
+    ``checkpoint_size`` recipients. Running a broadcast with the same
+    name and source again resumes it and recipients with a stored
+    outcome are not sent to again, so after a crash up to
+    ``checkpoint_size`` recipients sent since the last checkpoint and
+    those in flight can get the message twice. A worker error stops the
+    run and is raised by ``run``.
+    """
+
+    def __init__(
+        self,
+        request: RequestCallable[object],
+        safe_request: RequestCallable[object],
+        storage: StorageProtocol,
+        name: str,
+        chat_ids: ChatIds,
+        send: BroadcastSend,
+        *,
+        total: int | None = None,
+        workers: int = 30,
+        checkpoint_size: int = 100,
+    ) -> None:
+        if workers <= 0:
+            raise ValueError("workers must be positive")
+        if checkpoint_size <= 0:
+            raise ValueError("checkpoint_size must be positive")
+        self._api: Final[ApiMethods] = _BroadcastApi(request, safe_request)
+        self._storage: Final[StorageProtocol] = storage
+        self._name: Final[str] = name
+        self._chat_ids: Final[ChatIds] = chat_ids
+        self._send: Final[BroadcastSend] = send
+        self._workers: Final[int] = workers
+        self._checkpoint_size: Final[int] = checkpoint_size
+        self._progress_key: Final[str] = f"{BROADCAST_PROGRESS_PREFIX}|{name}"
+        self._stats: BroadcastStats = BroadcastStats(total)
+        self._in_flight: Final[set[int]] = set()
+        self._produced: int = 0
+        self._end: int = 0
+        self._recorded: dict[str, Json] = {}
+        self._checkpoint_lock: Final[asyncio.Lock] = asyncio.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def stats(self) -> BroadcastStats:
+        return self._stats
+
+    def _outcome_key(self, chat_id: ChatId) -> str:
+        return f"{BROADCAST_PREFIX}|{self._name}|{chat_id}"
+
+    async def _chat_ids_from(self, offset: int) -> AsyncIterable[tuple[int, ChatId]]:
+        index = 0
+        if isinstance(self._chat_ids, AsyncIterable):
+            async for chat_id in self._chat_ids:
+                if index >= offset:
+                    yield index, chat_id
+                index += 1
+        else:
+            for chat_id in self._chat_ids:
+                if index >= offset:
+                    yield index, chat_id
+                index += 1
+
+    async def run(self) -> BroadcastStats:
+        stored = await self._storage.get(self._progress_key)
+        progress = (
+            msgspec.convert(stored, _Progress)
+            if stored is not None
+            else _Progress(0, 0, dict.fromkeys(BroadcastOutcome, 0))
+        )
+        self._stats = BroadcastStats(self._stats.total, dict(progress.outcomes))
+        self._in_flight.clear()
+        self._produced = progress.offset
+        self._end = resume_end = progress.end
+        queue: asyncio.Queue[tuple[int, ChatId] | None] = asyncio.Queue(
+            self._workers * 2
+        )
+        workers = [
+            asyncio.create_task(self._worker(queue, resume_end))
+            for _ in range(self._workers)
+        ]
+        # Workers only return after the producer, so any done one failed
+        failed: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+        def stop(_: asyncio.Task[None]) -> None:
+            if not failed.done():
+                failed.set_result(None)
+
+        for worker in workers:
+            worker.add_done_callback(stop)
+        try:
+            async for index, chat_id in self._chat_ids_from(progress.offset):
+                self._produced = index + 1
+                self._in_flight.add(index)
+                if not await self._put(queue, (index, chat_id), failed):
+                    break
+            else:
+                for _ in workers:
+                    if not await self._put(queue, None, failed):
+                        break
+            # Raises the error of a failed worker
+            _ = await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                _ = worker.cancel()
+            _ = await asyncio.gather(*workers, return_exceptions=True)
+            await self._checkpoint()
+        return self._stats
+
+    @staticmethod
+    async def _put(
+        queue: asyncio.Queue[tuple[int, ChatId] | None],
+        item: tuple[int, ChatId] | None,
+        failed: asyncio.Future[None],
+    ) -> bool:
+        """Put an item, False when a worker failed before it fit."""
+        if not queue.full():
+            queue.put_nowait(item)
+            return True
+        put = asyncio.ensure_future(queue.put(item))
+        try:
+            _ = await asyncio.wait((put, failed), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            done = put.done()
+            if not done:
+                _ = put.cancel()
+        return done
+
+    async def _worker(
+        self, queue: asyncio.Queue[tuple[int, ChatId] | None], resume_end: int
+    ) -> None:
+        with request_priority(RequestPriority.BULK):
+            while (item := await queue.get()) is not None:
+                index, chat_id = item
+                key = self._outcome_key(chat_id)
+                # Recipients after the stored end have no outcome yet
+                if index >= resume_end or await self._storage.get(key) is None:
+                    outcome = await self._deliver(chat_id)
+                    self._stats.outcomes[outcome] += 1
+                    self._stats.processed += 1
+                    self._recorded[key] = outcome.value
+                self._end = max(self._end, index + 1)
+                self._in_flight.discard(index)
+                if len(self._recorded) >= self._checkpoint_size:
+                    await self._checkpoint()
+
+    async def _deliver(self, chat_id: ChatId) -> BroadcastOutcome:
+        try:
+            try:
+                _ = await self._send(self._api, chat_id)
+            except MigrateToChat as migrate:
+                _ = await self._send(self._api, ChatId(migrate.chat_id))
+        except BotBlocked:
+            return BroadcastOutcome.BLOCKED
+        except BotKicked:
+            return BroadcastOutcome.KICKED
+        except ChatNotFound:
+            return BroadcastOutcome.NOT_FOUND
+        except TelegramError as exception:
+            broadcast_logger.warning(
+                'Broadcast "%s" to chat %s error: %s', self._name, chat_id, exception
+            )
+            return BroadcastOutcome.FAILED
+        return BroadcastOutcome.SENT
+
+    def _transaction(self) -> AbstractAsyncContextManager[None]:
+        if isinstance(self._storage, TransactionalStorageProtocol):
+            return self._storage.transaction()
+        return nullcontext()
+
+    async def _checkpoint(self) -> None:
+        async with self._checkpoint_lock:
+            recorded, self._recorded = self._recorded, {}
+            offset = min(self._in_flight) if self._in_flight else self._produced
+            progress = _Progress(offset, self._end, dict(self._stats.outcomes))
+            items = [
+                *recorded.items(),
+                (self._progress_key, cast(Json, msgspec.to_builtins(progress))),
+            ]
+            try:
+                async with self._transaction():
+                    if isinstance(self._storage, BatchStorageProtocol):
+                        await self._storage.set_many(items)
+                    else:
+                        for key, value in items:
+                            await self._storage.set(key, value)
+            except BaseException:
+                self._recorded = recorded | self._recorded
+                raise
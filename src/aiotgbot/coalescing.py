@@ -0,0 +1,441 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass, field
+from typing import Final, NamedTuple, TypeVar, cast
+
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .api_methods import ApiMethods, ParamType
+from .api_types import (
+    ChatId,
+    InlineKeyboardMarkup,
+    LinkPreviewOptions,
+    Message,
+    MessageEntity,
+    MessageId,
+    MessageThreadId,
+    ReplyMarkup,
+    ReplyParameters,
+    ResponseMessageId,
+)
+from .constants import ParseMode, RequestMethod
+from .exceptions import MessageNotModified, TelegramError
+
+__all__ = ("CoalescingApi",)
+
+COALESCE_DELAY: Final[float] = 0.05
+BULK_LIMIT: Final[int] = 100
+
+T = TypeVar("T")
+
+RequestCallable = Callable[..., Awaitable[T]]
+
+
+class _BatchKey(NamedTuple):
+    api_method: str
+    chat_id: ChatId | str
+    from_chat_id: ChatId | str | None = None
+    message_thread_id: MessageThreadId | None = None
+    disable_notification: bool | None = None
+    protect_content: bool | None = None
+    allow_paid_broadcast: bool | None = None
+
+
+# Inline message id or chat id and message id
+EditKey = str | tuple[ChatId | str, MessageId]
+
+
+class _Edit(NamedTuple):
+    # Markup-only edits have no text
+    text: str | None
+    reply_markup: InlineKeyboardMarkup | None
+    parse_mode: ParseMode | None = None
+    entities: Sequence[MessageEntity] | None = None
+    link_preview_options: LinkPreviewOptions | None = None
+
+    def then(self, edit: "_Edit") -> "_Edit":
+        """Edit with the effect of this one followed by ``edit``."""
+        if edit.text is None:
+            return self._replace(reply_markup=edit.reply_markup)
+        return edit
+
+
+@dataclass
+class _EditSlot:
+    pending: _Edit | None = None
+    waiters: list[asyncio.Future[Message | bool]] = field(default_factory=list)
+    # Content and result of the last edit sent by this slot
+    sent: tuple[_Edit, Message | bool] | None = None
+
+
+class CoalescingApi(ApiMethods):
+    """API methods that merge single message calls into bulk calls.
+
+    ``delete_message``, ``copy_message`` without caption or reply
+    options and ``forward_message_id`` wait up to ``delay`` seconds for
+    calls with the same chat and options, then send up to 100 message
+    ids in one ``deleteMessages``, ``copyMessages`` or
+    ``forwardMessages`` call. When a bulk call fails the messages are
+    sent one by one, so every caller gets its own result. When it skips
+    messages its results can't be matched to callers, and all of them
+    get a ``RuntimeError`` as the other messages were already sent.
+    ``deleteMessages`` skips messages it can't delete and still returns
+    True, so a batched ``delete_message`` returns True where a single
+    call would raise for a missing or undeletable message.
+
+    ``edit_message_text`` and ``edit_message_reply_markup`` keep at most
+    one edit per message in flight. Edits made meanwhile are merged
+    into one, the last one wins and all their callers get its result.
+    Edits that don't change the content sent while edits of the message
+    are in flight are not sent. Later ones are sent, as the message may
+    have been edited elsewhere meanwhile.
+    """
+
+    def __init__(
+        self,
+        request: RequestCallable[object],
+        safe_request: RequestCallable[object],
+        *,
+        delay: float = COALESCE_DELAY,
+    ) -> None:
+        if delay < 0:
+            raise ValueError("delay must not be negative")
+        self._request_callable: Final[RequestCallable[object]] = request
+        self._safe_request_callable: Final[RequestCallable[object]] = safe_request
+        self._delay: Final[float] = delay
+        self._batches: Final[
+            dict[_BatchKey, dict[MessageId, asyncio.Future[object]]]
+        ] = {}
+        self._timers: Final[dict[_BatchKey, asyncio.TimerHandle]] = {}
+        self._tasks: Final[set[asyncio.Task[None]]] = set()
+        self._edits: Final[dict[EditKey, _EditSlot]] = {}
+
+    @override
+    async def _request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        type_: type[T],
+        **params: ParamType,
+    ) -> T:
+        return cast(
+            T, await self._request_callable(http_method, api_method, type_, **params)
+        )
+
+    @override
+    async def _safe_request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        type_: type[T],
+        **params: ParamType,
+    ) -> T:
+        return cast(
+            T,
+            await self._safe_request_callable(
+                http_method, api_method, chat_id, type_, **params
+            ),
+        )
+
+    async def _add(self, key: _BatchKey, message_id: MessageId) -> object:
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = {}
+            self._timers[key] = loop.call_later(self._delay, self._flush, key)
+        future = batch.get(message_id)
+        if future is None:
+            future = batch[message_id] = loop.create_future()
+        if len(batch) >= BULK_LIMIT:
+            self._flush(key)
+        # Callers of the same message share the future
+        return await asyncio.shield(future)
+
+    def _flush(self, key: _BatchKey) -> None:
+        self._timers.pop(key).cancel()
+        batch = self._batches.pop(key)
+        task = asyncio.create_task(self._send(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(
+        self, key: _BatchKey, batch: dict[MessageId, asyncio.Future[object]]
+    ) -> None:
+        message_ids = sorted(batch)
+        try:
+            results = await self._send_batch(key, message_ids)
+            for message_id, result in zip(message_ids, results, strict=True):
+                future = batch[message_id]
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            # Callers must not wait forever when sending was interrupted
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError(f"{key.api_method} of {message_ids} failed")
+                    )
+
+    async def _send_batch(
+        self, key: _BatchKey, message_ids: list[MessageId]
+    ) -> Sequence[object]:
+        if len(message_ids) > 1:
+            try:
+                results = await self._send_bulk(key, message_ids)
+            except TelegramError:
+                pass
+            except Exception as exception:
+                return [exception] * len(message_ids)
+            else:
+                if len(results) == len(message_ids):
+                    return results
+                # Resending would send the copied messages twice
+                error = RuntimeError(
+                    f"{key.api_method}s skipped messages of {message_ids}"
+                )
+                return [error] * len(message_ids)
+        return await asyncio.gather(
+            *(self._send_one(key, message_id) for message_id in message_ids),
+            return_exceptions=True,
+        )
+
+    async def _send_bulk(
+        self, key: _BatchKey, message_ids: list[MessageId]
+    ) -> Sequence[object]:
+        if key.api_method == "deleteMessage":
+            deleted = await self.delete_messages(key.chat_id, message_ids)
+            return [deleted] * len(message_ids)
+        assert key.from_chat_id is not None
+        if key.api_method == "copyMessage":
+            return await self.copy_messages(
+                key.chat_id,
+                key.from_chat_id,
+                message_ids,
+                message_thread_id=key.message_thread_id,
+                disable_notification=key.disable_notification,
+                protect_content=key.protect_content,
+                allow_paid_broadcast=key.allow_paid_broadcast,
+            )
+        return await self.forward_messages(
+            key.chat_id,
+            key.from_chat_id,
+            message_ids,
+            message_thread_id=key.message_thread_id,
+            disable_notification=key.disable_notification,
+            protect_content=key.protect_content,
+        )
+
+    async def _send_one(self, key: _BatchKey, message_id: MessageId) -> object:
+        if key.api_method == "deleteMessage":
+            return await super().delete_message(key.chat_id, message_id)
+        assert key.from_chat_id is not None
+        if key.api_method == "copyMessage":
+            return await super().copy_message(
+                key.chat_id,
+                key.from_chat_id,
+                message_id,
+                message_thread_id=key.message_thread_id,
+                disable_notification=key.disable_notification,
+                protect_content=key.protect_content,
+                allow_paid_broadcast=key.allow_paid_broadcast,
+            )
+        message = await self.forward_message(
+            key.chat_id,
+            key.from_chat_id,
+            message_id,
+            message_thread_id=key.message_thread_id,
+            disable_notification=key.disable_notification,
+            protect_content=key.protect_content,
+        )
+        return ResponseMessageId(message_id=message.message_id)
+
+    @override
+    async def delete_message(
+        self,
+        chat_id: ChatId | str | None = None,
+        message_id: MessageId | None = None,
+    ) -> bool:
+        if chat_id is None or message_id is None:
+            return await super().delete_message(chat_id, message_id)
+        key = _BatchKey("deleteMessage", chat_id)
+        return cast(bool, await self._add(key, message_id))
+
+    @override
+    async def copy_message(
+        self,
+        chat_id: ChatId | str,
+        from_chat_id: ChatId | str,
+        message_id: MessageId,
+        message_thread_id: MessageThreadId | None = None,
+        caption: str | None = None,
+        parse_mode: ParseMode | None = None,
+        caption_entities: Sequence[MessageEntity] | None = None,
+        disable_notification: bool | None = None,
+        protect_content: bool | None = None,
+        allow_paid_broadcast: bool | None = None,
+        reply_parameters: ReplyParameters | None = None,
+        reply_markup: ReplyMarkup | None = None,
+    ) -> ResponseMessageId:
+        options = (caption, parse_mode, caption_entities, reply_parameters)
+        if reply_markup is not None or any(option is not None for option in options):
+            # copyMessages has no per-message options
+            return await super().copy_message(
+                chat_id,
+                from_chat_id,
+                message_id,
+                message_thread_id,
+                caption,
+                parse_mode,
+                caption_entities,
+                disable_notification,
+                protect_content,
+                allow_paid_broadcast,
+                reply_parameters,
+                reply_markup,
+            )
+        key = _BatchKey(
+            "copyMessage",
+            chat_id,
+            from_chat_id,
+            message_thread_id,
+            disable_notification,
+            protect_content,
+            allow_paid_broadcast,
+        )
+        return cast(ResponseMessageId, await self._add(key, message_id))
+
+    async def forward_message_id(
+        self,
+        chat_id: ChatId | str,
+        from_chat_id: ChatId | str,
+        message_id: MessageId,
+        message_thread_id: MessageThreadId | None = None,
+        disable_notification: bool | None = None,
+        protect_content: bool | None = None,
+    ) -> ResponseMessageId:
+        """Coalesced ``forward_message`` returning the new message id.
+
+        ``forwardMessages`` returns only ids, so ``forward_message``
+        itself, which returns the message, is never coalesced.
+        """
+        key = _BatchKey(
+            "forwardMessage",
+            chat_id,
+            from_chat_id,
+            message_thread_id,
+            disable_notification,
+            protect_content,
+        )
+        return cast(ResponseMessageId, await self._add(key, message_id))
+
+    @staticmethod
+    def _edit_key(
+        chat_id: ChatId | str | None,
+        message_id: MessageId | None,
+        inline_message_id: str | None,
+    ) -> EditKey:
+        if inline_message_id is not None:
+            return inline_message_id
+        if chat_id is None or message_id is None:
+            raise RuntimeError(
+                "chat_id and message_id are required when inline_message_id is None"
+            )
+        return chat_id, message_id
+
+    async def _edit(self, key: EditKey, edit: _Edit) -> Message | bool:
+        slot = self._edits.get(key)
+        if slot is None:
+            slot = self._edits[key] = _EditSlot()
+            task = asyncio.create_task(self._send_edits(key, slot))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        slot.pending = edit if slot.pending is None else slot.pending.then(edit)
+        future = asyncio.get_running_loop().create_future()
+        slot.waiters.append(future)
+        return await asyncio.shield(future)
+
+    async def _send_edits(self, key: EditKey, slot: _EditSlot) -> None:
+        try:
+            while slot.pending is not None:
+                edit, waiters = slot.pending, slot.waiters
+                slot.pending, slot.waiters = None, []
+                try:
+                    result = await self._send_edit(key, slot, edit)
+                except Exception as exception:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(exception)
+                    continue
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(result)
+        finally:
+            del self._edits[key]
+
+    async def _send_edit(
+        self, key: EditKey, slot: _EditSlot, edit: _Edit
+    ) -> Message | bool:
+        sent = slot.sent
+        content = edit if sent is None else sent[0].then(edit)
+        if sent is not None and content == sent[0]:
+            return sent[1]
+        inline_message_id = key if isinstance(key, str) else None
+        chat_id, message_id = (None, None) if isinstance(key, str) else key
+        try:
+            if edit.text is None:
+                result = await super().edit_message_reply_markup(
+                    chat_id, message_id, inline_message_id, edit.reply_markup
+                )
+            else:
+                result = await super().edit_message_text(
+                    edit.text,
+                    chat_id,
+                    message_id,
+                    inline_message_id,
+                    edit.parse_mode,
+                    edit.entities,
+                    edit.link_preview_options,
+                    edit.reply_markup,
+                )
+        except MessageNotModified:
+            result = sent[1] if sent is not None else True
+        slot.sent = content, result
+        return result
+
+    @override
+    async def edit_message_text(
+        self,
+        text: str,
+        chat_id: ChatId | str | None = None,
+        message_id: MessageId | None = None,
+        inline_message_id: str | None = None,
+        parse_mode: ParseMode | None = None,
+        entities: Sequence[MessageEntity] | None = None,
+        link_preview_options: LinkPreviewOptions | None = None,
+        reply_markup: InlineKeyboardMarkup | None = None,
+    ) -> Message | bool:
+        key = self._edit_key(chat_id, message_id, inline_message_id)
+        edit = _Edit(text, reply_markup, parse_mode, entities, link_preview_options)
+        return await self._edit(key, edit)
+
+    @override
+    async def edit_message_reply_markup(
+        self,
+        chat_id: ChatId | str | None = None,
+        message_id: MessageId | None = None,
+        inline_message_id: str | None = None,
+        reply_markup: InlineKeyboardMarkup | None = None,
+    ) -> Message | bool:
+        key = self._edit_key(chat_id, message_id, inline_message_id)
+        return await self._edit(key, _Edit(None, reply_markup))
+
+    async def flush(self) -> None:
+        """Send pending calls now and wait until they are sent."""
+        for key in list(self._batches):
+            self._flush(key)
+        _ = await asyncio.gather(*self._tasks, return_exceptions=True)
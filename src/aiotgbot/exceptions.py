@@ -5,6 +5,7 @@ __all__ = (
     "BotBlocked",
     "BotKicked",
     "ChatNotFound",
+    "MessageNotModified",
     "MigrateToChat",
     "RestartingTelegram",
     "RetryAfter",
@@ -55,3 +56,7 @@ class BotKicked(TelegramError):  # noqa: N818 - Telegram API naming
 
 class ChatNotFound(TelegramError):  # noqa: N818 - Telegram API naming
     pattern: ClassVar[str | None] = "chat not found"
+
+
+class MessageNotModified(TelegramError):  # noqa: N818 - Telegram API naming
+    pattern: ClassVar[str | None] = "message is not modified"
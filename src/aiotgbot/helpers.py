@@ -1,5 +1,8 @@
 import asyncio
-from collections.abc import AsyncIterator, Hashable
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections.abc import AsyncIterator, Hashable, Iterable
 from contextlib import asynccontextmanager
 from typing import Final
 from weakref import WeakValueDictionary
@@ -13,11 +16,16 @@ __all__ = (
     "BotKey",
     "Json",
     "KeyLock",
+    "SortedKeys",
+    "expiry_time",
     "get_python_version",
     "get_software",
     "json_dumps",
+    "prefix_successor",
 )
 
+SORTED_CHUNK_SIZE: Final[int] = 256
+
 Json = str | int | float | bool | dict[str, "Json"] | list["Json"] | None
 
 
@@ -25,6 +33,25 @@ def json_dumps(obj: Json) -> str:
     return msgspec.json.encode(obj).decode()
 
 
+def expiry_time(ttl: float | None) -> float | None:
+    if ttl is None:
+        return None
+    if ttl <= 0:
+        raise ValueError("ttl must be positive")
+    return time.time() + ttl
+
+
+def prefix_successor(prefix: str) -> str | None:
+    """Return the least string above every string with the prefix."""
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if len(stripped) == 0:
+        return None
+    code_point = ord(stripped[-1]) + 1
+    if 0xD800 <= code_point <= 0xDFFF:
+        code_point = 0xE000
+    return stripped[:-1] + chr(code_point)
+
+
 def get_python_version() -> str:
     from sys import version_info as version
 
@@ -52,4 +79,107 @@ class KeyLock:
             yield
 
 
+class SortedKeys:
+    """Sorted set of keys kept in chunks of bounded size.
+
+    Adding or removing a key bisects the chunk maxima and shifts only
+    one chunk, so updates cost O(log n + SORTED_CHUNK_SIZE) instead of
+    O(n) for a single sorted list.
+    """
+
+    def __init__(self, keys: Iterable[str] = ()) -> None:
+        self._chunks: list[list[str]] = []
+        self._maxima: list[str] = []
+        self._size: int = 0
+        self.reset(keys)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, key: str) -> bool:
+        index = bisect_left(self._maxima, key)
+        if index == len(self._chunks):
+            return False
+        chunk = self._chunks[index]
+        return chunk[bisect_left(chunk, key)] == key
+
+    def reset(self, keys: Iterable[str]) -> None:
+        ordered = sorted(set(keys))
+        self._chunks = [
+            ordered[index : index + SORTED_CHUNK_SIZE]
+            for index in range(0, len(ordered), SORTED_CHUNK_SIZE)
+        ]
+        self._maxima = [chunk[-1] for chunk in self._chunks]
+        self._size = len(ordered)
+
+    def clear(self) -> None:
+        self.reset(())
+
+    def add(self, key: str) -> None:
+        if len(self._chunks) == 0:
+            self._chunks.append([key])
+            self._maxima.append(key)
+            self._size = 1
+            return
+        index = min(bisect_left(self._maxima, key), len(self._chunks) - 1)
+        chunk = self._chunks[index]
+        position = bisect_left(chunk, key)
+        if position < len(chunk) and chunk[position] == key:
+            return
+        chunk.insert(position, key)
+        self._maxima[index] = chunk[-1]
+        self._size += 1
+        if len(chunk) > 2 * SORTED_CHUNK_SIZE:
+            half = len(chunk) // 2
+            self._chunks[index : index + 1] = [chunk[:half], chunk[half:]]
+            self._maxima[index : index + 1] = [chunk[half - 1], chunk[-1]]
+
+    def discard(self, key: str) -> None:
+        index = bisect_left(self._maxima, key)
+        if index == len(self._chunks):
+            return
+        chunk = self._chunks[index]
+        position = bisect_left(chunk, key)
+        if chunk[position] != key:
+            return
+        del chunk[position]
+        self._size -= 1
+        if len(chunk) == 0:
+            del self._chunks[index]
+            del self._maxima[index]
+        else:
+            self._maxima[index] = chunk[-1]
+
+    def page(self, prefix: str, start_after: str | None, limit: int) -> list[str]:
+        """Return up to ``limit`` keys with the prefix after a key."""
+        if start_after is not None and start_after >= prefix:
+            index = bisect_right(self._maxima, start_after)
+            position = (
+                bisect_right(self._chunks[index], start_after)
+                if index < len(self._chunks)
+                else 0
+            )
+        else:
+            index = bisect_left(self._maxima, prefix)
+            position = (
+                bisect_left(self._chunks[index], prefix)
+                if index < len(self._chunks)
+                else 0
+            )
+        successor = prefix_successor(prefix)
+        keys: list[str] = []
+        while index < len(self._chunks) and len(keys) < limit:
+            chunk = self._chunks[index]
+            end = min(len(chunk), position + limit - len(keys))
+            if successor is not None and chunk[end - 1] >= successor:
+                keys.extend(
+                    chunk[position : bisect_left(chunk, successor, position, end)]
+                )
+                break
+            keys.extend(chunk[position:end])
+            index += 1
+            position = 0
+        return keys
+
+
 BotKey = web.AppKey
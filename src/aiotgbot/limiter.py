@@ -0,0 +1,254 @@
+import asyncio
+import heapq
+import inspect
+import time
+from collections.abc import AsyncIterator, Hashable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Final
+
+from aiofreqlimit import FreqLimitBackend, FreqLimitParams, gcra_step
+
+from .storage import AtomicStorageProtocol, StorageProtocol
+
+__all__ = (
+    "CHAT_LIMIT_PARAMS",
+    "DEFAULT_LIMIT_PROFILE",
+    "GROUP_LIMIT_PARAMS",
+    "MESSAGE_LIMIT_PARAMS",
+    "PAID_BROADCAST_LIMIT_PROFILE",
+    "AdaptiveLimit",
+    "LimitProfile",
+    "MemoryLimitBackend",
+    "StorageLimitBackend",
+)
+
+
+MESSAGE_LIMIT_PARAMS: Final[FreqLimitParams] = FreqLimitParams(
+    limit=30,
+    period=1.0,
+)
+CHAT_LIMIT_PARAMS: Final[FreqLimitParams] = FreqLimitParams(
+    limit=1,
+    period=1.0,
+)
+GROUP_LIMIT_PARAMS: Final[FreqLimitParams] = FreqLimitParams(
+    limit=20,
+    period=60.0,
+)
+
+
+@dataclass(frozen=True, slots=True)
+class LimitProfile:
+    """Rate limits of outgoing chat calls."""
+
+    message: FreqLimitParams
+    chat: FreqLimitParams
+    group: FreqLimitParams
+
+
+DEFAULT_LIMIT_PROFILE: Final[LimitProfile] = LimitProfile(
+    message=MESSAGE_LIMIT_PARAMS,
+    chat=CHAT_LIMIT_PARAMS,
+    group=GROUP_LIMIT_PARAMS,
+)
+# Bots with paid broadcasts enabled may send up to 1000 messages per
+# second, the send calls must pass allow_paid_broadcast=True, as
+# send_text and copy_message of aiotgbot.broadcast do when asked
+PAID_BROADCAST_LIMIT_PROFILE: Final[LimitProfile] = LimitProfile(
+    message=FreqLimitParams(limit=1000, period=1.0),
+    chat=CHAT_LIMIT_PARAMS,
+    group=GROUP_LIMIT_PARAMS,
+)
+
+
+class AdaptiveLimit:
+    """GCRA rate limit tuned by ``RetryAfter`` feedback.
+
+    ``backoff`` pauses every caller of the key, or of all keys when the
+    key is None, for the retry delay and cuts the rate by
+    ``decrease``. Every ``success`` raises the rate again so that it
+    grows by ``increase`` of the configured rate per period at full
+    speed, never above the configured rate. Pauses and the rate factor
+    are kept in the process, the GCRA state in the backend.
+    """
+
+    def __init__(
+        self,
+        params: FreqLimitParams,
+        *,
+        backend: FreqLimitBackend,
+        name: str | None = None,
+        decrease: float = 0.5,
+        increase: float = 0.05,
+        min_factor: float = 0.05,
+    ) -> None:
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        if increase <= 0:
+            raise ValueError("increase must be positive")
+        if not 0 < min_factor <= 1:
+            raise ValueError("min_factor must be between 0 and 1")
+        self._params: Final[FreqLimitParams] = params
+        self._backend: Final[FreqLimitBackend] = backend
+        self._name: Final[str | None] = name
+        self._decrease: Final[float] = decrease
+        self._increase: Final[float] = increase
+        self._min_factor: Final[float] = min_factor
+        self._factor: float = 1.0
+        self._effective: FreqLimitParams = params
+        self._paused_until: Final[dict[Hashable | None, float]] = {}
+
+    @property
+    def params(self) -> FreqLimitParams:
+        return self._params
+
+    @property
+    def backend(self) -> FreqLimitBackend:
+        return self._backend
+
+    @property
+    def factor(self) -> float:
+        """Fraction of the configured rate currently allowed."""
+        return self._factor
+
+    def _set_factor(self, factor: float) -> None:
+        self._factor = min(max(factor, self._min_factor), 1.0)
+        self._effective = FreqLimitParams(
+            limit=self._params.limit,
+            period=self._params.period / self._factor,
+            burst=self._params.burst,
+        )
+
+    def _pause_left(self, key: Hashable | None, now: float) -> float:
+        left = 0.0
+        for scope in (key, None):
+            paused_until = self._paused_until.get(scope)
+            if paused_until is None:
+                continue
+            if paused_until <= now:
+                del self._paused_until[scope]
+            else:
+                left = max(left, paused_until - now)
+        return left
+
+    async def _wait_pause(self, key: Hashable | None) -> None:
+        loop = asyncio.get_running_loop()
+        while (pause := self._pause_left(key, loop.time())) > 0:
+            await asyncio.sleep(pause)
+
+    @asynccontextmanager
+    async def resource(self, key: Hashable | None = None) -> AsyncIterator[None]:
+        await self._wait_pause(key)
+        # Named limits can share one backend
+        backend_key = key if self._name is None else f"{self._name}|{key}"
+        loop = asyncio.get_running_loop()
+        delay = await self._backend.reserve(backend_key, loop.time(), self._effective)
+        if delay > 0:
+            await asyncio.sleep(delay)
+            # A pause may have started while this caller was waiting
+            await self._wait_pause(key)
+        yield
+
+    def backoff(self, key: Hashable | None, retry_after: float) -> None:
+        now = asyncio.get_running_loop().time()
+        # Callers sent before the pause get their 429 during it, count
+        # them all as one decrease
+        paused = self._pause_left(key, now) > 0
+        for scope in list(self._paused_until):
+            _ = self._pause_left(scope, now)
+        self._paused_until[key] = max(
+            self._paused_until.get(key, now), now + retry_after
+        )
+        if not paused:
+            self._set_factor(self._factor * self._decrease)
+
+    def success(self) -> None:
+        if self._factor < 1.0:
+            self._set_factor(self._factor + self._increase / self._params.limit)
+
+    async def clear(self) -> None:
+        self._paused_until.clear()
+        self._set_factor(1.0)
+        clear = getattr(self._backend, "clear", None)
+        if clear is None:
+            return
+        result = clear()
+        if inspect.isawaitable(result):
+            await result
+
+
+class MemoryLimitBackend(FreqLimitBackend):
+    """GCRA state of one process, dropped once it can't delay anyone.
+
+    A key whose theoretical arrival time has passed reserves exactly
+    like a new key, so it is removed. Expiry times are kept in a heap
+    and removed on every reservation, keeping memory proportional to
+    the keys used within their last period.
+    """
+
+    def __init__(self) -> None:
+        self._tat: Final[dict[Hashable, float]] = {}
+        self._expiry: Final[list[tuple[float, int, Hashable]]] = []
+        # Tie breaker, keys may not be comparable
+        self._counter: int = 0
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def _evict(self, now: float) -> None:
+        while len(self._expiry) > 0 and self._expiry[0][0] <= now:
+            _, _, key = heapq.heappop(self._expiry)
+            # Stale entry when the key was reserved again since
+            tat = self._tat.get(key)
+            if tat is not None and tat <= now:
+                del self._tat[key]
+
+    async def reserve(
+        self, key: Hashable, now: float, params: FreqLimitParams
+    ) -> float:
+        self._evict(now)
+        new_tat, delay = gcra_step(now, self._tat.get(key), params)
+        self._tat[key] = new_tat
+        self._counter += 1
+        heapq.heappush(self._expiry, (new_tat, self._counter, key))
+        return delay
+
+    async def clear(self) -> None:
+        self._tat.clear()
+        self._expiry.clear()
+
+
+class StorageLimitBackend(FreqLimitBackend):
+    """GCRA state kept in a storage shared by several processes.
+
+    The theoretical arrival time of every key is a ``<prefix>|<key>``
+    value updated with ``compare_and_set``, so processes sending with
+    one token share its limits. Times are wall clock, the loop time
+    passed to ``reserve`` is not comparable between processes. Values
+    expire once they no longer delay anyone.
+    """
+
+    def __init__(self, storage: StorageProtocol, *, prefix: str = "freq_limit") -> None:
+        if not isinstance(storage, AtomicStorageProtocol):
+            raise TypeError(
+                f"{type(storage).__name__} does not support atomic operations"
+            )
+        self._storage: Final[StorageProtocol] = storage
+        self._atomic: Final[AtomicStorageProtocol] = storage
+        self._prefix: Final[str] = prefix
+
+    async def reserve(
+        self, key: Hashable, now: float, params: FreqLimitParams
+    ) -> float:
+        storage_key = f"{self._prefix}|{key}"
+        while True:
+            stored = await self._storage.get(storage_key)
+            current = time.time()
+            tat = float(stored) if isinstance(stored, int | float) else None
+            new_tat, delay = gcra_step(current, tat, params)
+            ttl = new_tat - current + params.interval
+            if await self._atomic.compare_and_set(
+                storage_key, stored, new_tat, ttl=ttl
+            ):
+                return delay
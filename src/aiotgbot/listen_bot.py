@@ -1,11 +1,13 @@
 import asyncio
 import logging
 from collections.abc import Iterable, Mapping
+from contextlib import suppress
 from ipaddress import IPv4Address, IPv4Network
 from secrets import compare_digest, token_urlsafe
 from typing import Final, TypedDict, Unpack
 
 import msgspec.json
+from aiofreqlimit import FreqLimitBackend
 from aiohttp import ClientSession
 from aiohttp.typedefs import Middleware
 from aiohttp.web import (
@@ -22,12 +24,16 @@ from yarl import URL
 
 from .api_types import InputFile, Update
 from .bot import Bot, HandlerTableProtocol
+from .limiter import DEFAULT_LIMIT_PROFILE, LimitProfile
+from .lock import LockProviderProtocol
 from .storage import StorageProtocol
+from .storage_queue import QueueItem, StorageQueue
 
 NETWORKS: Final[tuple[IPv4Network, ...]] = (
     IPv4Network("149.154.160.0/20"),
     IPv4Network("91.108.4.0/22"),
 )
+INBOX_POLL_INTERVAL: Final[float] = 1.0
 
 bot_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.bot")
 
@@ -59,6 +65,18 @@ class ListenBot(Bot):
         check_address: bool = False,
         address_header: str | None = None,
         client_session: ClientSession | None = None,
+        *,
+        state_ttl: float | None = None,
+        state_index: bool = False,
+        lock_provider: LockProviderProtocol | None = None,
+        inbox: StorageQueue | None = None,
+        inbox_workers: int = 4,
+        outbox: StorageQueue | None = None,
+        outbox_workers: int = 4,
+        limit_profile: LimitProfile = DEFAULT_LIMIT_PROFILE,
+        limit_backend: FreqLimitBackend | None = None,
+        unreachable_cache: bool = False,
+        unreachable_ttl: float | None = None,
         **application_args: Unpack[ApplicationKwargs],
     ) -> None:
         super().__init__(
@@ -66,13 +84,29 @@ class ListenBot(Bot):
             handler_table,
             storage,
             client_session,
+            state_ttl=state_ttl,
+            state_index=state_index,
+            lock_provider=lock_provider,
+            outbox=outbox,
+            outbox_workers=outbox_workers,
+            limit_profile=limit_profile,
+            limit_backend=limit_backend,
+            unreachable_cache=unreachable_cache,
+            unreachable_ttl=unreachable_ttl,
         )
+        if inbox_workers <= 0:
+            raise ValueError("inbox_workers must be positive")
         self._url: URL = URL(url) if isinstance(url, str) else url
         self._certificate = certificate
         self._ip_address = ip_address
         self._webhook_token = None
         self._check_address: Final[bool] = check_address
         self._address_header: Final[str | None] = address_header
+        self._inbox: Final[StorageQueue | None] = inbox
+        if inbox is not None:
+            self._expiring.append(inbox.storage)
+        self._inbox_workers: Final[int] = inbox_workers
+        self._inbox_tasks: list[asyncio.Task[None]] = []
         self._application = Application(**application_args)
         _ = self._application.router.add_post("/{token}", self._handler)  # noqa: RUF027
 
@@ -98,15 +132,65 @@ class ListenBot(Bot):
             raise HTTPNotFound()
         update_data = await request.read()
         update = msgspec.json.decode(update_data, type=Update)
-        _ = await self._scheduler.spawn(self._handle_update(update))
+        if self._inbox is not None:
+            _ = await self._inbox.put(update_data.decode())
+        else:
+            _ = await self._scheduler.spawn(self._handle_update(update))
         return Response()
 
+    async def _inbox_worker(self, inbox: StorageQueue) -> None:
+        while True:
+            try:
+                item = await inbox.claim()
+            except Exception:
+                bot_logger.exception("Inbox claim error")
+                await asyncio.sleep(INBOX_POLL_INTERVAL)
+                continue
+            if item is None:
+                await inbox.wait(INBOX_POLL_INTERVAL)
+                continue
+            renew_task = asyncio.create_task(self._renew_inbox_lease(inbox, item))
+            try:
+                assert isinstance(item.data, str)
+                await self._handle_update(msgspec.json.decode(item.data, type=Update))
+            except asyncio.CancelledError:
+                await inbox.release(item)
+                raise
+            except Exception:
+                bot_logger.exception("Update handle error")
+            finally:
+                _ = renew_task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await renew_task
+            try:
+                await inbox.ack(item)
+            except Exception:
+                bot_logger.exception("Inbox ack error")
+
+    @staticmethod
+    async def _renew_inbox_lease(inbox: StorageQueue, item: QueueItem) -> None:
+        while True:
+            await asyncio.sleep(inbox.lease_ttl / 3)
+            try:
+                renewed = await inbox.renew(item)
+            except Exception:
+                bot_logger.exception('Inbox lease of "%s" renew error', item.key)
+                continue
+            if not renewed:
+                bot_logger.warning('Inbox lease of "%s" lost', item.key)
+                return
+
     @override
     async def start(self) -> None:
         if self._started:
             raise RuntimeError("Polling already started")
         await self._start()
         assert self._me is not None
+        if self._inbox is not None:
+            self._inbox_tasks = [
+                asyncio.create_task(self._inbox_worker(self._inbox))
+                for _ in range(self._inbox_workers)
+            ]
         loop = asyncio.get_running_loop()
         self._webhook_token = await loop.run_in_executor(None, token_urlsafe)
         assert isinstance(self._webhook_token, str)
@@ -127,6 +211,10 @@ class ListenBot(Bot):
         assert self._me is not None
         self._stopped = True
         _ = await self.delete_webhook()
+        for task in self._inbox_tasks:
+            _ = task.cancel()
+        _ = await asyncio.gather(*self._inbox_tasks, return_exceptions=True)
+        self._inbox_tasks = []
         await self._cleanup()
         bot_logger.info(
             "Bot %s (%s) stop listen",
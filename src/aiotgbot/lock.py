@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import uuid
+from collections.abc import AsyncIterator
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import Any, Final, Protocol, runtime_checkable
+
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .helpers import KeyLock
+from .storage import AtomicStorageProtocol
+
+__all__ = ("LockLostError", "LockProviderProtocol", "StorageLock")
+
+lock_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.lock")
+
+
+@runtime_checkable
+class LockProviderProtocol(Protocol):
+    """Mutual exclusion by key.
+
+    The context manager yields a fencing token, a number that grows with
+    every acquisition of the key, or None when the lock cannot be lost
+    while held, as with the in-process ``KeyLock``.
+    """
+
+    def resource(self, key: str) -> AbstractAsyncContextManager[int | None]: ...
+
+
+class LockLostError(RuntimeError):
+    """The lease of a held lock expired or was taken over."""
+
+
+class StorageLock(LockProviderProtocol):
+    """Lease lock kept in a storage shared by several processes.
+
+    The lease is a ``<prefix>|<key>`` value with a TTL, renewed while
+    the lock is held. The fencing token is a ``<prefix>_fence|<key>``
+    counter incremented on every acquisition, so a holder whose lease
+    expired has a smaller token than the next holder. When renewal
+    fails, the holder task is cancelled and the context manager raises
+    ``LockLostError``.
+    """
+
+    def __init__(
+        self,
+        storage: AtomicStorageProtocol,
+        *,
+        ttl: float = 30.0,
+        retry_interval: float = 0.05,
+        prefix: str = "lock",
+    ) -> None:
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        if retry_interval <= 0:
+            raise ValueError("retry_interval must be positive")
+        self._storage: Final[AtomicStorageProtocol] = storage
+        self._ttl: Final[float] = ttl
+        self._retry_interval: Final[float] = retry_interval
+        self._prefix: Final[str] = prefix
+        self._local_lock: Final[KeyLock] = KeyLock()
+
+    async def _renew(
+        self, lease_key: str, owner: str, holder: asyncio.Task[Any]
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + self._ttl
+        while True:
+            await asyncio.sleep(self._ttl / 3)
+            started_at = loop.time()
+            try:
+                renewed = await self._storage.compare_and_set(
+                    lease_key, owner, owner, ttl=self._ttl
+                )
+            except Exception:
+                lock_logger.exception('Lease "%s" renew error', lease_key)
+                if loop.time() < expires_at:
+                    continue
+                renewed = False
+            if not renewed:
+                lock_logger.warning('Lease "%s" lost', lease_key)
+                _ = holder.cancel()
+                return
+            expires_at = started_at + self._ttl
+
+    @override
+    @asynccontextmanager
+    async def resource(self, key: str) -> AsyncIterator[int]:
+        lease_key = f"{self._prefix}|{key}"
+        owner = uuid.uuid4().hex
+        holder = asyncio.current_task()
+        assert holder is not None
+        # Waiters of this process queue locally instead of polling
+        async with self._local_lock.resource(key):
+            while not await self._storage.compare_and_set(
+                lease_key, None, owner, ttl=self._ttl
+            ):
+                await asyncio.sleep(self._retry_interval)
+            renew_task: asyncio.Task[None] | None = None
+            try:
+                token = await self._storage.incr(f"{self._prefix}_fence|{key}")
+                renew_task = asyncio.create_task(self._renew(lease_key, owner, holder))
+                yield token
+            except asyncio.CancelledError:
+                # Only a lost lease ends the renew task
+                if (
+                    renew_task is not None
+                    and renew_task.done()
+                    and holder.uncancel() == 0
+                ):
+                    raise LockLostError(f'Lease "{lease_key}" lost') from None
+                raise
+            finally:
+                lost = False
+                if renew_task is not None:
+                    lost = renew_task.done()
+                    _ = renew_task.cancel()
+                    _ = await asyncio.wait((renew_task,))
+                if not lost:
+                    _ = await self._storage.compare_and_set(
+                        lease_key, owner, None, ttl=self._ttl
+                    )
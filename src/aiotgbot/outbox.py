@@ -0,0 +1,316 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from contextlib import suppress
+from typing import Final, TypeVar, cast
+
+import msgspec.json
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .api_methods import ApiMethods, ParamType
+from .api_types import APIResponse, ChatId, InputFile, ResponseParameters
+from .constants import RequestMethod
+from .exceptions import MigrateToChat, RetryAfter, TelegramError
+from .helpers import Json
+from .storage_queue import QueueItem, StorageQueue
+
+__all__ = ("Outbox",)
+
+OUTBOX_POLL_INTERVAL: Final[float] = 1.0
+RESULT_TTL: Final[float] = 600.0
+
+outbox_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.outbox")
+
+T = TypeVar("T")
+
+
+class _Request(msgspec.Struct, frozen=True):
+    http_method: RequestMethod
+    api_method: str
+    chat_id: ChatId | str
+    params: dict[str, str]
+    wait: bool
+
+
+class _Result(msgspec.Struct, frozen=True, omit_defaults=True):
+    result: str | None = None
+    error_code: int | None = None
+    description: str | None = None
+    retry_after: int | None = None
+    migrate_to_chat_id: ChatId | None = None
+    error: str | None = None
+
+
+RequestCallable = Callable[..., Awaitable[T]]
+DeliverCallable = Callable[
+    [RequestMethod, str, ChatId | str, dict[str, ParamType]],
+    Awaitable[msgspec.Raw],
+]
+ExceptionCallable = Callable[[APIResponse], TelegramError]
+
+
+class _OutboxApi(ApiMethods):
+    def __init__(self, outbox: "Outbox", request: RequestCallable[object]) -> None:
+        self._outbox: Final[Outbox] = outbox
+        self._request_callable: Final[RequestCallable[object]] = request
+
+    @override
+    async def _request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        type_: type[T],
+        **params: ParamType,
+    ) -> T:
+        return cast(
+            T, await self._request_callable(http_method, api_method, type_, **params)
+        )
+
+    @override
+    async def _safe_request(
+        self,
+        http_method: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        type_: type[T],
+        **params: ParamType,
+    ) -> T:
+        return await self._outbox.request(
+            api_method, chat_id, type_, http_method=http_method, **params
+        )
+
+
+class Outbox:
+    """Durable queue of outgoing API calls.
+
+    Calls are stored in a ``StorageQueue`` and sent by worker tasks
+    through the bot rate limiters, so calls still pending on shutdown
+    are sent after a restart by this or another process. A caller
+    awaiting a call sent by another process gets its result from a
+    result key kept for ``RESULT_TTL`` seconds, and Telegram errors are
+    rebuilt by ``exception`` from the stored response. Calls with files
+    can't be stored.
+    """
+
+    def __init__(
+        self,
+        queue: StorageQueue,
+        request: RequestCallable[object],
+        deliver: DeliverCallable,
+        exception: ExceptionCallable,
+        *,
+        workers: int = 4,
+        request_timeout: float = RESULT_TTL,
+    ) -> None:
+        if workers <= 0:
+            raise ValueError("workers must be positive")
+        if request_timeout <= 0:
+            raise ValueError("request_timeout must be positive")
+        self._queue: Final[StorageQueue] = queue
+        self._deliver: Final[DeliverCallable] = deliver
+        self._exception: Final[ExceptionCallable] = exception
+        self._workers: Final[int] = workers
+        self._request_timeout: Final[float] = request_timeout
+        self._api: Final[ApiMethods] = _OutboxApi(self, request)
+        self._waiters: Final[dict[str, asyncio.Future[msgspec.Raw]]] = {}
+        self._tasks: list[asyncio.Task[None]] = []
+
+    @property
+    def api(self) -> ApiMethods:
+        """API methods that send chat calls through the outbox."""
+        return self._api
+
+    def _result_key(self, item_key: str) -> str:
+        return f"{self._queue.name}|result|{item_key.rsplit('|', 1)[-1]}"
+
+    async def _put(
+        self,
+        api_method: str,
+        chat_id: ChatId | str,
+        http_method: RequestMethod,
+        params: dict[str, ParamType],
+        *,
+        wait: bool,
+    ) -> str:
+        stored: dict[str, str] = {}
+        for name, value in params.items():
+            if isinstance(value, InputFile):
+                raise TypeError("Files can't be sent through the outbox")
+            if value is not None:
+                stored[name] = value if isinstance(value, str) else str(value)
+        request = _Request(http_method, api_method, chat_id, stored, wait)
+        data = cast(Json, msgspec.to_builtins(request))
+        return await self._queue.put(data)
+
+    async def enqueue(
+        self,
+        api_method: str,
+        chat_id: ChatId | str,
+        *,
+        http_method: RequestMethod = RequestMethod.POST,
+        **params: ParamType,
+    ) -> str:
+        """Store a call to send later and return its queue key."""
+        return await self._put(api_method, chat_id, http_method, params, wait=False)
+
+    async def request(
+        self,
+        api_method: str,
+        chat_id: ChatId | str,
+        type_: type[T],
+        *,
+        http_method: RequestMethod = RequestMethod.POST,
+        **params: ParamType,
+    ) -> T:
+        """Store a call and wait until it is sent.
+
+        Raises ``TimeoutError`` when the call is not sent within
+        ``request_timeout`` seconds, though it stays queued and is sent
+        later, and ``RuntimeError`` when it was sent by another process
+        and its result has expired.
+        """
+        key = await self._put(api_method, chat_id, http_method, params, wait=True)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._request_timeout
+        future = loop.create_future()
+        self._waiters[key] = future
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError(f'Outbox item "{key}" was not sent in time')
+                try:
+                    raw = await asyncio.wait_for(
+                        asyncio.shield(future), min(OUTBOX_POLL_INTERVAL, remaining)
+                    )
+                except TimeoutError:
+                    # The item is acked after its result is stored
+                    pending = await self._queue.storage.get(key)
+                    stored = await self._queue.storage.get(self._result_key(key))
+                    if stored is not None:
+                        raw = self._unpack(msgspec.convert(stored, _Result))
+                    elif pending is None and not future.done():
+                        raise RuntimeError(
+                            f'Outbox item "{key}" was sent, its result is lost'
+                        ) from None
+                    else:
+                        continue
+                return msgspec.json.decode(raw, type=type_)
+        finally:
+            del self._waiters[key]
+
+    def _unpack(self, result: _Result) -> msgspec.Raw:
+        if result.result is not None:
+            return msgspec.Raw(result.result.encode())
+        if result.error_code is not None and result.description is not None:
+            raise self._exception(
+                APIResponse(
+                    ok=False,
+                    error_code=result.error_code,
+                    description=result.description,
+                    parameters=ResponseParameters(
+                        migrate_to_chat_id=result.migrate_to_chat_id,
+                        retry_after=result.retry_after,
+                    ),
+                )
+            )
+        raise RuntimeError(f"Outbox delivery error: {result.error}")
+
+    async def start(self) -> None:
+        if len(self._tasks) > 0:
+            raise RuntimeError("Outbox already started")
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self._workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            _ = task.cancel()
+        _ = await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                item = await self._queue.claim()
+            except Exception:
+                outbox_logger.exception("Outbox claim error")
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+                continue
+            if item is None:
+                await self._queue.wait(OUTBOX_POLL_INTERVAL)
+                continue
+            try:
+                await self._send(item)
+            except asyncio.CancelledError:
+                await self._queue.release(item)
+                raise
+            except Exception:
+                outbox_logger.exception('Outbox item "%s" error', item.key)
+            try:
+                await self._queue.ack(item)
+            except Exception:
+                outbox_logger.exception('Outbox item "%s" ack error', item.key)
+
+    async def _send(self, item: QueueItem) -> None:
+        request = msgspec.convert(item.data, _Request)
+        params = cast(dict[str, ParamType], request.params)
+        renew_task = asyncio.create_task(self._renew(item))
+        raw: msgspec.Raw | None = None
+        error: Exception | None = None
+        try:
+            raw = await self._deliver(
+                request.http_method, request.api_method, request.chat_id, params
+            )
+        except Exception as exception:
+            outbox_logger.exception('Outbox item "%s" delivery error', item.key)
+            error = exception
+        finally:
+            _ = renew_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await renew_task
+        future = self._waiters.get(item.key)
+        if future is not None:
+            if future.done():
+                pass
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                assert raw is not None
+                future.set_result(raw)
+        elif request.wait:
+            await self._queue.storage.set(
+                self._result_key(item.key),
+                cast(Json, msgspec.to_builtins(self._pack(raw, error))),
+                ttl=RESULT_TTL,
+            )
+
+    @staticmethod
+    def _pack(raw: msgspec.Raw | None, error: Exception | None) -> _Result:
+        if isinstance(error, TelegramError):
+            return _Result(
+                error_code=error.error_code,
+                description=error.description,
+                retry_after=(
+                    error.retry_after if isinstance(error, RetryAfter) else None
+                ),
+                migrate_to_chat_id=(
+                    ChatId(error.chat_id) if isinstance(error, MigrateToChat) else None
+                ),
+            )
+        if error is not None:
+            return _Result(error=str(error))
+        assert raw is not None
+        return _Result(result=bytes(raw).decode())
+
+    async def _renew(self, item: QueueItem) -> None:
+        while True:
+            await asyncio.sleep(self._queue.lease_ttl / 3)
+            try:
+                renewed = await self._queue.renew(item)
+            except Exception:
+                outbox_logger.exception('Outbox item "%s" renew error', item.key)
+                continue
+            if not renewed:
+                outbox_logger.warning('Outbox item "%s" lease lost', item.key)
+                return
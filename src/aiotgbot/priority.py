@@ -0,0 +1,87 @@
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Final
+
+__all__ = (
+    "PriorityLane",
+    "RequestPriority",
+    "current_priority",
+    "request_priority",
+)
+
+
+class RequestPriority(IntEnum):
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+
+_priority: Final[ContextVar[RequestPriority]] = ContextVar(
+    "request_priority", default=RequestPriority.NORMAL
+)
+
+
+def current_priority() -> RequestPriority:
+    return _priority.get()
+
+
+@contextmanager
+def request_priority(priority: RequestPriority) -> Iterator[None]:
+    """Send API calls made in the block with the priority."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class PriorityLane:
+    """Strict priority admission, one holder at a time.
+
+    Waiters are admitted lowest priority value first and in arrival
+    order within a priority, so lower priorities only get the lane when
+    no higher priority caller is waiting.
+    """
+
+    def __init__(self) -> None:
+        self._waiters: Final[dict[RequestPriority, deque[asyncio.Future[None]]]] = {
+            priority: deque() for priority in RequestPriority
+        }
+        self._busy: bool = False
+
+    def waiting(self, priority: RequestPriority) -> int:
+        return len(self._waiters[priority])
+
+    def _wake_next(self) -> None:
+        for waiters in self._waiters.values():
+            while len(waiters) > 0:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self._busy = False
+
+    @asynccontextmanager
+    async def resource(self, priority: RequestPriority) -> AsyncIterator[None]:
+        if self._busy:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[priority].append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Admitted while being cancelled, pass the lane on
+                    self._wake_next()
+                elif waiter in self._waiters[priority]:
+                    self._waiters[priority].remove(waiter)
+                raise
+        else:
+            self._busy = True
+        try:
+            yield
+        finally:
+            self._wake_next()
@@ -1,7 +1,15 @@
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterator, Iterable
+from contextlib import AbstractAsyncContextManager
 from typing import Protocol, runtime_checkable
 
-__all__ = ("StorageProtocol",)
+__all__ = (
+    "AtomicStorageProtocol",
+    "BatchStorageProtocol",
+    "ExpiringStorageProtocol",
+    "FencedStorageProtocol",
+    "StorageProtocol",
+    "TransactionalStorageProtocol",
+)
 
 from aiotgbot.helpers import Json
 
@@ -12,14 +20,99 @@ class StorageProtocol(Protocol):
 
     async def close(self) -> None: ...
 
-    async def set(self, key: str, value: Json | None = None) -> None: ...
+    async def set(
+        self, key: str, value: Json | None = None, *, ttl: float | None = None
+    ) -> None: ...
 
     async def get(self, key: str) -> Json: ...
 
     async def delete(self, key: str) -> None: ...
 
-    def iterate(self, prefix: str = "") -> AsyncIterator[tuple[str, Json]]: ...
+    def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]: ...
 
     async def clear(self) -> None: ...
 
     def raw_connection(self) -> object: ...
+
+
+@runtime_checkable
+class TransactionalStorageProtocol(Protocol):
+    def transaction(self) -> AbstractAsyncContextManager[None]: ...
+
+
+@runtime_checkable
+class BatchStorageProtocol(Protocol):
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None: ...
+
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]: ...
+
+    async def delete_many(self, keys: Iterable[str]) -> None: ...
+
+
+@runtime_checkable
+class ExpiringStorageProtocol(Protocol):
+    """Storage of values with a time to live.
+
+    ``get_expiry_many`` returns the wall clock expiry times of the
+    given keys, keys without one or without a live value are left out.
+    """
+
+    async def delete_expired(self, limit: int) -> int: ...
+
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]: ...
+
+
+@runtime_checkable
+class AtomicStorageProtocol(Protocol):
+    """Single-key read-modify-write operations executed atomically.
+
+    Missing, expired and null values all read as None: ``incr`` counts
+    them as 0 and ``compare_and_set`` matches them with
+    ``expected=None``. ``incr`` applies ``ttl`` only when it creates the
+    value, so a counter expires a fixed time after its first increment.
+    """
+
+    async def incr(
+        self, key: str, amount: int = 1, *, ttl: float | None = None
+    ) -> int: ...
+
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool: ...
+
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool: ...
+
+
+@runtime_checkable
+class FencedStorageProtocol(Protocol):
+    """Writes guarded by a fencing token.
+
+    ``set_many_fenced`` stores the items and ``token`` under
+    ``fence_key`` in one atomic write, or writes nothing and returns
+    False when the stored token is greater. Call it outside of
+    transactions.
+    """
+
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool: ...
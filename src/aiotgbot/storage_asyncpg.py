@@ -0,0 +1,501 @@
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Sequence
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from contextvars import ContextVar
+from importlib import import_module
+from typing import Final, Protocol, TypedDict, Unpack, cast
+
+import msgspec.json
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .helpers import Json, KeyLock, expiry_time, prefix_successor
+from .lock import LockProviderProtocol
+from .storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
+
+__all__ = ("AsyncpgAdvisoryLock", "AsyncpgStorage")
+
+JSONB_FORMAT_VERSION: Final[bytes] = b"\x01"
+CREATE_QUERIES: Final[tuple[str, ...]] = (
+    'CREATE TABLE IF NOT EXISTS kv (key TEXT COLLATE "C" PRIMARY KEY, value JSONB)',
+    "ALTER TABLE kv ADD COLUMN IF NOT EXISTS expires_at DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_kv_expires_at ON kv (expires_at)",
+)
+GET_QUERY: Final[str] = (
+    "SELECT value FROM kv WHERE key = $1 "
+    + "AND (expires_at IS NULL OR expires_at > $2)"
+)
+GET_MANY_QUERY: Final[str] = (
+    "SELECT key, value FROM kv WHERE key = ANY($1::text[]) "
+    + "AND (expires_at IS NULL OR expires_at > $2)"
+)
+GET_EXPIRY_MANY_QUERY: Final[str] = (
+    "SELECT key, expires_at FROM kv WHERE key = ANY($1::text[]) "
+    + "AND expires_at > $2"
+)
+SET_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES ($1, $2, $3) "
+    + "ON CONFLICT (key) DO UPDATE "
+    + "SET value = excluded.value, expires_at = excluded.expires_at"
+)
+NULL_OR_EXPIRED: Final[str] = (
+    "(kv.value IS NULL OR kv.value = 'null'::jsonb OR kv.expires_at <= $4)"
+)
+INCR_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES ($1, to_jsonb($2::bigint), $3) "
+    + "ON CONFLICT (key) DO UPDATE SET "
+    + f"value = CASE WHEN {NULL_OR_EXPIRED} THEN excluded.value "
+    + "ELSE to_jsonb((kv.value #>> '{}')::bigint + $2::bigint) END, "
+    + f"expires_at = CASE WHEN {NULL_OR_EXPIRED} THEN excluded.expires_at "
+    + "ELSE kv.expires_at END "
+    + f"WHERE {NULL_OR_EXPIRED} OR (jsonb_typeof(kv.value) = 'number' "
+    + "AND kv.value #>> '{}' ~ '^-?[0-9]+$') "
+    + "RETURNING (value #>> '{}')::bigint"
+)
+COMPARE_AND_SET_QUERY: Final[str] = (
+    "UPDATE kv SET value = $2, expires_at = $3 WHERE key = $1 AND value = $4 "
+    + "AND (expires_at IS NULL OR expires_at > $5)"
+)
+SET_IF_NULL_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES ($1, $2, $3) "
+    + "ON CONFLICT (key) DO UPDATE "
+    + "SET value = excluded.value, expires_at = excluded.expires_at "
+    + f"WHERE {NULL_OR_EXPIRED}"
+)
+SET_IF_ABSENT_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES ($1, $2, $3) "
+    + "ON CONFLICT (key) DO UPDATE "
+    + "SET value = excluded.value, expires_at = excluded.expires_at "
+    + "WHERE kv.expires_at <= $4"
+)
+# Locks the fence row until commit even when the token is stale
+SET_FENCE_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES ($1, to_jsonb($2::bigint), $3) "
+    + "ON CONFLICT (key) DO UPDATE "
+    + "SET value = excluded.value, expires_at = excluded.expires_at "
+    + "WHERE kv.expires_at <= $4 OR CASE WHEN jsonb_typeof(kv.value) = 'number' "
+    + "THEN (kv.value #>> '{}')::numeric <= $2 ELSE TRUE END "
+    + "RETURNING key"
+)
+DELETE_QUERY: Final[str] = "DELETE FROM kv WHERE key = $1"
+DELETE_MANY_QUERY: Final[str] = "DELETE FROM kv WHERE key = ANY($1::text[])"
+DELETE_EXPIRED_QUERY: Final[str] = (
+    "DELETE FROM kv WHERE key IN "
+    + "(SELECT key FROM kv WHERE expires_at <= $1 LIMIT $2)"
+)
+CLEAR_QUERY: Final[str] = "DELETE FROM kv"
+ADVISORY_LOCK_QUERY: Final[str] = "SELECT pg_advisory_lock(hashtextextended($1, 0))"
+ADVISORY_UNLOCK_QUERY: Final[str] = "SELECT pg_advisory_unlock(hashtextextended($1, 0))"
+
+
+# Local protocol copies of the minimal asyncpg surface we rely on,
+# asyncpg ships without type information.
+class Record(Protocol):
+    def __getitem__(self, index: int) -> object: ...
+
+
+class Connection(Protocol):
+    async def execute(self, query: str, *args: object) -> str: ...
+
+    async def executemany(
+        self, command: str, args: Iterable[Sequence[object]]
+    ) -> None: ...
+
+    async def fetch(self, query: str, *args: object) -> list[Record]: ...
+
+    async def fetchval(self, query: str, *args: object) -> object: ...
+
+    def cursor(
+        self, query: str, *args: object, prefetch: int | None = None
+    ) -> AsyncIterator[Record]: ...
+
+    def transaction(self) -> AbstractAsyncContextManager[object]: ...
+
+    async def set_type_codec(
+        self,
+        typename: str,
+        *,
+        encoder: Callable[..., object],
+        decoder: Callable[..., object],
+        schema: str = "public",
+        format: str = "text",
+    ) -> None: ...
+
+
+class Pool(Protocol):
+    def acquire(self) -> AbstractAsyncContextManager[Connection]: ...
+
+    async def execute(self, query: str, *args: object) -> str: ...
+
+    async def close(self) -> None: ...
+
+
+class _CreatePool(Protocol):
+    def __call__(
+        self,
+        dsn: str,
+        *,
+        init: Callable[[Connection], Awaitable[None]],
+        **kwargs: object,
+    ) -> Awaitable[Pool]: ...
+
+
+class _PoolKwargs(TypedDict, total=False):
+    min_size: int
+    max_size: int
+    max_queries: int
+    max_inactive_connection_lifetime: float
+    timeout: float
+    command_timeout: float
+    statement_cache_size: int
+    max_cached_statement_lifetime: int
+    max_cacheable_statement_size: int
+
+
+def _encode_jsonb(value: Json) -> bytes:
+    return JSONB_FORMAT_VERSION + msgspec.json.encode(value)
+
+
+def _decode_jsonb(data: bytes) -> Json:
+    return cast(Json, msgspec.json.decode(data[1:]))
+
+
+def _encode_json(value: Json) -> str:
+    return msgspec.json.encode(value).decode()
+
+
+def _decode_json(data: str) -> Json:
+    return cast(Json, msgspec.json.decode(data))
+
+
+class AsyncpgStorage(
+    StorageProtocol,
+    TransactionalStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+):
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        prefetch: int = 100,
+        lock_pool_size: int = 0,
+        **kwargs: Unpack[_PoolKwargs],
+    ) -> None:
+        if prefetch <= 0:
+            raise ValueError("prefetch must be positive")
+        if lock_pool_size < 0:
+            raise ValueError("lock_pool_size must be non-negative")
+        self._dsn: Final[str] = dsn
+        self._prefetch: Final[int] = prefetch
+        self._lock_pool_size: Final[int] = lock_pool_size
+        self._kwargs: Final[_PoolKwargs] = kwargs
+        self._pool: Pool | None = None
+        self._lock_pool: Pool | None = None
+        self._connection: Final[ContextVar[Connection | None]] = ContextVar(
+            f"asyncpg_storage_{id(self)}",
+            default=None,
+        )
+
+    @staticmethod
+    async def _init_connection(connection: Connection) -> None:
+        await connection.set_type_codec(
+            "jsonb",
+            encoder=_encode_jsonb,
+            decoder=_decode_jsonb,
+            schema="pg_catalog",
+            format="binary",
+        )
+        await connection.set_type_codec(
+            "json",
+            encoder=_encode_json,
+            decoder=_decode_json,
+            schema="pg_catalog",
+        )
+
+    @override
+    async def connect(self) -> None:
+        if self._pool is not None:
+            raise RuntimeError("Already connected")
+        create_pool = cast(_CreatePool, import_module("asyncpg").create_pool)
+        pool = await create_pool(
+            self._dsn,
+            init=self._init_connection,
+            **self._kwargs,
+        )
+        self._pool = pool
+        for query in CREATE_QUERIES:
+            _ = await pool.execute(query)
+        if self._lock_pool_size > 0:
+            self._lock_pool = await create_pool(
+                self._dsn,
+                init=self._init_connection,
+                **{**self._kwargs, "min_size": 0, "max_size": self._lock_pool_size},
+            )
+
+    @property
+    def pool(self) -> Pool:
+        if self._pool is None:
+            raise RuntimeError("Not connected")
+        return self._pool
+
+    @property
+    def lock_pool_size(self) -> int:
+        return self._lock_pool_size
+
+    @property
+    def lock_pool(self) -> Pool:
+        """Connections of advisory locks, separate from the pool."""
+        if self._lock_pool_size == 0:
+            raise RuntimeError("Lock pool is disabled")
+        if self._lock_pool is None:
+            raise RuntimeError("Not connected")
+        return self._lock_pool
+
+    @override
+    async def close(self) -> None:
+        if self._pool is None:
+            raise RuntimeError("Not connected")
+        if self._lock_pool is not None:
+            await self._lock_pool.close()
+            self._lock_pool = None
+        await self._pool.close()
+        self._pool = None
+
+    @override
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        if self._connection.get() is not None:
+            yield
+            return
+        async with self.pool.acquire() as connection, connection.transaction():
+            token = self._connection.set(connection)
+            try:
+                yield
+            finally:
+                self._connection.reset(token)
+
+    @asynccontextmanager
+    async def _acquire(self) -> AsyncIterator[Connection]:
+        connection = self._connection.get()
+        if connection is not None:
+            yield connection
+            return
+        async with self.pool.acquire() as connection:
+            yield connection
+
+    @override
+    async def set(
+        self, key: str, value: Json | None = None, *, ttl: float | None = None
+    ) -> None:
+        async with self._acquire() as connection:
+            _ = await connection.execute(SET_QUERY, key, value, expiry_time(ttl))
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        expires_at = expiry_time(ttl)
+        async with self._acquire() as connection:
+            await connection.executemany(
+                SET_QUERY,
+                ((key, value, expires_at) for key, value in items),
+            )
+
+    @override
+    async def get(self, key: str) -> Json:
+        async with self._acquire() as connection:
+            return cast(
+                Json,
+                await connection.fetchval(GET_QUERY, key, time.time()),
+            )
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        values: dict[str, Json] = dict.fromkeys(keys)
+        if len(values) == 0:
+            return values
+        async with self._acquire() as connection:
+            records = await connection.fetch(GET_MANY_QUERY, list(values), time.time())
+        for record in records:
+            values[cast(str, record[0])] = cast(Json, record[1])
+        return values
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        async with self._acquire() as connection, connection.transaction():
+            fenced = await connection.fetchval(
+                SET_FENCE_QUERY, fence_key, token, expires_at, time.time()
+            )
+            if fenced is None:
+                return False
+            await connection.executemany(
+                SET_QUERY,
+                ((key, value, expires_at) for key, value in items),
+            )
+        return True
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        key_list = list(keys)
+        if len(key_list) == 0:
+            return {}
+        async with self._acquire() as connection:
+            records = await connection.fetch(
+                GET_EXPIRY_MANY_QUERY, key_list, time.time()
+            )
+        return {cast(str, record[0]): cast(float, record[1]) for record in records}
+
+    @override
+    async def incr(self, key: str, amount: int = 1, *, ttl: float | None = None) -> int:
+        async with self._acquire() as connection:
+            value = await connection.fetchval(
+                INCR_QUERY, key, amount, expiry_time(ttl), time.time()
+            )
+        if value is None:
+            raise ValueError(f"Value of {key!r} is not an integer")
+        return cast(int, value)
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        async with self._acquire() as connection:
+            if expected is None:
+                status = await connection.execute(
+                    SET_IF_NULL_QUERY, key, value, expires_at, time.time()
+                )
+            else:
+                status = await connection.execute(
+                    COMPARE_AND_SET_QUERY,
+                    key,
+                    value,
+                    expires_at,
+                    expected,
+                    time.time(),
+                )
+        return status.split()[-1] == "1"
+
+    @override
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool:
+        async with self._acquire() as connection:
+            status = await connection.execute(
+                SET_IF_ABSENT_QUERY, key, value, expiry_time(ttl), time.time()
+            )
+        return status.split()[-1] == "1"
+
+    @override
+    async def delete(self, key: str) -> None:
+        async with self._acquire() as connection:
+            _ = await connection.execute(DELETE_QUERY, key)
+
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        async with self._acquire() as connection:
+            _ = await connection.execute(DELETE_MANY_QUERY, list(keys))
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        async with self._acquire() as connection:
+            status = await connection.execute(DELETE_EXPIRED_QUERY, time.time(), limit)
+            return int(status.split()[-1])
+
+    @override
+    async def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]:
+        args: list[object] = [prefix, time.time()]
+        query = (
+            "SELECT key, value FROM kv WHERE key >= $1 "
+            + "AND (expires_at IS NULL OR expires_at > $2)"
+        )
+        successor = prefix_successor(prefix)
+        if successor is not None:
+            args.append(successor)
+            query += f" AND key < ${len(args)}"
+        if start_after is not None:
+            args.append(start_after)
+            query += f" AND key > ${len(args)}"
+        query += " ORDER BY key"
+        if limit is not None:
+            args.append(limit)
+            query += f" LIMIT ${len(args)}"
+        async with self._acquire() as connection, connection.transaction():
+            async for record in connection.cursor(
+                query, *args, prefetch=self._prefetch
+            ):
+                yield cast(str, record[0]), cast(Json, record[1])
+
+    @override
+    async def clear(self) -> None:
+        async with self._acquire() as connection:
+            _ = await connection.execute(CLEAR_QUERY)
+
+    @override
+    def raw_connection(self) -> Pool:
+        return self.pool
+
+
+class AsyncpgAdvisoryLock(LockProviderProtocol):
+    """PostgreSQL session advisory lock.
+
+    Each held lock keeps a connection of the storage lock pool, so
+    handlers holding locks never wait for a connection of the storage
+    pool held by other locks. The server releases the lock when that
+    session ends. The fencing token is a ``<prefix>|<key>`` counter
+    incremented on the same connection on every acquisition.
+    """
+
+    def __init__(self, storage: AsyncpgStorage, *, prefix: str = "lock_fence") -> None:
+        if storage.lock_pool_size == 0:
+            raise ValueError("Advisory locks require a storage lock_pool_size")
+        self._storage: Final[AsyncpgStorage] = storage
+        self._prefix: Final[str] = prefix
+        self._local_lock: Final[KeyLock] = KeyLock()
+
+    @override
+    @asynccontextmanager
+    async def resource(self, key: str) -> AsyncIterator[int]:
+        async with (
+            self._local_lock.resource(key),
+            self._storage.lock_pool.acquire() as connection,
+        ):
+            _ = await connection.execute(ADVISORY_LOCK_QUERY, key)
+            try:
+                fence_key = f"{self._prefix}|{key}"
+                token = await connection.fetchval(
+                    INCR_QUERY, fence_key, 1, None, time.time()
+                )
+                if token is None:
+                    raise ValueError(f"Value of {fence_key!r} is not an integer")
+                yield cast(int, token)
+            finally:
+                _ = await connection.execute(ADVISORY_UNLOCK_QUERY, key)
@@ -0,0 +1,316 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import AsyncIterator, Iterable
+from contextlib import suppress
+from typing import Final, NamedTuple, cast
+
+import msgspec.json
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .helpers import Json, expiry_time
+from .storage import (
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+)
+
+__all__ = ("CachedStorage",)
+
+storage_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.storage")
+
+
+class _Entry(NamedTuple):
+    encoded: bytes
+    ttl: float | None
+    expires_at: float | None
+
+
+_NULL_ENTRY: Final[_Entry] = _Entry(b"null", None, None)
+
+
+class CachedStorage(
+    StorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+):
+    """Write-behind LRU cache in front of another storage.
+
+    Only safe when this process is the single writer of the wrapped
+    storage. Values are cached encoded, so callers never share mutable
+    objects with the cache. Buffered writes reach the wrapped storage
+    with their original TTL, so they may expire there up to
+    ``max_staleness`` seconds later than in the cache. Values loaded
+    from the wrapped storage are cached without its expiry time.
+    Fenced writes flush the buffer and go straight to the wrapped
+    storage.
+    """
+
+    def __init__(
+        self,
+        storage: StorageProtocol,
+        *,
+        max_size: int = 10_000,
+        max_staleness: float = 1.0,
+        max_dirty: int = 1000,
+    ) -> None:
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        if max_staleness < 0:
+            raise ValueError("max_staleness must be non-negative")
+        if max_dirty <= 0:
+            raise ValueError("max_dirty must be positive")
+        self._storage: Final[StorageProtocol] = storage
+        self._max_size: Final[int] = max_size
+        self._max_staleness: Final[float] = max_staleness
+        self._max_dirty: Final[int] = max_dirty
+        self._cache: Final[OrderedDict[str, _Entry]] = OrderedDict()
+        self._dirty: dict[str, _Entry | None] = {}
+        self._flushing: dict[str, _Entry | None] = {}
+        self._flush_lock: Final[asyncio.Lock] = asyncio.Lock()
+        self._wakeup: Final[asyncio.Event] = asyncio.Event()
+        self._flush_task: asyncio.Task[None] | None = None
+
+    @property
+    def storage(self) -> StorageProtocol:
+        return self._storage
+
+    @override
+    async def connect(self) -> None:
+        if self._flush_task is not None:
+            raise RuntimeError("Already connected")
+        await self._storage.connect()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    @override
+    async def close(self) -> None:
+        if self._flush_task is None:
+            raise RuntimeError("Not connected")
+        _ = self._flush_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._flush_task
+        self._flush_task = None
+        await self.flush()
+        self._cache.clear()
+        await self._storage.close()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            _ = await self._wakeup.wait()
+            await asyncio.sleep(self._max_staleness)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                storage_logger.exception("Cached storage flush error")
+                self._wakeup.set()
+
+    async def _write(
+        self,
+        items_by_ttl: dict[float | None, list[tuple[str, Json]]],
+        keys: list[str],
+    ) -> None:
+        storage = self._storage
+        for ttl, items in items_by_ttl.items():
+            if isinstance(storage, BatchStorageProtocol):
+                await storage.set_many(items, ttl=ttl)
+            elif ttl is not None:
+                for key, value in items:
+                    await storage.set(key, value, ttl=ttl)
+            else:
+                for key, value in items:
+                    await storage.set(key, value)
+        if len(keys) == 0:
+            return
+        if isinstance(storage, BatchStorageProtocol):
+            await storage.delete_many(keys)
+        else:
+            for key in keys:
+                await storage.delete(key)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, {}
+            if len(dirty) == 0:
+                return
+            self._flushing = dirty
+            items_by_ttl: defaultdict[float | None, list[tuple[str, Json]]] = (
+                defaultdict(list)
+            )
+            keys: list[str] = []
+            for key, entry in dirty.items():
+                if entry is None:
+                    keys.append(key)
+                else:
+                    value = cast(Json, msgspec.json.decode(entry.encoded))
+                    items_by_ttl[entry.ttl].append((key, value))
+            try:
+                await self._write(items_by_ttl, keys)
+            except BaseException:
+                for key, pending in dirty.items():
+                    _ = self._dirty.setdefault(key, pending)
+                raise
+            finally:
+                self._flushing = {}
+
+    def _remember(self, key: str, entry: _Entry) -> None:
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._max_size:
+            _ = self._cache.popitem(last=False)
+
+    async def _mark_dirty(self, writes: Iterable[tuple[str, _Entry | None]]) -> None:
+        self._dirty.update(writes)
+        if len(self._dirty) >= self._max_dirty:
+            await self.flush()
+        else:
+            self._wakeup.set()
+
+    @override
+    async def set(
+        self, key: str, value: Json | None = None, *, ttl: float | None = None
+    ) -> None:
+        entry = _Entry(msgspec.json.encode(value), ttl, expiry_time(ttl))
+        self._remember(key, entry)
+        await self._mark_dirty(((key, entry),))
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        expires_at = expiry_time(ttl)
+        writes: list[tuple[str, _Entry | None]] = []
+        for key, value in items:
+            entry = _Entry(msgspec.json.encode(value), ttl, expires_at)
+            self._remember(key, entry)
+            writes.append((key, entry))
+        await self._mark_dirty(writes)
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        if not isinstance(self._storage, FencedStorageProtocol):
+            raise TypeError(
+                f"{type(self._storage).__name__} does not support fenced writes"
+            )
+        item_list = list(items)
+        # Buffered writes must not land after the fenced one
+        await self.flush()
+        fenced = await self._storage.set_many_fenced(
+            fence_key, token, item_list, ttl=ttl
+        )
+        expires_at = expiry_time(ttl)
+        for key, value in [(fence_key, token), *item_list]:
+            if not fenced:
+                _ = self._cache.pop(key, None)
+            elif not self._pending(key)[0]:
+                self._remember(key, _Entry(msgspec.json.encode(value), ttl, expires_at))
+        return fenced
+
+    def _pending(self, key: str) -> tuple[bool, _Entry | None]:
+        if key in self._dirty:
+            return True, self._dirty[key]
+        if key in self._flushing:
+            return True, self._flushing[key]
+        return False, None
+
+    @override
+    async def get(self, key: str) -> Json:
+        pending, entry = self._pending(key)
+        if pending and entry is None:
+            return None
+        if entry is None:
+            entry = self._cache.get(key)
+        if entry is None:
+            value = await self._storage.get(key)
+            pending, _ = self._pending(key)
+            if pending or key in self._cache:
+                return await self.get(key)
+            entry = _Entry(msgspec.json.encode(value), None, None)
+        if entry.expires_at is not None and entry.expires_at <= time.time():
+            entry = _NULL_ENTRY
+        self._remember(key, entry)
+        return cast(Json, msgspec.json.decode(entry.encoded))
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        values: dict[str, Json] = dict.fromkeys(keys)
+        missing = [
+            key
+            for key in values
+            if not self._pending(key)[0] and key not in self._cache
+        ]
+        loaded: dict[str, Json] = {}
+        if isinstance(self._storage, BatchStorageProtocol):
+            loaded = await self._storage.get_many(missing)
+        else:
+            for key in missing:
+                loaded[key] = await self._storage.get(key)
+        for key in values:
+            pending, _ = self._pending(key)
+            if key in loaded and not pending and key not in self._cache:
+                self._remember(
+                    key, _Entry(msgspec.json.encode(loaded[key]), None, None)
+                )
+            values[key] = await self.get(key)
+        return values
+
+    @override
+    async def delete(self, key: str) -> None:
+        self._remember(key, _NULL_ENTRY)
+        await self._mark_dirty(((key, None),))
+
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        writes: list[tuple[str, _Entry | None]] = []
+        for key in keys:
+            self._remember(key, _NULL_ENTRY)
+            writes.append((key, None))
+        await self._mark_dirty(writes)
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        if not isinstance(self._storage, ExpiringStorageProtocol):
+            return 0
+        await self.flush()
+        return await self._storage.delete_expired(limit)
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        if not isinstance(self._storage, ExpiringStorageProtocol):
+            return {}
+        await self.flush()
+        return await self._storage.get_expiry_many(keys)
+
+    @override
+    async def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]:
+        await self.flush()
+        items = self._storage.iterate(prefix, start_after=start_after, limit=limit)
+        async for item in items:
+            yield item
+
+    @override
+    async def clear(self) -> None:
+        async with self._flush_lock:
+            self._dirty.clear()
+            self._cache.clear()
+            await self._storage.clear()
+
+    @override
+    def raw_connection(self) -> object:
+        return self._storage.raw_connection()
@@ -0,0 +1,316 @@
+import asyncio
+import copy
+from collections.abc import AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Final
+
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .helpers import Json
+from .storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
+
+__all__ = ("CoalescingStorage",)
+
+
+def _own(value: Json) -> Json:
+    # Coalesced callers must not share mutable values
+    if isinstance(value, dict | list):
+        return copy.deepcopy(value)
+    return value
+
+
+class CoalescingStorage(
+    StorageProtocol,
+    TransactionalStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+):
+    """Single-flight reads in front of another storage.
+
+    Concurrent gets of one key share a single read, and keys requested
+    in the same event loop iteration are loaded with one ``get_many``
+    call when the wrapped storage supports it. A write through this
+    storage detaches its key from reads started before the write, so a
+    get that starts after the write returns sees it. Reads inside a
+    transaction go straight to the wrapped storage.
+    """
+
+    def __init__(self, storage: StorageProtocol, *, max_batch_size: int = 100) -> None:
+        if max_batch_size <= 0:
+            raise ValueError("max_batch_size must be positive")
+        self._storage: Final[StorageProtocol] = storage
+        self._max_batch_size: Final[int] = max_batch_size
+        self._inflight: Final[dict[str, asyncio.Future[Json]]] = {}
+        self._queued: dict[str, asyncio.Future[Json]] = {}
+        self._tasks: Final[set[asyncio.Task[None]]] = set()
+        self._transaction: Final[ContextVar[bool]] = ContextVar(
+            f"coalescing_storage_{id(self)}",
+            default=False,
+        )
+
+    @property
+    def storage(self) -> StorageProtocol:
+        return self._storage
+
+    @override
+    async def connect(self) -> None:
+        await self._storage.connect()
+
+    @override
+    async def close(self) -> None:
+        if len(self._tasks) > 0:
+            _ = await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._storage.close()
+
+    @override
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        if not isinstance(self._storage, TransactionalStorageProtocol):
+            yield
+            return
+        token = self._transaction.set(True)
+        try:
+            async with self._storage.transaction():
+                yield
+        finally:
+            self._transaction.reset(token)
+
+    def _future(self, key: str) -> asyncio.Future[Json]:
+        future = self._inflight.get(key)
+        if future is not None:
+            return future
+        # A queued read has not started yet, so it is never stale
+        future = self._queued.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            if len(self._queued) == 0:
+                _ = loop.call_soon(self._dispatch)
+            self._queued[key] = future
+        self._inflight[key] = future
+        return future
+
+    def _dispatch(self) -> None:
+        queued, self._queued = self._queued, {}
+        batch: dict[str, asyncio.Future[Json]] = {}
+        for key, future in queued.items():
+            batch[key] = future
+            if len(batch) >= self._max_batch_size:
+                self._start(batch)
+                batch = {}
+        if len(batch) > 0:
+            self._start(batch)
+
+    def _start(self, batch: dict[str, asyncio.Future[Json]]) -> None:
+        task = asyncio.create_task(self._load(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, batch: dict[str, asyncio.Future[Json]]) -> None:
+        try:
+            if isinstance(self._storage, BatchStorageProtocol):
+                values = await self._storage.get_many(batch)
+            else:
+                results = await asyncio.gather(*map(self._storage.get, batch))
+                values = dict(zip(batch, results, strict=True))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                _ = future.cancel()
+            raise
+        except Exception as exception:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(exception)
+                    # Mark as retrieved when every waiter has gone
+                    _ = future.exception()
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(values[key])
+        finally:
+            for key, future in batch.items():
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def _detach(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            _ = self._inflight.pop(key, None)
+
+    @override
+    async def get(self, key: str) -> Json:
+        if self._transaction.get():
+            return await self._storage.get(key)
+        return _own(await asyncio.shield(self._future(key)))
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        if self._transaction.get():
+            if isinstance(self._storage, BatchStorageProtocol):
+                return await self._storage.get_many(keys)
+            return {key: await self._storage.get(key) for key in keys}
+        futures = {key: self._future(key) for key in keys}
+        if len(futures) > 0:
+            _ = await asyncio.shield(asyncio.gather(*futures.values()))
+        return {key: _own(future.result()) for key, future in futures.items()}
+
+    @override
+    async def set(
+        self, key: str, value: Json | None = None, *, ttl: float | None = None
+    ) -> None:
+        self._detach((key,))
+        try:
+            if ttl is not None:
+                await self._storage.set(key, value, ttl=ttl)
+            else:
+                await self._storage.set(key, value)
+        finally:
+            self._detach((key,))
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        item_list = list(items)
+        keys = [key for key, _ in item_list]
+        self._detach(keys)
+        try:
+            if isinstance(self._storage, BatchStorageProtocol):
+                await self._storage.set_many(item_list, ttl=ttl)
+            else:
+                for key, value in item_list:
+                    await self.set(key, value, ttl=ttl)
+        finally:
+            self._detach(keys)
+
+    @override
+    async def delete(self, key: str) -> None:
+        self._detach((key,))
+        try:
+            await self._storage.delete(key)
+        finally:
+            self._detach((key,))
+
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        key_list = list(keys)
+        self._detach(key_list)
+        try:
+            if isinstance(self._storage, BatchStorageProtocol):
+                await self._storage.delete_many(key_list)
+            else:
+                for key in key_list:
+                    await self._storage.delete(key)
+        finally:
+            self._detach(key_list)
+
+    def _atomic(self) -> AtomicStorageProtocol:
+        if not isinstance(self._storage, AtomicStorageProtocol):
+            raise TypeError(
+                f"{type(self._storage).__name__} does not support atomic operations"
+            )
+        return self._storage
+
+    @override
+    async def incr(self, key: str, amount: int = 1, *, ttl: float | None = None) -> int:
+        storage = self._atomic()
+        self._detach((key,))
+        try:
+            return await storage.incr(key, amount, ttl=ttl)
+        finally:
+            self._detach((key,))
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        storage = self._atomic()
+        self._detach((key,))
+        try:
+            return await storage.compare_and_set(key, expected, value, ttl=ttl)
+        finally:
+            self._detach((key,))
+
+    @override
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool:
+        storage = self._atomic()
+        self._detach((key,))
+        try:
+            return await storage.set_if_absent(key, value, ttl=ttl)
+        finally:
+            self._detach((key,))
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        if not isinstance(self._storage, FencedStorageProtocol):
+            raise TypeError(
+                f"{type(self._storage).__name__} does not support fenced writes"
+            )
+        item_list = list(items)
+        keys = [fence_key, *(key for key, _ in item_list)]
+        self._detach(keys)
+        try:
+            return await self._storage.set_many_fenced(
+                fence_key, token, item_list, ttl=ttl
+            )
+        finally:
+            self._detach(keys)
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        if not isinstance(self._storage, ExpiringStorageProtocol):
+            return 0
+        return await self._storage.delete_expired(limit)
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        if not isinstance(self._storage, ExpiringStorageProtocol):
+            return {}
+        return await self._storage.get_expiry_many(keys)
+
+    @override
+    async def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]:
+        items = self._storage.iterate(prefix, start_after=start_after, limit=limit)
+        async for item in items:
+            yield item
+
+    @override
+    async def clear(self) -> None:
+        self._inflight.clear()
+        try:
+            await self._storage.clear()
+        finally:
+            self._inflight.clear()
+
+    @override
+    def raw_connection(self) -> object:
+        return self._storage.raw_connection()
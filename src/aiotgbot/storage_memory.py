@@ -1,45 +1,492 @@
-from collections.abc import AsyncIterator
-from typing import Final
+import asyncio
+import heapq
+import logging
+import os
+import struct
+import time
+import zlib
+from collections.abc import AsyncIterator, Iterable, Iterator
+from contextlib import asynccontextmanager, suppress
+from contextvars import ContextVar
+from pathlib import Path
+from typing import BinaryIO, Final, cast
 
+import msgspec.msgpack
 from typing_extensions import override  # Python 3.11 compatibility
 
-from .helpers import Json
-from .storage import StorageProtocol
+from .helpers import Json, SortedKeys, expiry_time
+from .storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
 
 __all__ = ("MemoryStorage",)
 
+storage_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.storage")
 
-class MemoryStorage(StorageProtocol):
-    def __init__(self) -> None:
+# Length and CRC32 of a log record payload
+RECORD_HEADER: Final[struct.Struct] = struct.Struct(">II")
+ITERATE_PAGE_SIZE: Final[int] = 100
+
+# Value and expiry time of a buffered write, None for a deletion
+_Write = tuple[Json, float | None] | None
+# Log record operation: (key, value, expires_at) to set, (key,) to
+# delete, () to clear
+_Operation = tuple[()] | tuple[str] | tuple[str, Json, float | None]
+
+
+def _generation(path: Path) -> int:
+    return int(path.stem.rpartition("-")[2])
+
+
+def _file_name(kind: str, generation: int) -> str:
+    return f"{kind}-{generation:020d}.msgpack"
+
+
+def _read_log(path: Path) -> Iterator[list[list[Json]]]:
+    data = path.read_bytes()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        size, checksum = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        payload = data[offset : offset + size]
+        if len(payload) < size or zlib.crc32(payload) != checksum:
+            # Torn tail of an interrupted append
+            return
+        yield cast(list[list[Json]], msgspec.msgpack.decode(payload))
+        offset += size
+
+
+def _recover(directory: Path) -> tuple[int, dict[str, tuple[Json, float | None]]]:
+    directory.mkdir(parents=True, exist_ok=True)
+    state: dict[str, tuple[Json, float | None]] = {}
+    snapshots = sorted(directory.glob("snapshot-*.msgpack"), key=_generation)
+    generation = 0
+    if len(snapshots) > 0:
+        generation = _generation(snapshots[-1])
+        items = cast(
+            list[tuple[str, Json, float | None]],
+            msgspec.msgpack.decode(snapshots[-1].read_bytes()),
+        )
+        state.update((key, (value, expires_at)) for key, value, expires_at in items)
+    for log in sorted(directory.glob("log-*.msgpack"), key=_generation):
+        log_generation = _generation(log)
+        if log_generation < generation:
+            continue
+        generation = log_generation
+        for record in _read_log(log):
+            for operation in record:
+                if len(operation) == 0:
+                    state.clear()
+                elif len(operation) == 1:
+                    _ = state.pop(cast(str, operation[0]), None)
+                else:
+                    key, value, expires_at = operation
+                    state[cast(str, key)] = (value, cast(float | None, expires_at))
+    return generation, state
+
+
+def _fsync_directory(directory: Path) -> None:
+    # Windows can't open directories, renames there need no fsync
+    if os.name == "nt":
+        return
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _append(file: BinaryIO, data: bytes) -> None:
+    _ = file.write(data)
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _rotate(directory: Path, generation: int, snapshot: bytes) -> BinaryIO:
+    path = directory / _file_name("snapshot", generation)
+    temporary_path = path.with_suffix(".tmp")
+    with temporary_path.open("wb") as file:
+        _append(file, snapshot)
+    _ = temporary_path.replace(path)
+    log_file = (directory / _file_name("log", generation)).open("ab")
+    _fsync_directory(directory)
+    for old_path in directory.iterdir():
+        if old_path.suffix == ".tmp" or (
+            old_path.suffix == ".msgpack" and _generation(old_path) < generation
+        ):
+            old_path.unlink()
+    return log_file
+
+
+class MemoryStorage(
+    StorageProtocol,
+    TransactionalStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+):
+    """In-process storage.
+
+    Transactions buffer their writes and apply them at once on exit,
+    reads inside a transaction see the buffered writes, iteration does
+    not.
+
+    With ``path`` set, every write is appended to a log in that
+    directory, fsynced every ``sync_interval`` seconds, and the log is
+    compacted into a snapshot every ``snapshot_interval`` seconds.
+    ``connect`` restores the latest snapshot and replays the log after
+    it, so a crash loses at most ``sync_interval`` seconds of writes.
+    """
+
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        *,
+        sync_interval: float = 1.0,
+        snapshot_interval: float = 600.0,
+    ) -> None:
+        if sync_interval <= 0:
+            raise ValueError("sync_interval must be positive")
+        if snapshot_interval <= 0:
+            raise ValueError("snapshot_interval must be positive")
+        self._path: Final[Path | None] = Path(path) if path is not None else None
+        self._sync_interval: Final[float] = sync_interval
+        self._snapshot_interval: Final[float] = snapshot_interval
+        self._log_buffer: Final[bytearray] = bytearray()
+        self._log_file: BinaryIO | None = None
+        self._log_size: int = 0
+        self._generation: int = 0
+        self._snapshot_time: float = 0.0
+        self._persist_lock: Final[asyncio.Lock] = asyncio.Lock()
+        self._closing: Final[asyncio.Event] = asyncio.Event()
+        self._persist_task: asyncio.Task[None] | None = None
         self._data: Final[dict[str, Json]] = {}
+        self._expires: Final[dict[str, float]] = {}
+        self._expiry_heap: Final[list[tuple[float, str]]] = []
+        self._keys: Final[SortedKeys] = SortedKeys()
+        self._transaction: Final[ContextVar[dict[str, _Write] | None]] = ContextVar(
+            f"memory_storage_{id(self)}",
+            default=None,
+        )
 
     @override
-    async def connect(self) -> None: ...
+    async def connect(self) -> None:
+        if self._path is None:
+            return
+        if self._persist_task is not None:
+            raise RuntimeError("Already connected")
+        generation, state = await asyncio.to_thread(_recover, self._path)
+        self._data.clear()
+        self._data.update((key, value) for key, (value, _) in state.items())
+        self._keys.reset(self._data)
+        self._expires.clear()
+        self._expires.update(
+            (key, expires_at)
+            for key, (_, expires_at) in state.items()
+            if expires_at is not None
+        )
+        self._expiry_heap[:] = [
+            (expires_at, key) for key, expires_at in self._expires.items()
+        ]
+        heapq.heapify(self._expiry_heap)
+        self._log_buffer.clear()
+        self._generation = generation
+        await self._snapshot()
+        self._closing.clear()
+        self._persist_task = asyncio.create_task(self._persist_loop())
 
     @override
-    async def close(self) -> None: ...
+    async def close(self) -> None:
+        if self._path is None:
+            return
+        if self._persist_task is None:
+            raise RuntimeError("Not connected")
+        self._closing.set()
+        await self._persist_task
+        self._persist_task = None
+        if self._log_file is not None:
+            await asyncio.to_thread(self._log_file.close)
+            self._log_file = None
 
-    @override
-    async def set(self, key: str, value: Json = None) -> None:
+    async def _persist_loop(self) -> None:
+        while True:
+            with suppress(TimeoutError):
+                async with asyncio.timeout(self._sync_interval):
+                    _ = await self._closing.wait()
+            try:
+                if (
+                    not self._closing.is_set()
+                    and self._log_size > 0
+                    and time.monotonic() - self._snapshot_time
+                    >= self._snapshot_interval
+                ):
+                    await self._snapshot()
+                else:
+                    await self.sync()
+            except Exception:
+                storage_logger.exception("Memory storage persistence error")
+            if self._closing.is_set():
+                return
+
+    async def sync(self) -> None:
+        async with self._persist_lock:
+            if self._log_file is None or len(self._log_buffer) == 0:
+                return
+            data = bytes(self._log_buffer)
+            await asyncio.to_thread(_append, self._log_file, data)
+            del self._log_buffer[: len(data)]
+            self._log_size += len(data)
+
+    async def _snapshot(self) -> None:
+        assert self._path is not None
+        async with self._persist_lock:
+            # The snapshot covers every buffered record
+            buffered = len(self._log_buffer)
+            snapshot = msgspec.msgpack.encode([
+                (key, value, self._expires.get(key))
+                for key, value in self._data.items()
+            ])
+            generation = self._generation + 1
+            log_file = await asyncio.to_thread(
+                _rotate, self._path, generation, snapshot
+            )
+            if self._log_file is not None:
+                await asyncio.to_thread(self._log_file.close)
+            self._log_file = log_file
+            self._generation = generation
+            del self._log_buffer[:buffered]
+            self._log_size = 0
+            self._snapshot_time = time.monotonic()
+
+    def _log(self, operations: list[_Operation]) -> None:
+        if self._path is None:
+            return
+        if self._log_file is None:
+            raise RuntimeError("Not connected")
+        payload = msgspec.msgpack.encode(operations)
+        self._log_buffer.extend(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._log_buffer.extend(payload)
+
+    def _set(self, key: str, value: Json, expires_at: float | None) -> None:
+        if key not in self._data:
+            self._keys.add(key)
         self._data[key] = value
+        if expires_at is None:
+            _ = self._expires.pop(key, None)
+        else:
+            self._expires[key] = expires_at
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+            if len(self._expiry_heap) > 2 * len(self._expires) + 64:
+                self._expiry_heap[:] = [
+                    (expires_at, key) for key, expires_at in self._expires.items()
+                ]
+                heapq.heapify(self._expiry_heap)
+
+    def _pop(self, key: str) -> None:
+        if key in self._data:
+            del self._data[key]
+            self._keys.discard(key)
+        _ = self._expires.pop(key, None)
+
+    def _expired(self, key: str, now: float) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is None or expires_at > now:
+            return False
+        self._pop(key)
+        return True
+
+    def _apply(self, writes: dict[str, _Write]) -> None:
+        self._log([
+            (key,) if write is None else (key, *write) for key, write in writes.items()
+        ])
+        for key, write in writes.items():
+            if write is None:
+                self._pop(key)
+            else:
+                self._set(key, *write)
+
+    def _write(self, writes: dict[str, _Write]) -> None:
+        transaction = self._transaction.get()
+        if transaction is not None:
+            transaction.update(writes)
+        elif len(writes) > 0:
+            self._apply(writes)
+
+    def _lookup(self, key: str) -> _Write:
+        now = time.time()
+        transaction = self._transaction.get()
+        if transaction is not None and key in transaction:
+            write = transaction[key]
+            if write is None or (write[1] is not None and write[1] <= now):
+                return None
+            return write
+        if key not in self._data or self._expired(key, now):
+            return None
+        return self._data[key], self._expires.get(key)
+
+    @override
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        if self._transaction.get() is not None:
+            yield
+            return
+        writes: dict[str, _Write] = {}
+        token = self._transaction.set(writes)
+        try:
+            yield
+        finally:
+            self._transaction.reset(token)
+        if len(writes) > 0:
+            self._apply(writes)
+
+    @override
+    async def set(
+        self, key: str, value: Json = None, *, ttl: float | None = None
+    ) -> None:
+        self._write({key: (value, expiry_time(ttl))})
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        expires_at = expiry_time(ttl)
+        self._write({key: (value, expires_at) for key, value in items})
 
     @override
     async def get(self, key: str) -> Json:
-        return self._data.get(key)
+        current = self._lookup(key)
+        return current[0] if current is not None else None
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        values: dict[str, Json] = {}
+        for key in keys:
+            current = self._lookup(key)
+            values[key] = current[0] if current is not None else None
+        return values
 
     @override
     async def delete(self, key: str) -> None:
-        _ = self._data.pop(key, None)
+        self._write({key: None})
+
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        self._write(dict.fromkeys(keys))
+
+    @override
+    async def incr(self, key: str, amount: int = 1, *, ttl: float | None = None) -> int:
+        expires_at = expiry_time(ttl)
+        current = self._lookup(key)
+        if current is None or current[0] is None:
+            self._write({key: (amount, expires_at)})
+            return amount
+        value, expires_at = current
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"Value of {key!r} is not an integer")
+        self._write({key: (value + amount, expires_at)})
+        return value + amount
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        current = self._lookup(key)
+        if (current[0] if current is not None else None) != expected:
+            return False
+        self._write({key: (value, expires_at)})
+        return True
+
+    @override
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        if self._lookup(key) is not None:
+            return False
+        self._write({key: (value, expires_at)})
+        return True
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        if fence_key in self._data and not self._expired(fence_key, time.time()):
+            current = self._data[fence_key]
+            if isinstance(current, int) and current > token:
+                return False
+        writes: dict[str, _Write] = {key: (value, expires_at) for key, value in items}
+        writes[fence_key] = (token, expires_at)
+        self._apply(writes)
+        return True
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        expiry: dict[str, float] = {}
+        for key in keys:
+            current = self._lookup(key)
+            if current is not None and current[1] is not None:
+                expiry[key] = current[1]
+        return expiry
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        now = time.time()
+        deleted = 0
+        heap = self._expiry_heap
+        while deleted < limit and len(heap) > 0 and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            if self._expires.get(key) == expires_at and self._expired(key, now):
+                deleted += 1
+        return deleted
 
     @override
-    async def iterate(self, prefix: str = "") -> AsyncIterator[tuple[str, Json]]:
-        for key, value in self._data.items():
-            if key.startswith(prefix):
-                yield key, value
+    async def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]:
+        count = 0
+        while limit is None or count < limit:
+            page_keys = self._keys.page(prefix, start_after, ITERATE_PAGE_SIZE)
+            if len(page_keys) == 0:
+                return
+            now = time.time()
+            page: list[tuple[str, Json]] = []
+            for key in page_keys:
+                if not self._expired(key, now):
+                    page.append((key, self._data[key]))
+            start_after = page_keys[-1]
+            for item in page[: None if limit is None else limit - count]:
+                yield item
+                count += 1
 
     @override
     async def clear(self) -> None:
+        self._log([()])
         self._data.clear()
+        self._expires.clear()
+        self._expiry_heap.clear()
+        self._keys.clear()
 
     @override
     def raw_connection(self) -> object:
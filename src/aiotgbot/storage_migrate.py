@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Callable, Sequence
+from functools import partial
+from pathlib import Path
+from typing import Final
+
+import msgspec.json
+
+from .helpers import Json
+from .storage import BatchStorageProtocol, ExpiringStorageProtocol, StorageProtocol
+
+__all__ = ("copy_storage", "main", "open_storage", "verify_storage")
+
+DEFAULT_BATCH_SIZE: Final[int] = 1000
+
+
+async def _read_page(
+    storage: StorageProtocol, prefix: str, start_after: str | None, limit: int
+) -> list[tuple[str, Json]]:
+    items = storage.iterate(prefix, start_after=start_after, limit=limit)
+    return [item async for item in items]
+
+
+async def _write_page(
+    source: StorageProtocol, storage: StorageProtocol, items: list[tuple[str, Json]]
+) -> int:
+    expiry: dict[str, float] = {}
+    if isinstance(source, ExpiringStorageProtocol):
+        expiry = await source.get_expiry_many(key for key, _ in items)
+    # Keys written with one set_many call share an expiry time
+    by_expiry: defaultdict[float | None, list[tuple[str, Json]]] = defaultdict(list)
+    for key, value in items:
+        by_expiry[expiry.get(key)].append((key, value))
+    now = time.time()
+    written = 0
+    for expires_at, expiry_items in by_expiry.items():
+        ttl = expires_at - now if expires_at is not None else None
+        if ttl is not None and ttl <= 0:
+            continue
+        if isinstance(storage, BatchStorageProtocol):
+            await storage.set_many(expiry_items, ttl=ttl)
+        else:
+            for key, value in expiry_items:
+                await storage.set(key, value, ttl=ttl)
+        written += len(expiry_items)
+    return written
+
+
+async def copy_storage(
+    source: StorageProtocol,
+    destination: StorageProtocol,
+    *,
+    prefix: str = "",
+    start_after: str | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    checkpoint: Callable[[str], None] | None = None,
+) -> int:
+    """Copy keys with the prefix from one storage to another.
+
+    Pages of ``batch_size`` keys are written with one ``set_many`` call
+    while the next page is read, so at most two pages are held in
+    memory. After each written page ``checkpoint`` receives its last
+    key, pass it back as ``start_after`` to resume. Keys keep the time
+    they have left to live when the source can tell it, keys expiring
+    meanwhile are skipped. Returns the number of copied keys.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    copied = 0
+    reading = asyncio.create_task(_read_page(source, prefix, start_after, batch_size))
+    try:
+        while True:
+            page = await reading
+            if len(page) == 0:
+                return copied
+            last_key = page[-1][0]
+            if len(page) == batch_size:
+                reading = asyncio.create_task(
+                    _read_page(source, prefix, last_key, batch_size)
+                )
+            copied += await _write_page(source, destination, page)
+            if checkpoint is not None:
+                checkpoint(last_key)
+            if len(page) < batch_size:
+                return copied
+    finally:
+        if not reading.done():
+            _ = reading.cancel()
+
+
+async def verify_storage(
+    source: StorageProtocol,
+    destination: StorageProtocol,
+    *,
+    prefix: str = "",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> list[str]:
+    """Return keys with the prefix whose destination value differs.
+
+    Keys present only in the destination are not reported.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    mismatched: list[str] = []
+    start_after: str | None = None
+    while True:
+        page = await _read_page(source, prefix, start_after, batch_size)
+        if len(page) == 0:
+            return mismatched
+        if isinstance(destination, BatchStorageProtocol):
+            values = await destination.get_many(key for key, _ in page)
+        else:
+            values = {key: await destination.get(key) for key, _ in page}
+        mismatched.extend(key for key, value in page if values[key] != value)
+        start_after = page[-1][0]
+
+
+def open_storage(url: str) -> StorageProtocol:
+    """Create a storage from a URL.
+
+    Supported forms are ``memory:<path>``, ``sqlite:<path>``,
+    ``mmap:<path>``, ``postgresql://...`` for asyncpg and
+    ``sqlalchemy+<url>`` for an SQLAlchemy async engine URL.
+    """
+    scheme, _, rest = url.partition(":")
+    path = rest.removeprefix("//")
+    if scheme == "memory":
+        from .storage_memory import MemoryStorage
+
+        return MemoryStorage(path or None)
+    if scheme == "sqlite":
+        from .storage_sqlite import SQLiteStorage
+
+        return SQLiteStorage(path)
+    if scheme == "mmap":
+        from .storage_mmap import MmapStorage
+
+        return MmapStorage(path)
+    if scheme in {"postgres", "postgresql"}:
+        from .storage_asyncpg import AsyncpgStorage
+
+        return AsyncpgStorage(url)
+    if scheme.startswith("sqlalchemy+"):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        from .storage_sqlalchemy import SqlalchemyStorage
+
+        return SqlalchemyStorage(create_async_engine(url.removeprefix("sqlalchemy+")))
+    raise ValueError(f"Unsupported storage URL: {url}")
+
+
+def _read_checkpoint(path: Path) -> str | None:
+    if not path.exists():
+        return None
+    return msgspec.json.decode(path.read_bytes(), type=str)
+
+
+def _write_checkpoint(path: Path, key: str) -> None:
+    temporary = path.with_name(f"{path.name}.tmp")
+    _ = temporary.write_bytes(msgspec.json.encode(key))
+    os.replace(temporary, path)
+
+
+async def _migrate(arguments: argparse.Namespace) -> int:
+    source = open_storage(arguments.source)
+    destination = open_storage(arguments.destination)
+    checkpoint_path: Path | None = arguments.checkpoint
+    start_after: str | None = None
+    checkpoint: Callable[[str], None] | None = None
+    if checkpoint_path is not None:
+        start_after = _read_checkpoint(checkpoint_path)
+        checkpoint = partial(_write_checkpoint, checkpoint_path)
+
+    await source.connect()
+    try:
+        await destination.connect()
+        try:
+            copied = await copy_storage(
+                source,
+                destination,
+                prefix=arguments.prefix,
+                start_after=start_after,
+                batch_size=arguments.batch_size,
+                checkpoint=checkpoint,
+            )
+            print(f"Copied {copied} keys")
+            if not arguments.verify:
+                return 0
+            mismatched = await verify_storage(
+                source,
+                destination,
+                prefix=arguments.prefix,
+                batch_size=arguments.batch_size,
+            )
+            for key in mismatched:
+                print(f"Mismatch: {key}", file=sys.stderr)
+            print(f"Verified with {len(mismatched)} mismatches")
+            return 1 if len(mismatched) > 0 else 0
+        finally:
+            await destination.close()
+    finally:
+        await source.close()
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="aiotgbot-migrate",
+        description="Copy keys from one storage to another.",
+    )
+    _ = parser.add_argument("source", help="source storage URL")
+    _ = parser.add_argument("destination", help="destination storage URL")
+    _ = parser.add_argument("--prefix", default="", help="copy only this prefix")
+    _ = parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="keys per batch"
+    )
+    _ = parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="file with the last copied key, used to resume",
+    )
+    _ = parser.add_argument(
+        "--verify", action="store_true", help="compare values after copying"
+    )
+    return asyncio.run(_migrate(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,596 @@
+import asyncio
+import heapq
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections.abc import AsyncIterator, Iterable
+from contextlib import suppress
+from pathlib import Path
+from typing import Final, NamedTuple, cast
+
+import msgspec.msgpack
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .helpers import Json, SortedKeys, expiry_time
+from .storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+)
+
+__all__ = ("MmapStorage",)
+
+storage_logger: Final[logging.Logger] = logging.getLogger("aiotgbot.storage")
+
+# CRC32 of the rest of the record, flag, key size, value size and
+# expiry time, NaN for none
+RECORD_HEADER: Final[struct.Struct] = struct.Struct(">IBIId")
+FLAG_SET: Final[int] = 1
+FLAG_DELETE: Final[int] = 2
+ITERATE_PAGE_SIZE: Final[int] = 100
+COMPACT_YIELD_EVERY: Final[int] = 1000
+# Longest msgpack encoding of a 64-bit integer
+MAX_INT_SIZE: Final[int] = 9
+
+
+class _Segment:
+    def __init__(self, path: Path, segment_id: int, size: int) -> None:
+        self.path: Final[Path] = path
+        self.id: Final[int] = segment_id
+        self.file_descriptor: Final[int] = os.open(path, os.O_RDWR | os.O_CREAT)
+        if os.fstat(self.file_descriptor).st_size < max(size, 1):
+            os.ftruncate(self.file_descriptor, max(size, 1))
+        self.size: Final[int] = os.fstat(self.file_descriptor).st_size
+        self.map: Final[mmap.mmap] = mmap.mmap(self.file_descriptor, self.size)
+        self.view: Final[memoryview] = memoryview(self.map)
+        self.end: int = 0
+        self.live: int = 0
+
+    def close(self) -> None:
+        self.view.release()
+        self.map.close()
+        os.close(self.file_descriptor)
+
+
+class _Entry(NamedTuple):
+    segment: _Segment
+    offset: int
+    record_size: int
+    value_size: int
+    expires_at: float | None
+
+
+def _segment_id(path: Path) -> int:
+    return int(path.stem.rpartition("-")[2])
+
+
+def _record(flag: int, key: bytes, value: bytes, expires_at: float | None) -> bytes:
+    body = RECORD_HEADER.pack(
+        0,
+        flag,
+        len(key),
+        len(value),
+        expires_at if expires_at is not None else math.nan,
+    )[4:]
+    body += key + value
+    return (zlib.crc32(body)).to_bytes(4, "big") + body
+
+
+def _record_size(key: str, value: bytes) -> int:
+    return RECORD_HEADER.size + len(key.encode()) + len(value)
+
+
+def _fsync_directory(directory: Path) -> None:
+    # Windows can't open directories, renames there need no fsync
+    if os.name == "nt":
+        return
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _seal(sealed: _Segment, path: Path, segment_id: int, size: int) -> _Segment:
+    sealed.map.flush()
+    segment = _Segment(path, segment_id, size)
+    _fsync_directory(path.parent)
+    return segment
+
+
+def _persist(segment: _Segment, path: Path) -> None:
+    segment.map.flush()
+    os.fsync(segment.file_descriptor)
+    _ = segment.path.replace(path)
+    _fsync_directory(path.parent)
+
+
+def _close_segments(segments: list[_Segment], *, remove: bool) -> None:
+    for segment in segments:
+        if not remove:
+            segment.map.flush()
+        segment.close()
+        if remove:
+            segment.path.unlink()
+
+
+class MmapStorage(
+    StorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+):
+    """Log-structured storage in memory-mapped segment files.
+
+    Writes append records to the active segment through the map, reads
+    decode values straight from it. Records reach the disk when the
+    kernel writes the pages back and at least every ``sync_interval``
+    seconds. Flushes, fsyncs and new segment files run in a thread, so
+    they don't block the event loop. Sealed segments are compacted in
+    the background once ``compact_ratio`` of their bytes belong to
+    overwritten or deleted keys.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        *,
+        segment_size: int = 64 * 1024 * 1024,
+        sync_interval: float = 1.0,
+        compact_ratio: float = 0.5,
+    ) -> None:
+        if segment_size <= RECORD_HEADER.size:
+            raise ValueError("segment_size is too small")
+        if sync_interval <= 0:
+            raise ValueError("sync_interval must be positive")
+        if not 0 < compact_ratio <= 1:
+            raise ValueError("compact_ratio must be in (0, 1]")
+        self._path: Final[Path] = Path(path)
+        self._segment_size: Final[int] = segment_size
+        self._sync_interval: Final[float] = sync_interval
+        self._compact_ratio: Final[float] = compact_ratio
+        self._segments: list[_Segment] = []
+        self._index: Final[dict[str, _Entry]] = {}
+        self._keys: Final[SortedKeys] = SortedKeys()
+        self._expiry_heap: Final[list[tuple[float, str]]] = []
+        self._compact_lock: Final[asyncio.Lock] = asyncio.Lock()
+        self._rotate_lock: Final[asyncio.Lock] = asyncio.Lock()
+        self._closing: Final[asyncio.Event] = asyncio.Event()
+        self._sync_task: asyncio.Task[None] | None = None
+
+    @property
+    def _active(self) -> _Segment:
+        if len(self._segments) == 0:
+            raise RuntimeError("Not connected")
+        return self._segments[-1]
+
+    @override
+    async def connect(self) -> None:
+        if self._sync_task is not None:
+            raise RuntimeError("Already connected")
+        self._path.mkdir(parents=True, exist_ok=True)
+        compacted = sorted(self._path.glob("compact-*.data"), key=_segment_id)
+        compacted_id = _segment_id(compacted[-1]) if len(compacted) > 0 else 0
+        for path in self._path.iterdir():
+            if path.suffix == ".tmp" or (
+                path.suffix == ".data"
+                and _segment_id(path) <= compacted_id
+                and (path.name.startswith("segment-") or path not in compacted[-1:])
+            ):
+                path.unlink()
+        paths = [
+            *compacted[-1:],
+            *sorted(self._path.glob("segment-*.data"), key=_segment_id),
+        ]
+        now = time.time()
+        for path in paths:
+            segment = _Segment(path, _segment_id(path), 0)
+            self._segments.append(segment)
+            self._load(segment, now)
+        if len(paths) == 0 or paths[-1] in compacted:
+            _ = self._add_segment(self._segment_size)
+        self._keys.reset(self._index)
+        self._expiry_heap[:] = [
+            (entry.expires_at, key)
+            for key, entry in self._index.items()
+            if entry.expires_at is not None
+        ]
+        heapq.heapify(self._expiry_heap)
+        self._closing.clear()
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    def _load(self, segment: _Segment, now: float) -> None:
+        view = segment.view
+        offset = 0
+        while offset + RECORD_HEADER.size <= segment.size:
+            checksum, flag, key_size, value_size, expires_at = (
+                RECORD_HEADER.unpack_from(view, offset)
+            )
+            record_size = RECORD_HEADER.size + key_size + value_size
+            if (
+                flag not in (FLAG_SET, FLAG_DELETE)
+                or offset + record_size > segment.size
+                or zlib.crc32(view[offset + 4 : offset + record_size]) != checksum
+            ):
+                # End of records or torn tail of an interrupted write
+                break
+            key_offset = offset + RECORD_HEADER.size
+            key = bytes(view[key_offset : key_offset + key_size]).decode()
+            _ = self._forget(key)
+            if flag == FLAG_SET and (math.isnan(expires_at) or expires_at > now):
+                entry = _Entry(
+                    segment,
+                    offset,
+                    record_size,
+                    value_size,
+                    None if math.isnan(expires_at) else expires_at,
+                )
+                self._index[key] = entry
+                segment.live += record_size
+            offset += record_size
+        segment.end = offset
+
+    def _add_segment(self, size: int) -> _Segment:
+        segment_id = self._segments[-1].id + 1 if len(self._segments) > 0 else 1
+        segment = _Segment(
+            self._path / f"segment-{segment_id:020d}.data", segment_id, size
+        )
+        _fsync_directory(self._path)
+        self._segments.append(segment)
+        return segment
+
+    @override
+    async def close(self) -> None:
+        if self._sync_task is None:
+            raise RuntimeError("Not connected")
+        self._closing.set()
+        await self._sync_task
+        self._sync_task = None
+        async with self._compact_lock, self._rotate_lock:
+            segments = list(self._segments)
+            self._segments.clear()
+            await asyncio.to_thread(_close_segments, segments, remove=False)
+            self._index.clear()
+            self._keys.clear()
+            self._expiry_heap.clear()
+
+    async def _sync_loop(self) -> None:
+        while not self._closing.is_set():
+            with suppress(TimeoutError):
+                async with asyncio.timeout(self._sync_interval):
+                    _ = await self._closing.wait()
+            try:
+                await self.sync()
+                if not self._closing.is_set() and self._garbage_ratio() >= (
+                    self._compact_ratio
+                ):
+                    await self.compact()
+            except Exception:
+                storage_logger.exception("Mmap storage background error")
+
+    async def sync(self) -> None:
+        # Compaction closes sealed segments, so it waits for the flush
+        async with self._compact_lock:
+            await asyncio.to_thread(self._active.map.flush)
+
+    def _garbage_ratio(self) -> float:
+        sealed = self._segments[:-1]
+        size = sum(segment.end for segment in sealed)
+        if size == 0:
+            return 0.0
+        return 1 - sum(segment.live for segment in sealed) / size
+
+    def _forget(self, key: str) -> _Entry | None:
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            entry.segment.live -= entry.record_size
+        return entry
+
+    async def _reserve(self, size: int) -> None:
+        """Make room for ``size`` bytes in the active segment.
+
+        Callers append right after it returns, without awaiting.
+        """
+        while self._rotate_lock.locked() or self._active.end + size > self._active.size:
+            async with self._rotate_lock:
+                sealed = self._active
+                if sealed.end + size <= sealed.size:
+                    continue
+                segment_id = sealed.id + 1
+                segment = await asyncio.to_thread(
+                    _seal,
+                    sealed,
+                    self._path / f"segment-{segment_id:020d}.data",
+                    segment_id,
+                    max(self._segment_size, size),
+                )
+                self._segments.append(segment)
+
+    def _append(self, record: bytes) -> tuple[_Segment, int]:
+        segment = self._active
+        assert segment.end + len(record) <= segment.size, "Space not reserved"
+        offset = segment.end
+        segment.map[offset : offset + len(record)] = record
+        segment.end += len(record)
+        return segment, offset
+
+    def _set(self, key: str, encoded_value: bytes, expires_at: float | None) -> None:
+        record = _record(FLAG_SET, key.encode(), encoded_value, expires_at)
+        segment, offset = self._append(record)
+        if self._forget(key) is None:
+            self._keys.add(key)
+        self._index[key] = _Entry(
+            segment, offset, len(record), len(encoded_value), expires_at
+        )
+        segment.live += len(record)
+        if expires_at is not None:
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+            if len(self._expiry_heap) > 2 * len(self._index) + 64:
+                self._expiry_heap[:] = [
+                    (entry.expires_at, key)
+                    for key, entry in self._index.items()
+                    if entry.expires_at is not None
+                ]
+                heapq.heapify(self._expiry_heap)
+
+    def _remove(self, key: str) -> None:
+        if self._forget(key) is not None:
+            self._keys.discard(key)
+
+    def _delete(self, key: str) -> None:
+        if key not in self._index:
+            return
+        _ = self._append(_record(FLAG_DELETE, key.encode(), b"", None))
+        self._remove(key)
+
+    def _decode(self, entry: _Entry) -> Json:
+        end = entry.offset + entry.record_size
+        return cast(
+            Json,
+            msgspec.msgpack.decode(entry.segment.view[end - entry.value_size : end]),
+        )
+
+    def _alive(self, key: str, now: float) -> _Entry | None:
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= now:
+            self._remove(key)
+            return None
+        return entry
+
+    @override
+    async def set(
+        self, key: str, value: Json = None, *, ttl: float | None = None
+    ) -> None:
+        encoded = msgspec.msgpack.encode(value)
+        await self._reserve(_record_size(key, encoded))
+        self._set(key, encoded, expiry_time(ttl))
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        _ = self._active
+        expires_at = expiry_time(ttl)
+        for key, value in items:
+            encoded = msgspec.msgpack.encode(value)
+            await self._reserve(_record_size(key, encoded))
+            self._set(key, encoded, expires_at)
+
+    @override
+    async def get(self, key: str) -> Json:
+        _ = self._active
+        entry = self._alive(key, time.time())
+        return self._decode(entry) if entry is not None else None
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        _ = self._active
+        now = time.time()
+        values: dict[str, Json] = {}
+        for key in keys:
+            entry = self._alive(key, now)
+            values[key] = self._decode(entry) if entry is not None else None
+        return values
+
+    @override
+    async def delete(self, key: str) -> None:
+        await self._reserve(_record_size(key, b""))
+        self._delete(key)
+
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        _ = self._active
+        for key in keys:
+            await self._reserve(_record_size(key, b""))
+            self._delete(key)
+
+    @override
+    async def incr(self, key: str, amount: int = 1, *, ttl: float | None = None) -> int:
+        expires_at = expiry_time(ttl)
+        await self._reserve(_record_size(key, b"") + MAX_INT_SIZE)
+        entry = self._alive(key, time.time())
+        value = self._decode(entry) if entry is not None else None
+        if entry is None or value is None:
+            self._set(key, msgspec.msgpack.encode(amount), expires_at)
+            return amount
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"Value of {key!r} is not an integer")
+        self._set(key, msgspec.msgpack.encode(value + amount), entry.expires_at)
+        return value + amount
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        encoded = msgspec.msgpack.encode(value)
+        await self._reserve(_record_size(key, encoded))
+        entry = self._alive(key, time.time())
+        if (self._decode(entry) if entry is not None else None) != expected:
+            return False
+        self._set(key, encoded, expires_at)
+        return True
+
+    @override
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        encoded = msgspec.msgpack.encode(value)
+        await self._reserve(_record_size(key, encoded))
+        if self._alive(key, time.time()) is not None:
+            return False
+        self._set(key, encoded, expires_at)
+        return True
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        encoded = [(key, msgspec.msgpack.encode(value)) for key, value in items]
+        encoded.append((fence_key, msgspec.msgpack.encode(token)))
+        # One reservation keeps the check and the writes atomic
+        await self._reserve(sum(_record_size(key, value) for key, value in encoded))
+        entry = self._alive(fence_key, time.time())
+        if entry is not None:
+            current = self._decode(entry)
+            if isinstance(current, int) and current > token:
+                return False
+        for key, value in encoded:
+            self._set(key, value, expires_at)
+        return True
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        _ = self._active
+        now = time.time()
+        expiry: dict[str, float] = {}
+        for key in keys:
+            entry = self._alive(key, now)
+            if entry is not None and entry.expires_at is not None:
+                expiry[key] = entry.expires_at
+        return expiry
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        now = time.time()
+        deleted = 0
+        heap = self._expiry_heap
+        while deleted < limit and len(heap) > 0 and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            entry = self._index.get(key)
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(key)
+                deleted += 1
+        return deleted
+
+    @override
+    async def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]:
+        _ = self._active
+        count = 0
+        while limit is None or count < limit:
+            page_keys = self._keys.page(prefix, start_after, ITERATE_PAGE_SIZE)
+            if len(page_keys) == 0:
+                return
+            now = time.time()
+            page: list[tuple[str, Json]] = []
+            for key in page_keys:
+                entry = self._alive(key, now)
+                if entry is not None:
+                    page.append((key, self._decode(entry)))
+            start_after = page_keys[-1]
+            for item in page[: None if limit is None else limit - count]:
+                yield item
+                count += 1
+
+    async def compact(self) -> None:
+        async with self._compact_lock:
+            sealed = self._segments[:-1]
+            if len(sealed) == 0:
+                return
+            sealed_ids = {segment.id for segment in sealed}
+            now = time.time()
+            moved = [
+                (key, entry)
+                for key, entry in self._index.items()
+                if entry.segment.id in sealed_ids
+                and (entry.expires_at is None or entry.expires_at > now)
+            ]
+            compact_id = sealed[-1].id
+            temporary_path = self._path / f"compact-{compact_id:020d}.tmp"
+            target = await asyncio.to_thread(
+                _Segment,
+                temporary_path,
+                compact_id,
+                max(sum(entry.record_size for _, entry in moved), 1),
+            )
+            offsets: list[int] = []
+            for number, (_, entry) in enumerate(moved, 1):
+                offset = target.end
+                end = entry.offset + entry.record_size
+                target.map[offset : offset + entry.record_size] = entry.segment.view[
+                    entry.offset : end
+                ]
+                target.end += entry.record_size
+                offsets.append(offset)
+                if number % COMPACT_YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+            path = self._path / f"compact-{compact_id:020d}.data"
+            await asyncio.to_thread(_persist, target, path)
+            segment = await asyncio.to_thread(_Segment, path, compact_id, 0)
+            target.close()
+            segment.end = sum(entry.record_size for _, entry in moved)
+            for (key, entry), offset in zip(moved, offsets, strict=True):
+                if self._index.get(key) is entry:
+                    self._index[key] = entry._replace(segment=segment, offset=offset)
+                    segment.live += entry.record_size
+            self._segments[: len(sealed)] = [segment]
+            await asyncio.to_thread(_close_segments, sealed, remove=True)
+
+    @override
+    async def clear(self) -> None:
+        async with self._compact_lock, self._rotate_lock:
+            segment_id = self._active.id + 1
+            segment = await asyncio.to_thread(
+                _Segment,
+                self._path / f"segment-{segment_id:020d}.data",
+                segment_id,
+                self._segment_size,
+            )
+            await asyncio.to_thread(_fsync_directory, self._path)
+            segments = list(self._segments)
+            self._segments[:] = [segment]
+            self._index.clear()
+            self._keys.clear()
+            self._expiry_heap.clear()
+            await asyncio.to_thread(_close_segments, segments, remove=True)
+
+    @override
+    def raw_connection(self) -> object:
+        return None
@@ -0,0 +1,137 @@
+import asyncio
+import uuid
+from contextlib import suppress
+from typing import Final, NamedTuple
+
+from .helpers import Json
+from .storage import AtomicStorageProtocol, BatchStorageProtocol, StorageProtocol
+
+__all__ = ("QueueItem", "StorageQueue")
+
+
+class QueueItem(NamedTuple):
+    key: str
+    data: Json
+    owner: str
+
+
+class StorageQueue:
+    """At-least-once queue kept in a storage with atomic operations.
+
+    Items are ``<name>|item|<sequence>`` keys, so they are consumed in
+    the order they were put. A consumer claims an item with a lease, a
+    ``<name>|lease|<sequence>`` key with a TTL, and acknowledges it when
+    done. An item whose consumer died is claimed again once its lease
+    expires, so several processes can consume one queue.
+    """
+
+    def __init__(
+        self,
+        storage: StorageProtocol,
+        name: str,
+        *,
+        lease_ttl: float = 60.0,
+        page_size: int = 100,
+    ) -> None:
+        if not isinstance(storage, AtomicStorageProtocol):
+            raise TypeError(
+                f"{type(storage).__name__} does not support atomic operations"
+            )
+        if lease_ttl <= 0:
+            raise ValueError("lease_ttl must be positive")
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+        self._storage: Final[StorageProtocol] = storage
+        self._atomic: Final[AtomicStorageProtocol] = storage
+        self._name: Final[str] = name
+        self._lease_ttl: Final[float] = lease_ttl
+        self._page_size: Final[int] = page_size
+        self._item_prefix: Final[str] = f"{name}|item|"
+        self._put_event: Final[asyncio.Event] = asyncio.Event()
+
+    @property
+    def storage(self) -> StorageProtocol:
+        return self._storage
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def lease_ttl(self) -> float:
+        return self._lease_ttl
+
+    def _lease_key(self, item_key: str) -> str:
+        return f"{self._name}|lease|{item_key.removeprefix(self._item_prefix)}"
+
+    async def put(self, data: Json) -> str:
+        sequence = await self._atomic.incr(f"{self._name}|sequence")
+        key = f"{self._item_prefix}{sequence:020d}"
+        await self._storage.set(key, data)
+        self._put_event.set()
+        return key
+
+    async def claim(self) -> QueueItem | None:
+        """Lease the oldest item that has no live lease."""
+        # A put after this point wakes waiters again
+        self._put_event.clear()
+        owner = uuid.uuid4().hex
+        start_after: str | None = None
+        while True:
+            items = self._storage.iterate(
+                self._item_prefix, start_after=start_after, limit=self._page_size
+            )
+            page = [item async for item in items]
+            if len(page) == 0:
+                return None
+            lease_keys = [self._lease_key(key) for key, _ in page]
+            if isinstance(self._storage, BatchStorageProtocol):
+                leases = await self._storage.get_many(lease_keys)
+            else:
+                leases = {key: await self._storage.get(key) for key in lease_keys}
+            for (key, data), lease_key in zip(page, lease_keys, strict=True):
+                if leases[lease_key] is None and await self._atomic.compare_and_set(
+                    lease_key, None, owner, ttl=self._lease_ttl
+                ):
+                    # The item may be acked since the page was read
+                    if not await self._exists(key):
+                        await self._storage.delete(lease_key)
+                        continue
+                    return QueueItem(key, data, owner)
+            start_after = page[-1][0]
+
+    async def _exists(self, key: str) -> bool:
+        # Items may hold null, so look the key up instead of the value
+        async for _ in self._storage.iterate(key, limit=1):
+            return True
+        return False
+
+    async def renew(self, item: QueueItem) -> bool:
+        """Extend the lease, False when it was lost."""
+        return await self._atomic.compare_and_set(
+            self._lease_key(item.key), item.owner, item.owner, ttl=self._lease_ttl
+        )
+
+    async def ack(self, item: QueueItem) -> None:
+        keys = (item.key, self._lease_key(item.key))
+        if isinstance(self._storage, BatchStorageProtocol):
+            await self._storage.delete_many(keys)
+        else:
+            for key in keys:
+                await self._storage.delete(key)
+
+    async def release(self, item: QueueItem) -> None:
+        """Give the item back for another consumer to claim."""
+        # The released lease expires and is reaped like a lost one
+        _ = await self._atomic.compare_and_set(
+            self._lease_key(item.key), item.owner, None, ttl=self._lease_ttl
+        )
+
+    async def wait(self, timeout: float) -> None:
+        """Wait for a put in this process since the last claim.
+
+        Puts by other processes are not seen, so consumers should wait
+        with a timeout and claim again.
+        """
+        with suppress(TimeoutError):
+            _ = await asyncio.wait_for(self._put_event.wait(), timeout)
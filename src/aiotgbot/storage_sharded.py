@@ -0,0 +1,288 @@
+import asyncio
+import heapq
+import zlib
+from collections import defaultdict
+from collections.abc import AsyncGenerator, AsyncIterator, Iterable, Sequence
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+from typing import Final
+
+from typing_extensions import override  # Python 3.11 compatibility
+
+from .helpers import Json
+from .storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
+
+__all__ = ("ShardedStorage", "shard_key")
+
+
+def shard_key(key: str) -> str:
+    """Return the part of the key that selects its shard.
+
+    Keys with at least three ``|``-separated parts, such as
+    ``state|<user>|<chat>``, are routed by their last two parts, so all
+    keys of one user and chat land on the same shard.
+    """
+    parts = key.rsplit("|", 2)
+    if len(parts) < 3:
+        return key
+    return f"{parts[1]}|{parts[2]}"
+
+
+class _Transaction:
+    def __init__(self) -> None:
+        self.stack: Final[AsyncExitStack] = AsyncExitStack()
+        self.entered: Final[set[int]] = set()
+
+
+class ShardedStorage(
+    StorageProtocol,
+    TransactionalStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+):
+    """Storage that spreads keys over several storages by a stable hash.
+
+    A transaction enters the transaction of each shard it touches and
+    commits them one after another, so it is atomic only when it stays
+    on one shard. Iteration merges the shards in key order.
+    """
+
+    def __init__(self, shards: Sequence[StorageProtocol]) -> None:
+        if len(shards) == 0:
+            raise ValueError("At least one shard is required")
+        self._shards: Final[tuple[StorageProtocol, ...]] = tuple(shards)
+        self._transaction: Final[ContextVar[_Transaction | None]] = ContextVar(
+            f"sharded_storage_{id(self)}",
+            default=None,
+        )
+
+    @property
+    def shards(self) -> tuple[StorageProtocol, ...]:
+        return self._shards
+
+    def shard_index(self, key: str) -> int:
+        return zlib.crc32(shard_key(key).encode()) % len(self._shards)
+
+    @override
+    async def connect(self) -> None:
+        _ = await asyncio.gather(*(shard.connect() for shard in self._shards))
+
+    @override
+    async def close(self) -> None:
+        _ = await asyncio.gather(*(shard.close() for shard in self._shards))
+
+    @override
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        if self._transaction.get() is not None:
+            yield
+            return
+        transaction = _Transaction()
+        token = self._transaction.set(transaction)
+        try:
+            async with transaction.stack:
+                yield
+        finally:
+            self._transaction.reset(token)
+
+    async def _shard(self, index: int) -> StorageProtocol:
+        shard = self._shards[index]
+        transaction = self._transaction.get()
+        if (
+            transaction is not None
+            and index not in transaction.entered
+            and isinstance(shard, TransactionalStorageProtocol)
+        ):
+            await transaction.stack.enter_async_context(shard.transaction())
+            transaction.entered.add(index)
+        return shard
+
+    async def _key_shard(self, key: str) -> StorageProtocol:
+        return await self._shard(self.shard_index(key))
+
+    async def _atomic_shard(self, key: str) -> AtomicStorageProtocol:
+        shard = await self._key_shard(key)
+        if not isinstance(shard, AtomicStorageProtocol):
+            raise TypeError(
+                f"{type(shard).__name__} does not support atomic operations"
+            )
+        return shard
+
+    @override
+    async def set(
+        self, key: str, value: Json | None = None, *, ttl: float | None = None
+    ) -> None:
+        shard = await self._key_shard(key)
+        if ttl is not None:
+            await shard.set(key, value, ttl=ttl)
+        else:
+            await shard.set(key, value)
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        items_by_shard: defaultdict[int, list[tuple[str, Json]]] = defaultdict(list)
+        for key, value in items:
+            items_by_shard[self.shard_index(key)].append((key, value))
+        for index, shard_items in items_by_shard.items():
+            shard = await self._shard(index)
+            if isinstance(shard, BatchStorageProtocol):
+                await shard.set_many(shard_items, ttl=ttl)
+            elif ttl is not None:
+                for key, value in shard_items:
+                    await shard.set(key, value, ttl=ttl)
+            else:
+                for key, value in shard_items:
+                    await shard.set(key, value)
+
+    @override
+    async def get(self, key: str) -> Json:
+        return await (await self._key_shard(key)).get(key)
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        values: dict[str, Json] = dict.fromkeys(keys)
+        keys_by_shard: defaultdict[int, list[str]] = defaultdict(list)
+        for key in values:
+            keys_by_shard[self.shard_index(key)].append(key)
+        for index, shard_keys in keys_by_shard.items():
+            shard = await self._shard(index)
+            if isinstance(shard, BatchStorageProtocol):
+                values.update(await shard.get_many(shard_keys))
+            else:
+                for key in shard_keys:
+                    values[key] = await shard.get(key)
+        return values
+
+    @override
+    async def delete(self, key: str) -> None:
+        await (await self._key_shard(key)).delete(key)
+
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        keys_by_shard: defaultdict[int, list[str]] = defaultdict(list)
+        for key in keys:
+            keys_by_shard[self.shard_index(key)].append(key)
+        for index, shard_keys in keys_by_shard.items():
+            shard = await self._shard(index)
+            if isinstance(shard, BatchStorageProtocol):
+                await shard.delete_many(shard_keys)
+            else:
+                for key in shard_keys:
+                    await shard.delete(key)
+
+    @override
+    async def incr(self, key: str, amount: int = 1, *, ttl: float | None = None) -> int:
+        shard = await self._atomic_shard(key)
+        return await shard.incr(key, amount, ttl=ttl)
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        shard = await self._atomic_shard(key)
+        return await shard.compare_and_set(key, expected, value, ttl=ttl)
+
+    @override
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool:
+        shard = await self._atomic_shard(key)
+        return await shard.set_if_absent(key, value, ttl=ttl)
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        item_list = list(items)
+        index = self.shard_index(fence_key)
+        if any(self.shard_index(key) != index for key, _ in item_list):
+            raise ValueError("Fenced items must be on the shard of the fence key")
+        shard = await self._shard(index)
+        if not isinstance(shard, FencedStorageProtocol):
+            raise TypeError(f"{type(shard).__name__} does not support fenced writes")
+        return await shard.set_many_fenced(fence_key, token, item_list, ttl=ttl)
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        deleted = 0
+        for shard in self._shards:
+            if deleted >= limit:
+                break
+            if isinstance(shard, ExpiringStorageProtocol):
+                deleted += await shard.delete_expired(limit - deleted)
+        return deleted
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        keys_by_shard: defaultdict[int, list[str]] = defaultdict(list)
+        for key in keys:
+            keys_by_shard[self.shard_index(key)].append(key)
+        expiry: dict[str, float] = {}
+        for index, shard_keys in keys_by_shard.items():
+            shard = await self._shard(index)
+            if isinstance(shard, ExpiringStorageProtocol):
+                expiry.update(await shard.get_expiry_many(shard_keys))
+        return expiry
+
+    @override
+    async def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]:
+        iterators = [
+            shard.iterate(prefix, start_after=start_after, limit=limit)
+            for shard in self._shards
+        ]
+        try:
+            heap: list[tuple[str, int, Json]] = []
+            for index, iterator in enumerate(iterators):
+                async for key, value in iterator:
+                    heap.append((key, index, value))
+                    break
+            heapq.heapify(heap)
+            count = 0
+            while len(heap) > 0 and (limit is None or count < limit):
+                key, index, value = heap[0]
+                yield key, value
+                count += 1
+                async for next_key, next_value in iterators[index]:
+                    _ = heapq.heapreplace(heap, (next_key, index, next_value))
+                    break
+                else:
+                    _ = heapq.heappop(heap)
+        finally:
+            for iterator in iterators:
+                if isinstance(iterator, AsyncGenerator):
+                    await iterator.aclose()
+
+    @override
+    async def clear(self) -> None:
+        _ = await asyncio.gather(*(shard.clear() for shard in self._shards))
+
+    @override
+    def raw_connection(self) -> tuple[object, ...]:
+        return tuple(shard.raw_connection() for shard in self._shards)
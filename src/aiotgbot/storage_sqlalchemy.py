@@ -1,14 +1,44 @@
-from collections.abc import AsyncIterator
+import time
+from collections.abc import AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import Final, cast
 
-from sqlalchemy import JSON, Text, delete, insert, select, update
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    ColumnElement,
+    Connection,
+    Float,
+    Insert,
+    Integer,
+    Text,
+    case,
+    collate,
+    delete,
+    insert,
+    inspect,
+    literal,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from typing_extensions import override  # Python 3.11 compatibility
 
-from .helpers import Json
-from .storage import StorageProtocol
+from .helpers import Json, expiry_time, prefix_successor
+from .storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
 
 __all__ = ("SqlalchemyStorage",)
 
@@ -20,65 +50,454 @@ class Base(DeclarativeBase):
 class KV(Base):
     __tablename__: str = "kv"
 
-    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    key: Mapped[str] = mapped_column(
+        Text().with_variant(Text(collation="C"), "postgresql"), primary_key=True
+    )
     value: Mapped[Json] = mapped_column(JSON)
+    expires_at: Mapped[float | None] = mapped_column(Float, index=True)
 
 
-class SqlalchemyStorage(StorageProtocol):
+def _upsert_statement(dialect_name: str) -> Insert | None:
+    if dialect_name == "postgresql":
+        pg_statement = postgresql.insert(KV)
+        return pg_statement.on_conflict_do_update(
+            index_elements=[KV.key],
+            set_={
+                "value": pg_statement.excluded.value,
+                "expires_at": pg_statement.excluded.expires_at,
+            },
+        )
+    if dialect_name == "sqlite":
+        sqlite_statement = sqlite.insert(KV)
+        return sqlite_statement.on_conflict_do_update(
+            index_elements=[KV.key],
+            set_={
+                "value": sqlite_statement.excluded.value,
+                "expires_at": sqlite_statement.excluded.expires_at,
+            },
+        )
+    if dialect_name in ("mysql", "mariadb"):
+        mysql_statement = mysql.insert(KV)
+        return mysql_statement.on_duplicate_key_update(
+            value=mysql_statement.inserted.value,
+            expires_at=mysql_statement.inserted.expires_at,
+        )
+    return None
+
+
+def _conflict_insert(
+    dialect_name: str,
+) -> postgresql.Insert | sqlite.Insert | None:
+    if dialect_name == "postgresql":
+        return postgresql.insert(KV)
+    if dialect_name == "sqlite":
+        return sqlite.insert(KV)
+    return None
+
+
+def _is_integer(dialect_name: str) -> ColumnElement[bool]:
+    value: ColumnElement[str] = KV.value.cast(Text)
+    if dialect_name == "postgresql":
+        return value.regexp_match("^-?[0-9]+$")
+    return value.cast(Integer).cast(Text) == value
+
+
+def _migrate(connection: Connection) -> None:
+    columns = {column["name"] for column in inspect(connection).get_columns("kv")}
+    if "expires_at" not in columns:
+        column_type = Float().compile(dialect=connection.dialect)
+        _ = connection.execute(
+            text(f"ALTER TABLE kv ADD COLUMN expires_at {column_type}")
+        )
+    for index in Base.metadata.tables["kv"].indexes:
+        index.create(connection, checkfirst=True)
+
+
+# Binary collations make key order match the code point order of str
+KEY_COLLATIONS: Final[dict[str, str]] = {
+    "postgresql": "C",
+    "mysql": "utf8mb4_bin",
+    "mariadb": "utf8mb4_bin",
+}
+
+
+def _alive(now: float) -> ColumnElement[bool]:
+    return or_(KV.expires_at.is_(None), KV.expires_at > now)
+
+
+def _null_or_expired(now: float) -> ColumnElement[bool]:
+    return or_(KV.value.cast(Text) == "null", KV.expires_at <= now)
+
+
+class SqlalchemyStorage(
+    StorageProtocol,
+    TransactionalStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+):
     def __init__(self, engine: AsyncEngine) -> None:
         self._engine: Final = engine
+        self._upsert: Final = _upsert_statement(engine.dialect.name)
+        collation = KEY_COLLATIONS.get(engine.dialect.name)
+        self._key: Final[ColumnElement[str]] = (
+            collate(KV.key, collation) if collation is not None else KV.key.expression
+        )
+        self._connection: Final[ContextVar[AsyncConnection | None]] = ContextVar(
+            f"sqlalchemy_storage_{id(self)}",
+            default=None,
+        )
 
     @override
     async def connect(self) -> None:
         async with self._engine.begin() as connection:
             await connection.run_sync(Base.metadata.create_all)
+            await connection.run_sync(_migrate)
 
     @override
     async def close(self) -> None:
         pass
 
     @override
-    async def set(self, key: str, value: Json | None = None) -> None:
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        if self._connection.get() is not None:
+            yield
+            return
         async with self._engine.begin() as connection:
+            token = self._connection.set(connection)
             try:
-                async with connection.begin_nested():
-                    _ = await connection.execute(
-                        insert(KV).values(key=key, value=value)
-                    )
-            except IntegrityError:
+                yield
+            finally:
+                self._connection.reset(token)
+
+    @asynccontextmanager
+    async def _begin(self) -> AsyncIterator[AsyncConnection]:
+        connection = self._connection.get()
+        if connection is not None:
+            yield connection
+            return
+        async with self._engine.begin() as connection:
+            yield connection
+
+    async def _set(
+        self,
+        connection: AsyncConnection,
+        key: str,
+        value: Json,
+        expires_at: float | None,
+    ) -> None:
+        try:
+            async with connection.begin_nested():
                 _ = await connection.execute(
-                    update(KV).where(KV.key == key).values(value=value)
+                    insert(KV).values(key=key, value=value, expires_at=expires_at)
                 )
+        except IntegrityError:
+            _ = await connection.execute(
+                update(KV)
+                .where(KV.key == key)
+                .values(value=value, expires_at=expires_at)
+            )
+
+    @override
+    async def set(
+        self, key: str, value: Json | None = None, *, ttl: float | None = None
+    ) -> None:
+        expires_at = expiry_time(ttl)
+        async with self._begin() as connection:
+            if self._upsert is not None:
+                _ = await connection.execute(
+                    self._upsert,
+                    {"key": key, "value": value, "expires_at": expires_at},
+                )
+            else:
+                await self._set(connection, key, value, expires_at)
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        item_list = list(items)
+        if len(item_list) == 0:
+            return
+        async with self._begin() as connection:
+            await self._set_many(connection, item_list, expiry_time(ttl))
+
+    async def _set_many(
+        self,
+        connection: AsyncConnection,
+        items: list[tuple[str, Json]],
+        expires_at: float | None,
+    ) -> None:
+        if self._upsert is not None:
+            _ = await connection.execute(
+                self._upsert,
+                [
+                    {"key": key, "value": value, "expires_at": expires_at}
+                    for key, value in items
+                ],
+            )
+        else:
+            for key, value in items:
+                await self._set(connection, key, value, expires_at)
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        item_list = list(items)
+        expires_at = expiry_time(ttl)
+        statement = _conflict_insert(self._engine.dialect.name)
+        async with self._begin() as connection:
+            if statement is None:
+                current = await self._locked_lookup(connection, fence_key)
+                stored = current[0] if current is not None else None
+                if isinstance(stored, int) and stored > token:
+                    return False
+                await self._set(connection, fence_key, token, expires_at)
+            else:
+                stored_token = KV.value.cast(Text).cast(BigInteger)
+                result = await connection.execute(
+                    statement.values(
+                        key=fence_key, value=token, expires_at=expires_at
+                    ).on_conflict_do_update(
+                        index_elements=[KV.key],
+                        set_={"value": token, "expires_at": expires_at},
+                        where=or_(
+                            KV.expires_at <= time.time(),
+                            case(
+                                (
+                                    _is_integer(self._engine.dialect.name),
+                                    stored_token <= token,
+                                ),
+                                else_=literal(True),
+                            ),
+                        ),
+                    )
+                )
+                if result.rowcount != 1:
+                    return False
+            if len(item_list) > 0:
+                await self._set_many(connection, item_list, expires_at)
+        return True
+
+    async def _locked_lookup(
+        self, connection: AsyncConnection, key: str
+    ) -> tuple[Json, float | None] | None:
+        result = await connection.execute(
+            select(KV.value, KV.expires_at)
+            .where(KV.key == key, _alive(time.time()))
+            .with_for_update()
+        )
+        row = result.one_or_none()
+        return (row.value, row.expires_at) if row is not None else None
+
+    @override
+    async def incr(self, key: str, amount: int = 1, *, ttl: float | None = None) -> int:
+        expires_at = expiry_time(ttl)
+        statement = _conflict_insert(self._engine.dialect.name)
+        async with self._begin() as connection:
+            if statement is None:
+                current = await self._locked_lookup(connection, key)
+                if current is not None and current[0] is not None:
+                    value, expires_at = current
+                    if not isinstance(value, int) or isinstance(value, bool):
+                        raise ValueError(f"Value of {key!r} is not an integer")
+                    amount += value
+                await self._set(connection, key, amount, expires_at)
+                return amount
+            reset = _null_or_expired(time.time())
+            incremented = (KV.value.cast(Text).cast(BigInteger) + amount).cast(Text)
+            result = await connection.execute(
+                statement
+                .values(key=key, value=amount, expires_at=expires_at)
+                .on_conflict_do_update(
+                    index_elements=[KV.key],
+                    set_={
+                        "value": case(
+                            (reset, statement.excluded.value),
+                            else_=incremented.cast(JSON),
+                        ),
+                        "expires_at": case(
+                            (reset, statement.excluded.expires_at),
+                            else_=KV.expires_at,
+                        ),
+                    },
+                    where=or_(reset, _is_integer(self._engine.dialect.name)),
+                )
+                .returning(KV.value.cast(Text))
+            )
+            value_str = result.scalar()
+            if value_str is None:
+                raise ValueError(f"Value of {key!r} is not an integer")
+            return int(value_str)
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        statement = _conflict_insert(self._engine.dialect.name)
+        async with self._begin() as connection:
+            if statement is None:
+                current = await self._locked_lookup(connection, key)
+                if (current[0] if current is not None else None) != expected:
+                    return False
+                await self._set(connection, key, value, expires_at)
+                return True
+            if expected is None:
+                result = await connection.execute(
+                    statement.values(
+                        key=key, value=value, expires_at=expires_at
+                    ).on_conflict_do_update(
+                        index_elements=[KV.key],
+                        set_={"value": value, "expires_at": expires_at},
+                        where=_null_or_expired(time.time()),
+                    )
+                )
+            else:
+                result = await connection.execute(
+                    update(KV)
+                    .where(
+                        KV.key == key,
+                        _alive(time.time()),
+                        KV.value.cast(Text) == literal(expected, JSON).cast(Text),
+                    )
+                    .values(value=value, expires_at=expires_at)
+                )
+            return result.rowcount == 1
+
+    @override
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        statement = _conflict_insert(self._engine.dialect.name)
+        async with self._begin() as connection:
+            if statement is None:
+                if await self._locked_lookup(connection, key) is not None:
+                    return False
+                await self._set(connection, key, value, expires_at)
+                return True
+            result = await connection.execute(
+                statement.values(
+                    key=key, value=value, expires_at=expires_at
+                ).on_conflict_do_update(
+                    index_elements=[KV.key],
+                    set_={"value": value, "expires_at": expires_at},
+                    where=KV.expires_at <= time.time(),
+                )
+            )
+            return result.rowcount == 1
 
     @override
     async def get(self, key: str) -> Json:
-        async with self._engine.begin() as connection:
-            result = await connection.execute(select(KV.value).where(KV.key == key))
+        async with self._begin() as connection:
+            result = await connection.execute(
+                select(KV.value).where(KV.key == key, _alive(time.time()))
+            )
             return result.scalar()
 
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        values: dict[str, Json] = dict.fromkeys(keys)
+        if len(values) == 0:
+            return values
+        async with self._begin() as connection:
+            result = await connection.execute(
+                select(KV.key, KV.value).where(
+                    KV.key.in_(list(values)), _alive(time.time())
+                )
+            )
+            for key, value in result:
+                values[key] = value
+        return values
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        key_list = list(keys)
+        if len(key_list) == 0:
+            return {}
+        async with self._begin() as connection:
+            result = await connection.execute(
+                select(KV.key, KV.expires_at).where(
+                    KV.key.in_(key_list), KV.expires_at > time.time()
+                )
+            )
+            return {
+                key: expires_at for key, expires_at in result if expires_at is not None
+            }
+
     @override
     async def delete(self, key: str) -> None:
-        async with self._engine.begin() as connection:
+        async with self._begin() as connection:
             _ = await connection.execute(delete(KV).where(KV.key == key))
 
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        key_list = list(keys)
+        if len(key_list) == 0:
+            return
+        async with self._begin() as connection:
+            _ = await connection.execute(delete(KV).where(KV.key.in_(key_list)))
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        now = time.time()
+        async with self._begin() as connection:
+            result = await connection.execute(
+                select(KV.key).where(KV.expires_at <= now).limit(limit)
+            )
+            keys = list(result.scalars())
+            if len(keys) == 0:
+                return 0
+            deleted = await connection.execute(
+                delete(KV).where(KV.key.in_(keys), KV.expires_at <= now)
+            )
+            return deleted.rowcount
+
     @override
     async def iterate(
         self,
         prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
     ) -> AsyncIterator[tuple[str, Json]]:
-        async with self._engine.begin() as connection:
+        key = self._key
+        statement = (
+            select(KV.key, KV.value)
+            .where(key >= prefix, _alive(time.time()))
+            .order_by(key)
+            .limit(limit)
+        )
+        successor = prefix_successor(prefix)
+        if successor is not None:
+            statement = statement.where(key < successor)
+        if start_after is not None:
+            statement = statement.where(key > start_after)
+        async with self._begin() as connection:
             stream = cast(
                 AsyncIterator[tuple[str, Json]],
-                await connection.stream(
-                    select(KV.key, KV.value).where(KV.key.startswith(prefix))
-                ),
+                await connection.stream(statement),
             )
-            async for key, value in stream:
-                yield key, value
+            async for item_key, value in stream:
+                yield item_key, value
 
     @override
     async def clear(self) -> None:
-        async with self._engine.begin() as connection:
+        async with self._begin() as connection:
             _ = await connection.execute(delete(KV))
 
     @override
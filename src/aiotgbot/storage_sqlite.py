@@ -1,17 +1,93 @@
 import asyncio
 import json
-from collections.abc import AsyncIterator
+import time
+from collections.abc import AsyncIterator, Iterable
+from contextlib import asynccontextmanager, suppress
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Final, TypedDict, Unpack, cast
+from typing import Final, Literal, TypedDict, Unpack, cast
 
 import aiosqlite
 from typing_extensions import override  # Python 3.11 compatibility
 
-from .helpers import Json, json_dumps
-from .storage import StorageProtocol
+from .helpers import Json, expiry_time, json_dumps, prefix_successor
+from .storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
 
 __all__ = ("SQLiteStorage",)
 
+JournalMode = Literal["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+Synchronous = Literal["OFF", "NORMAL", "FULL", "EXTRA"]
+
+JOURNAL_MODES: Final[frozenset[str]] = frozenset((
+    "DELETE",
+    "TRUNCATE",
+    "PERSIST",
+    "MEMORY",
+    "WAL",
+    "OFF",
+))
+ITERATE_PAGE_SIZE: Final[int] = 100
+SYNCHRONOUS_MODES: Final[frozenset[str]] = frozenset(("OFF", "NORMAL", "FULL", "EXTRA"))
+UPSERT_QUERY: Final[str] = (
+    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)"
+)
+DELETE_QUERY: Final[str] = "DELETE FROM kv WHERE key = ?"
+GET_QUERY: Final[str] = (
+    "SELECT value, expires_at FROM kv WHERE key = ? "
+    + "AND (expires_at IS NULL OR expires_at > ?)"
+)
+INCR_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES (?1, ?2, ?3) "
+    + "ON CONFLICT (key) DO UPDATE SET "
+    + "value = CASE WHEN kv.value = 'null' OR kv.expires_at <= ?4 "
+    + "THEN excluded.value "
+    + "ELSE CAST(kv.value AS INTEGER) + CAST(excluded.value AS INTEGER) END, "
+    + "expires_at = CASE WHEN kv.value = 'null' OR kv.expires_at <= ?4 "
+    + "THEN excluded.expires_at ELSE kv.expires_at END "
+    + "WHERE kv.value = 'null' OR kv.expires_at <= ?4 "
+    + "OR CAST(CAST(kv.value AS INTEGER) AS TEXT) = kv.value "
+    + "RETURNING value"
+)
+COMPARE_AND_SET_QUERY: Final[str] = (
+    "UPDATE kv SET value = ?, expires_at = ? WHERE key = ? AND value = ? "
+    + "AND (expires_at IS NULL OR expires_at > ?)"
+)
+SET_IF_NULL_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES (?1, ?2, ?3) "
+    + "ON CONFLICT (key) DO UPDATE SET "
+    + "value = excluded.value, expires_at = excluded.expires_at "
+    + "WHERE kv.value = 'null' OR kv.expires_at <= ?4"
+)
+SET_IF_ABSENT_QUERY: Final[str] = (
+    "INSERT INTO kv (key, value, expires_at) VALUES (?1, ?2, ?3) "
+    + "ON CONFLICT (key) DO UPDATE SET "
+    + "value = excluded.value, expires_at = excluded.expires_at "
+    + "WHERE kv.expires_at <= ?4"
+)
+GET_MANY_QUERY: Final[str] = (
+    "SELECT key, value FROM kv WHERE key IN ({}) "
+    + "AND (expires_at IS NULL OR expires_at > ?)"
+)
+GET_EXPIRY_MANY_QUERY: Final[str] = (
+    "SELECT key, expires_at FROM kv WHERE key IN ({}) AND expires_at > ?"
+)
+# Stays below the default SQLite limit of host parameters per statement
+GET_MANY_CHUNK_SIZE: Final[int] = 500
+DELETE_EXPIRED_QUERY: Final[str] = (
+    "DELETE FROM kv WHERE key IN "
+    + "(SELECT key FROM kv WHERE expires_at <= ? LIMIT ?)"
+)
+
+# Encoded value and expiry time of a pending write, None for a deletion
+_Write = tuple[str, float | None] | None
+
 
 class _ConnectKwargs(TypedDict, total=False):
     timeout: float
@@ -24,18 +100,77 @@ class _ConnectKwargs(TypedDict, total=False):
     iter_chunk_size: int
 
 
-class SQLiteStorage(StorageProtocol):
+class SQLiteStorage(
+    StorageProtocol,
+    TransactionalStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+):
+    """SQLite storage.
+
+    Transactions buffer their writes and commit them as one batch on
+    exit, reads inside a transaction see the buffered writes, iteration
+    does not. Atomic operations inside a transaction are evaluated
+    against the transaction view and committed with it.
+    """
+
     def __init__(
         self,
         database: str | Path,
         *,
         isolation_level: str | None = None,
+        journal_mode: JournalMode | None = None,
+        synchronous: Synchronous | None = None,
+        commit_delay: float | None = None,
+        commit_batch_size: int = 1000,
+        read_connections: int = 0,
         **kwargs: Unpack[_ConnectKwargs],
     ) -> None:
+        if journal_mode is not None and journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode {journal_mode!r}")
+        if synchronous is not None and synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown synchronous mode {synchronous!r}")
+        if commit_delay is not None:
+            if commit_delay < 0:
+                raise ValueError("commit_delay must be non-negative")
+            if isolation_level is not None:
+                raise ValueError("Group commit requires isolation_level=None")
+        if commit_batch_size <= 0:
+            raise ValueError("commit_batch_size must be positive")
+        if read_connections < 0:
+            raise ValueError("read_connections must be non-negative")
+        if read_connections > 0:
+            if str(database) in ("", ":memory:"):
+                raise ValueError("Read connections require a file database")
+            # Readers of other journal modes block writers until done
+            if journal_mode != "WAL":
+                raise ValueError("Read connections require journal_mode='WAL'")
+            if isolation_level is not None:
+                raise ValueError("Read connections require isolation_level=None")
         self._database: Final[str | Path] = database
         self._isolation_level: Final[str | None] = isolation_level
+        self._journal_mode: Final[JournalMode | None] = journal_mode
+        self._synchronous: Final[Synchronous | None] = synchronous
+        self._commit_delay: Final[float | None] = commit_delay
+        self._commit_batch_size: Final[int] = commit_batch_size
+        self._read_connections: Final[int] = read_connections
         self._kwargs: Final[_ConnectKwargs] = kwargs
         self._connection: aiosqlite.Connection | None = None
+        self._readers: list[aiosqlite.Connection] = []
+        self._idle_readers: asyncio.Queue[aiosqlite.Connection] | None = None
+        self._pending: dict[str, _Write] = {}
+        self._waiters: list[asyncio.Future[None]] = []
+        self._wakeup: Final[asyncio.Event] = asyncio.Event()
+        self._batch_full: Final[asyncio.Event] = asyncio.Event()
+        self._write_lock: Final[asyncio.Lock] = asyncio.Lock()
+        self._commit_task: asyncio.Task[None] | None = None
+        self._closing: bool = False
+        self._transaction: Final[ContextVar[dict[str, _Write] | None]] = ContextVar(
+            f"sqlite_storage_{id(self)}",
+            default=None,
+        )
 
     @override
     async def connect(self) -> None:
@@ -47,12 +182,38 @@ class SQLiteStorage(StorageProtocol):
             **self._kwargs,
         )
         self._connection = connection
+        if self._journal_mode is not None:
+            _ = await connection.execute(f"PRAGMA journal_mode = {self._journal_mode}")
+        if self._synchronous is not None:
+            _ = await connection.execute(f"PRAGMA synchronous = {self._synchronous}")
         async with connection.cursor() as cursor:
             query = (
                 "CREATE TABLE IF NOT EXISTS kv "
                 + "(key TEXT NOT NULL PRIMARY KEY, value TEXT NOT NULL)"
             )
             _ = await cursor.execute(query)
+            _ = await cursor.execute("PRAGMA table_info(kv)")
+            columns = {cast(str, row[1]) for row in await cursor.fetchall()}
+            if "expires_at" not in columns:
+                _ = await cursor.execute("ALTER TABLE kv ADD COLUMN expires_at REAL")
+            _ = await cursor.execute(
+                "CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at) "
+                + "WHERE expires_at IS NOT NULL"
+            )
+        if self._read_connections > 0:
+            self._idle_readers = asyncio.Queue()
+            for _ in range(self._read_connections):
+                reader = await aiosqlite.connect(
+                    self._database,
+                    isolation_level=None,
+                    **self._kwargs,
+                )
+                _ = await reader.execute("PRAGMA query_only = ON")
+                self._readers.append(reader)
+                self._idle_readers.put_nowait(reader)
+        if self._commit_delay is not None:
+            self._closing = False
+            self._commit_task = asyncio.create_task(self._commit_loop())
 
     @property
     def connection(self) -> aiosqlite.Connection:
@@ -64,46 +225,375 @@ class SQLiteStorage(StorageProtocol):
     async def close(self) -> None:
         if self._connection is None:
             raise RuntimeError("Not connected")
+        if self._commit_task is not None:
+            if not self._commit_task.done():
+                self._closing = True
+                self._wakeup.set()
+                self._batch_full.set()
+                await self._commit_task
+            self._commit_task = None
+        for reader in self._readers:
+            await reader.close()
+        self._readers.clear()
+        self._idle_readers = None
         await self._connection.close()
         self._connection = None
 
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        connection = self.connection
+        idle_readers = self._idle_readers
+        if idle_readers is None:
+            yield connection
+            return
+        reader = await idle_readers.get()
+        try:
+            yield reader
+        finally:
+            idle_readers.put_nowait(reader)
+
     @override
-    async def set(self, key: str, value: Json | None = None) -> None:
-        async with self.connection.cursor() as cursor:
-            _ = await cursor.execute(
-                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
-                (key, json_dumps(value)),
-            )
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        if self._transaction.get() is not None:
+            yield
+            return
+        writes: dict[str, _Write] = {}
+        token = self._transaction.set(writes)
+        try:
+            yield
+        finally:
+            self._transaction.reset(token)
+        if len(writes) > 0:
+            await self._write(writes)
+
+    async def _write(self, writes: dict[str, _Write]) -> None:
+        transaction = self._transaction.get()
+        if transaction is not None:
+            transaction.update(writes)
+            return
+        connection = self.connection
+        if self._commit_task is None:
+            async with self._write_lock:
+                await self._execute(connection, writes)
+            return
+        if self._commit_task.done():
+            raise RuntimeError("Commit loop stopped")
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending.update(writes)
+        self._waiters.append(waiter)
+        self._wakeup.set()
+        if len(self._pending) >= self._commit_batch_size:
+            self._batch_full.set()
+        await waiter
+
+    @staticmethod
+    async def _execute(
+        connection: aiosqlite.Connection,
+        writes: dict[str, _Write],
+    ) -> None:
+        if len(writes) == 1:
+            ((key, write),) = writes.items()
+            if write is not None:
+                _ = await connection.execute(UPSERT_QUERY, (key, *write))
+            else:
+                _ = await connection.execute(DELETE_QUERY, (key,))
+            return
+        upserts = [(key, *write) for key, write in writes.items() if write is not None]
+        deletes = [(key,) for key, write in writes.items() if write is None]
+        _ = await connection.execute("BEGIN")
+        try:
+            if len(upserts) > 0:
+                _ = await connection.executemany(UPSERT_QUERY, upserts)
+            if len(deletes) > 0:
+                _ = await connection.executemany(DELETE_QUERY, deletes)
+        except BaseException:
+            await connection.rollback()
+            raise
+        await connection.commit()
+
+    async def _commit_loop(self) -> None:
+        assert self._commit_delay is not None
+        waiters: list[asyncio.Future[None]] = []
+        try:
+            while True:
+                _ = await self._wakeup.wait()
+                if not self._closing:
+                    with suppress(TimeoutError):
+                        async with asyncio.timeout(self._commit_delay):
+                            _ = await self._batch_full.wait()
+                self._wakeup.clear()
+                self._batch_full.clear()
+                pending, waiters = self._pending, self._waiters
+                self._pending, self._waiters = {}, []
+                if len(pending) > 0:
+                    await self._commit(pending, waiters)
+                if self._closing and len(self._pending) == 0:
+                    return
+        finally:
+            # Nothing commits the writes left once the loop is gone
+            waiters, self._waiters = [*waiters, *self._waiters], []
+            self._pending.clear()
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(RuntimeError("Commit loop stopped"))
+
+    async def _commit(
+        self,
+        pending: dict[str, _Write],
+        waiters: list[asyncio.Future[None]],
+    ) -> None:
+        try:
+            async with self._write_lock:
+                await self._execute(self.connection, pending)
+        except Exception as exception:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(exception)
+        else:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
 
     @override
-    async def get(self, key: str) -> Json:
-        async with self.connection.cursor() as cursor:
-            _ = await cursor.execute("SELECT value FROM kv WHERE key = ?", (key,))
+    async def set(
+        self, key: str, value: Json | None = None, *, ttl: float | None = None
+    ) -> None:
+        await self._write({key: (json_dumps(value), expiry_time(ttl))})
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        expires_at = expiry_time(ttl)
+        writes: dict[str, _Write] = {
+            key: (json_dumps(value), expires_at) for key, value in items
+        }
+        if len(writes) > 0:
+            await self._write(writes)
+
+    async def _lookup(self, key: str) -> _Write:
+        now = time.time()
+        transaction = self._transaction.get()
+        if transaction is not None and key in transaction:
+            write = transaction[key]
+            if write is None or (write[1] is not None and write[1] <= now):
+                return None
+            return write
+        async with self._reader() as reader, reader.cursor() as cursor:
+            _ = await cursor.execute(GET_QUERY, (key, now))
             row = await cursor.fetchone()
             if row is not None:
-                value_str = cast(str, row[0])
-                return cast(Json, json.loads(value_str))
+                return cast(str, row[0]), cast(float | None, row[1])
             return None
 
+    @override
+    async def get(self, key: str) -> Json:
+        current = await self._lookup(key)
+        if current is not None:
+            return cast(Json, json.loads(current[0]))
+        return None
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        now = time.time()
+        values: dict[str, Json] = dict.fromkeys(keys)
+        transaction = self._transaction.get() or {}
+        missing: list[str] = []
+        for key in values:
+            if key not in transaction:
+                missing.append(key)
+                continue
+            write = transaction[key]
+            if write is not None and (write[1] is None or write[1] > now):
+                values[key] = cast(Json, json.loads(write[0]))
+        async with self._reader() as reader, reader.cursor() as cursor:
+            for start in range(0, len(missing), GET_MANY_CHUNK_SIZE):
+                chunk = missing[start : start + GET_MANY_CHUNK_SIZE]
+                query = GET_MANY_QUERY.format(", ".join("?" * len(chunk)))
+                _ = await cursor.execute(query, (*chunk, now))
+                async for row in cursor:
+                    values[cast(str, row[0])] = cast(Json, json.loads(row[1]))
+        return values
+
     @override
     async def delete(self, key: str) -> None:
-        async with self.connection.cursor() as cursor:
-            _ = await cursor.execute("DELETE FROM kv WHERE key = ?", (key,))
+        await self._write({key: None})
+
+    @override
+    async def delete_many(self, keys: Iterable[str]) -> None:
+        writes: dict[str, _Write] = dict.fromkeys(keys)
+        if len(writes) > 0:
+            await self._write(writes)
+
+    @override
+    async def incr(self, key: str, amount: int = 1, *, ttl: float | None = None) -> int:
+        expires_at = expiry_time(ttl)
+        if self._transaction.get() is not None:
+            current = await self._lookup(key)
+            value = cast(Json, json.loads(current[0])) if current is not None else None
+            if current is not None and value is not None:
+                if not isinstance(value, int) or isinstance(value, bool):
+                    raise ValueError(f"Value of {key!r} is not an integer")
+                amount += value
+                expires_at = current[1]
+            await self._write({key: (json_dumps(amount), expires_at)})
+            return amount
+        params = (key, json_dumps(amount), expires_at, time.time())
+        async with self._write_lock, self.connection.cursor() as cursor:
+            _ = await cursor.execute(INCR_QUERY, params)
+            row = await cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Value of {key!r} is not an integer")
+        return int(cast(str | int, row[0]))
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        write = (json_dumps(value), expiry_time(ttl))
+        if self._transaction.get() is not None:
+            current = await self._lookup(key)
+            current_value = json.loads(current[0]) if current is not None else None
+            if current_value != expected:
+                return False
+            await self._write({key: write})
+            return True
+        params: tuple[str | float | None, ...]
+        if expected is None:
+            query = SET_IF_NULL_QUERY
+            params = (key, *write, time.time())
+        else:
+            query = COMPARE_AND_SET_QUERY
+            params = (*write, key, json_dumps(expected), time.time())
+        async with self._write_lock, self.connection.cursor() as cursor:
+            _ = await cursor.execute(query, params)
+            return cursor.rowcount == 1
 
     @override
-    async def iterate(self, prefix: str = "") -> AsyncIterator[tuple[str, Json]]:
-        async with self.connection.execute(
-            "SELECT key, value FROM kv WHERE key LIKE ? ORDER BY key",
-            (f"{prefix}%",),
-        ) as cursor:
-            async for row in cursor:
-                key = cast(str, row[0])
-                raw_value = cast(str, row[1])
-                yield key, cast(Json, json.loads(raw_value))
+    async def set_if_absent(
+        self, key: str, value: Json, *, ttl: float | None = None
+    ) -> bool:
+        write = (json_dumps(value), expiry_time(ttl))
+        if self._transaction.get() is not None:
+            if await self._lookup(key) is not None:
+                return False
+            await self._write({key: write})
+            return True
+        params = (key, *write, time.time())
+        async with self._write_lock, self.connection.cursor() as cursor:
+            _ = await cursor.execute(SET_IF_ABSENT_QUERY, params)
+            return cursor.rowcount == 1
+
+    @override
+    async def set_many_fenced(
+        self,
+        fence_key: str,
+        token: int,
+        items: Iterable[tuple[str, Json]],
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        expires_at = expiry_time(ttl)
+        upserts = [(key, json_dumps(value), expires_at) for key, value in items]
+        upserts.append((fence_key, json_dumps(token), expires_at))
+        connection = self.connection
+        async with self._write_lock:
+            # Other processes wait from the check until the commit
+            _ = await connection.execute("BEGIN IMMEDIATE")
+            try:
+                async with connection.execute(
+                    GET_QUERY, (fence_key, time.time())
+                ) as cursor:
+                    row = await cursor.fetchone()
+                current = json.loads(row[0]) if row is not None else None
+                if isinstance(current, int) and current > token:
+                    await connection.rollback()
+                    return False
+                _ = await connection.executemany(UPSERT_QUERY, upserts)
+            except BaseException:
+                await connection.rollback()
+                raise
+            await connection.commit()
+        return True
+
+    @override
+    async def get_expiry_many(self, keys: Iterable[str]) -> dict[str, float]:
+        now = time.time()
+        expiry: dict[str, float] = {}
+        transaction = self._transaction.get() or {}
+        missing: list[str] = []
+        for key in dict.fromkeys(keys):
+            if key not in transaction:
+                missing.append(key)
+                continue
+            write = transaction[key]
+            if write is not None and write[1] is not None and write[1] > now:
+                expiry[key] = write[1]
+        async with self._reader() as reader, reader.cursor() as cursor:
+            for start in range(0, len(missing), GET_MANY_CHUNK_SIZE):
+                chunk = missing[start : start + GET_MANY_CHUNK_SIZE]
+                query = GET_EXPIRY_MANY_QUERY.format(", ".join("?" * len(chunk)))
+                _ = await cursor.execute(query, (*chunk, now))
+                async for row in cursor:
+                    expiry[cast(str, row[0])] = cast(float, row[1])
+        return expiry
+
+    @override
+    async def delete_expired(self, limit: int) -> int:
+        async with self._write_lock, self.connection.cursor() as cursor:
+            _ = await cursor.execute(DELETE_EXPIRED_QUERY, (time.time(), limit))
+            return cursor.rowcount
+
+    @override
+    async def iterate(
+        self,
+        prefix: str = "",
+        *,
+        start_after: str | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[tuple[str, Json]]:
+        query = "SELECT key, value FROM kv WHERE key >= ?"
+        params: list[str | float | int] = [prefix]
+        successor = prefix_successor(prefix)
+        if successor is not None:
+            query += " AND key < ?"
+            params.append(successor)
+        query += " AND (expires_at IS NULL OR expires_at > ?)"
+        params.append(time.time())
+        while limit is None or limit > 0:
+            page_query, page_params = query, list(params)
+            if start_after is not None:
+                page_query += " AND key > ?"
+                page_params.append(start_after)
+            page_size = ITERATE_PAGE_SIZE
+            if limit is not None:
+                page_size = min(page_size, limit)
+            page_params.append(page_size)
+            # Pages are read whole, so no reader is held while yielding
+            async with (
+                self._reader() as reader,
+                reader.execute(
+                    f"{page_query} ORDER BY key LIMIT ?", page_params
+                ) as cursor,
+            ):
+                rows = list(await cursor.fetchall())
+            for row in rows:
+                yield cast(str, row[0]), cast(Json, json.loads(cast(str, row[1])))
+            if len(rows) < page_size:
+                return
+            start_after = cast(str, rows[-1][0])
+            if limit is not None:
+                limit -= len(rows)
 
     @override
     async def clear(self) -> None:
-        async with self.connection.cursor() as cursor:
+        async with self._write_lock, self.connection.cursor() as cursor:
             _ = await cursor.execute("DELETE FROM kv")
             _ = await self.connection.execute("VACUUM")
 
@@ -255,6 +255,7 @@ async def test_api_methods_send_message(
             message_thread_id=None,
             parse_mode=ParseMode.HTML,
             reply_markup=reply_kb,
+            allow_paid_broadcast=True,
         )
         == message
     )
@@ -270,6 +271,7 @@ async def test_api_methods_send_message(
             link_preview_options=None,
             disable_notification=None,
             protect_content=None,
+            allow_paid_broadcast=True,
             business_connection_id=None,
             reply_parameters=None,
             reply_markup=msgspec.json.encode(reply_kb).decode(),
@@ -306,6 +308,7 @@ async def test_api_methods_send_photo(
             has_spoiler=None,
             disable_notification=None,
             protect_content=None,
+            allow_paid_broadcast=None,
             business_connection_id=None,
             reply_parameters=None,
             reply_markup=msgspec.json.encode(reply_kb).decode(),
@@ -471,6 +474,7 @@ async def test_send_media_group(bot: Bot, make_message: _MakeMessage) -> None:
             message_thread_id=None,
             disable_notification=None,
             protect_content=None,
+            allow_paid_broadcast=None,
             business_connection_id=None,
             reply_parameters=None,
             attachment0=file0,
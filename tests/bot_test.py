@@ -5,14 +5,17 @@ import msgspec
 import pytest
 import pytest_asyncio
 
-from aiotgbot.api_types import Message, Update
+from aiotgbot.api_types import ChatId, Message, Update, UserId
 from aiotgbot.bot import Bot, Handler, PollBot, StorageKey
 from aiotgbot.bot_update import BotUpdate, Context
-from aiotgbot.constants import UpdateType
+from aiotgbot.constants import RequestMethod, UpdateType
+from aiotgbot.exceptions import BotBlocked
 from aiotgbot.filters import StateFilter, UpdateTypeFilter
 from aiotgbot.handler_table import HandlerTable
 from aiotgbot.helpers import BotKey
+from aiotgbot.lock import StorageLock
 from aiotgbot.storage_memory import MemoryStorage
+from aiotgbot.storage_queue import StorageQueue
 
 
 @pytest_asyncio.fixture
@@ -89,3 +92,187 @@ async def test_handler_check() -> None:
     assert await handler.check(bot, bu1)
     bu2 = BotUpdate("state2", ctx, Update(update_id=2, message=message))
     assert not await handler.check(bot, bu2)
+
+
+@pytest.mark.asyncio
+async def test_bot_state_context() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = MemoryStorage()
+    bot = PollBot("token", table, storage)
+    async with bot.state_context(UserId(1), ChatId(2)) as state_context:
+        assert state_context.state is None
+        state_context.state = "state1"
+        state_context.context["key"] = "value"
+    assert await storage.get("state|1|2") == "state1"
+    assert await storage.get("context|1|2") == {"key": "value"}
+    async with bot.state_context(UserId(1), ChatId(2)) as state_context:
+        assert state_context.state == "state1"
+        assert state_context.context["key"] == "value"
+
+
+@pytest.mark.asyncio
+async def test_bot_state_ttl() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = MemoryStorage()
+    with pytest.raises(ValueError, match="state_ttl"):
+        _ = PollBot("token", table, storage, state_ttl=0)
+    bot = PollBot("token", table, storage, state_ttl=0.05)
+    async with bot.state_context(UserId(1), None) as state_context:
+        state_context.state = "state1"
+    assert await storage.get("state|1|") == "state1"
+    await asyncio.sleep(0.06)
+    assert await storage.delete_expired(10) == 2
+    async with bot.state_context(UserId(1), None) as state_context:
+        assert state_context.state is None
+
+
+@pytest.mark.asyncio
+async def test_bot_reap_queue_storage(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("aiotgbot.bot.REAP_INTERVAL", 0.01)
+    table = HandlerTable()
+    table.freeze()
+    queue_storage = MemoryStorage()
+    queue = StorageQueue(queue_storage, "outbox", lease_ttl=0.01)
+    bot = PollBot("token", table, MemoryStorage(), outbox=queue)
+    expiring = bot._expiring  # pyright: ignore[reportPrivateUsage]
+    assert expiring == [queue_storage]
+    _ = await queue.put("call")
+    item = await queue.claim()
+    assert item is not None
+    await queue.release(item)
+    reap_expired = bot._reap_expired  # pyright: ignore[reportPrivateUsage]
+    reap_task = asyncio.create_task(reap_expired([queue_storage]))
+    await asyncio.sleep(0.05)
+    _ = reap_task.cancel()
+    assert await queue_storage.delete_expired(10) == 0
+    await bot.client.close()
+
+
+@pytest.mark.asyncio
+async def test_bot_reap_unreachable_storage() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = MemoryStorage()
+    bot = PollBot("token", table, storage, unreachable_ttl=60)
+    expiring = bot._expiring  # pyright: ignore[reportPrivateUsage]
+    assert expiring == [storage]
+    await bot.client.close()
+
+
+@pytest.mark.asyncio
+async def test_bot_state_index() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = MemoryStorage()
+    bot = PollBot("token", table, storage)
+    with pytest.raises(RuntimeError, match="disabled"):
+        _ = [item async for item in bot.iterate_state("state1")]
+    bot = PollBot("token", table, storage, state_index=True)
+    for user_id, chat_id, state in (
+        (UserId(1), ChatId(2), "state1"),
+        (UserId(3), None, "state1"),
+        (None, ChatId(4), "state2"),
+        (UserId(5), ChatId(6), "state1|2"),
+    ):
+        async with bot.state_context(user_id, chat_id) as state_context:
+            state_context.state = state
+    assert [item async for item in bot.iterate_state("state1")] == [
+        (UserId(1), ChatId(2)),
+        (UserId(3), None),
+    ]
+    async with bot.state_context(UserId(1), ChatId(2)) as state_context:
+        state_context.state = "state2"
+    async with bot.state_context(UserId(3), None) as state_context:
+        state_context.state = None
+    assert [item async for item in bot.iterate_state("state1")] == []
+    assert [item async for item in bot.iterate_state("state2")] == [
+        (UserId(1), ChatId(2)),
+        (None, ChatId(4)),
+    ]
+
+    await storage.delete("state_index|state2|1|2")
+    await storage.set("state_index|stale|7|8", None)
+    await bot.rebuild_state_index()
+    assert [item async for item in bot.iterate_state("stale")] == []
+    assert [item async for item in bot.iterate_state("state2")] == [
+        (UserId(1), ChatId(2)),
+        (None, ChatId(4)),
+    ]
+    assert [item async for item in bot.iterate_state("state1|2")] == [
+        (UserId(5), ChatId(6)),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_bot_lock_provider() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = MemoryStorage()
+    lock = StorageLock(storage, retry_interval=0.01)
+    bot = PollBot("token", table, storage, lock_provider=lock)
+    async with bot.state_context(UserId(1), ChatId(2)) as state_context:
+        state_context.state = "state1"
+    assert await storage.get("fence|1|2") == 1
+    assert await storage.get("state|1|2") == "state1"
+
+    with pytest.raises(RuntimeError, match="Lock lost"):
+        async with bot.state_context(UserId(1), ChatId(2)) as state_context:
+            await storage.set("fence|1|2", 5)
+            state_context.state = "stale"
+    assert await storage.get("state|1|2") == "state1"
+
+
+@pytest.mark.asyncio
+async def test_bot_unreachable_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = MemoryStorage()
+    bot = PollBot("token", table, storage, unreachable_cache=True)
+    calls: list[str] = []
+
+    async def request(
+        _: RequestMethod, api_method: str, type_: type[object], **__: object
+    ) -> object:
+        await asyncio.sleep(0)
+        calls.append(api_method)
+        if api_method == "getChat":
+            return msgspec.convert({"id": 2, "type": "private"}, type_)
+        raise BotBlocked(403, "Forbidden: bot was blocked by the user")
+
+    monkeypatch.setattr(bot, "_request", request)
+    with pytest.raises(BotBlocked):
+        _ = await bot.send_message(ChatId(2), "text")
+    assert calls == ["getChat", "sendMessage"]
+    # Known unreachable chats fail without requests
+    with pytest.raises(BotBlocked, match="blocked"):
+        _ = await bot.send_message(ChatId(2), "text")
+    assert calls == ["getChat", "sendMessage"]
+
+    update = msgspec.convert(
+        {
+            "update_id": 1,
+            "my_chat_member": {
+                "chat": {"id": 2, "type": "private"},
+                "from": {"id": 2, "is_bot": False, "first_name": "User"},
+                "date": 1,
+                "old_chat_member": {
+                    "status": "kicked",
+                    "user": {"id": 3, "is_bot": True, "first_name": "Bot"},
+                    "until_date": 0,
+                },
+                "new_chat_member": {
+                    "status": "member",
+                    "user": {"id": 3, "is_bot": True, "first_name": "Bot"},
+                },
+            },
+        },
+        Update,
+    )
+    await bot._handle_update(update)  # pyright: ignore[reportPrivateUsage]
+    assert await storage.get("unreachable|2") is None
+    with pytest.raises(BotBlocked):
+        _ = await bot.send_message(ChatId(2), "text")
+    assert calls == ["getChat", "sendMessage", "getChat", "sendMessage"]
+    await bot.client.close()
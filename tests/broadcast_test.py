@@ -0,0 +1,187 @@
+import asyncio
+from collections.abc import AsyncIterator
+
+import msgspec
+import pytest
+
+from aiotgbot.api_methods import ParamType
+from aiotgbot.api_types import ChatId, MessageId
+from aiotgbot.bot import PollBot
+from aiotgbot.broadcast import (
+    Broadcast,
+    BroadcastOutcome,
+    copy_message,
+    send_text,
+)
+from aiotgbot.constants import RequestMethod
+from aiotgbot.exceptions import (
+    BotBlocked,
+    BotKicked,
+    ChatNotFound,
+    MigrateToChat,
+    TelegramError,
+)
+from aiotgbot.handler_table import HandlerTable
+from aiotgbot.storage_memory import MemoryStorage
+
+
+class FakeApi:
+    def __init__(self, fail_at: int | None = None) -> None:
+        self.sent: list[tuple[str, ChatId | str, dict[str, ParamType]]] = []
+        self.fail_at: int | None = fail_at
+
+    async def request(self, *_: object, **__: object) -> object:
+        raise AssertionError("unexpected request")
+
+    async def safe_request(
+        self,
+        _: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        type_: type[object],
+        **params: ParamType,
+    ) -> object:
+        if chat_id == self.fail_at:
+            raise ConnectionError("network down")
+        self.sent.append((api_method, chat_id, params))
+        if chat_id == ChatId(2):
+            raise BotBlocked(403, "Forbidden: bot was blocked by the user")
+        if chat_id == ChatId(-3):
+            raise BotKicked(403, "Forbidden: bot was kicked from a chat")
+        if chat_id == ChatId(4):
+            raise ChatNotFound(400, "Bad Request: chat not found")
+        if chat_id == ChatId(-5):
+            raise MigrateToChat(400, "Bad Request: group chat was upgraded", -105)
+        if chat_id == ChatId(6):
+            raise TelegramError(400, "Bad Request: message is too long")
+        message = {
+            "message_id": len(self.sent),
+            "date": 1,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text"),
+        }
+        return msgspec.json.decode(msgspec.json.encode(message), type=type_)
+
+
+def make_broadcast(
+    storage: MemoryStorage, api: FakeApi, chat_ids: list[int]
+) -> Broadcast:
+    return Broadcast(
+        api.request,
+        api.safe_request,
+        storage,
+        "news",
+        [ChatId(chat_id) for chat_id in chat_ids],
+        send_text("hello"),
+        total=len(chat_ids),
+        workers=2,
+        checkpoint_size=2,
+    )
+
+
+@pytest.mark.asyncio
+async def test_broadcast() -> None:
+    storage = MemoryStorage()
+    api = FakeApi()
+    stats = await make_broadcast(storage, api, [1, 2, -3, 4, -5, 6, 7]).run()
+    assert stats.outcomes == {
+        BroadcastOutcome.SENT: 3,
+        BroadcastOutcome.BLOCKED: 1,
+        BroadcastOutcome.KICKED: 1,
+        BroadcastOutcome.NOT_FOUND: 1,
+        BroadcastOutcome.FAILED: 1,
+    }
+    assert stats.done == stats.processed == 7
+    assert stats.eta == 0
+    assert stats.rate > 0
+    sent = sorted(chat_id for _, chat_id, _ in api.sent)
+    assert sent == [-105, -5, -3, 1, 2, 4, 6, 7]
+    assert await storage.get("broadcast|news|2") == "blocked"
+    assert await storage.get("broadcast|news|-5") == "sent"
+    assert await storage.get("broadcast_progress|news") == {
+        "offset": 7,
+        "end": 7,
+        "outcomes": {
+            "sent": 3,
+            "blocked": 1,
+            "kicked": 1,
+            "not_found": 1,
+            "failed": 1,
+        },
+    }
+
+    # A finished broadcast sends nothing when run again
+    api.sent.clear()
+    stats = await make_broadcast(storage, api, [1, 2, -3, 4, -5, 6, 7]).run()
+    assert api.sent == []
+    assert stats.done == 7
+    assert stats.processed == 0
+
+
+@pytest.mark.asyncio
+async def test_broadcast_resume() -> None:
+    storage = MemoryStorage()
+    chat_ids = [1, 7, 8, 9, 10, 11, 12, 13]
+    api = FakeApi(fail_at=10)
+    with pytest.raises(ConnectionError):
+        _ = await make_broadcast(storage, api, chat_ids).run()
+    first = {chat_id for _, chat_id, _ in api.sent}
+    assert 10 not in first
+
+    api = FakeApi()
+    stats = await make_broadcast(storage, api, chat_ids).run()
+    second = {chat_id for _, chat_id, _ in api.sent}
+    assert first.isdisjoint(second)
+    assert first | second == set(chat_ids)
+    assert stats.outcomes[BroadcastOutcome.SENT] == len(chat_ids)
+    assert stats.processed == len(second)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_workers_failed() -> None:
+    storage = MemoryStorage()
+    api = FakeApi(fail_at=10)
+    # Both workers fail while the producer waits for queue space
+    broadcast = make_broadcast(storage, api, [10] * 49)
+    with pytest.raises(ConnectionError):
+        _ = await asyncio.wait_for(broadcast.run(), 1)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_async_source_and_copy() -> None:
+    async def chat_ids() -> AsyncIterator[ChatId]:
+        for chat_id in (1, 7):
+            await asyncio.sleep(0)
+            yield ChatId(chat_id)
+
+    storage = MemoryStorage()
+    api = FakeApi()
+    broadcast = Broadcast(
+        api.request,
+        api.safe_request,
+        storage,
+        "copy",
+        chat_ids(),
+        copy_message(ChatId(-100), MessageId(42), allow_paid_broadcast=True),
+    )
+    stats = await broadcast.run()
+    assert stats.outcomes[BroadcastOutcome.SENT] == 2
+    assert stats.eta is None
+    assert sorted(
+        (api_method, chat_id, params["from_chat_id"], params["message_id"])
+        for api_method, chat_id, params in api.sent
+    ) == [("copyMessage", 1, -100, 42), ("copyMessage", 7, -100, 42)]
+    assert all(params["allow_paid_broadcast"] for _, _, params in api.sent)
+
+
+@pytest.mark.asyncio
+async def test_bot_broadcast() -> None:
+    table = HandlerTable()
+    table.freeze()
+    bot = PollBot("token", table, MemoryStorage())
+    broadcast = bot.broadcast("news", [ChatId(1)], send_text("hello"))
+    assert isinstance(broadcast, Broadcast)
+    assert broadcast.name == "news"
+    await bot.client.close()
+    with pytest.raises(ValueError, match="workers"):
+        _ = bot.broadcast("news", [ChatId(1)], send_text("hello"), workers=0)
@@ -0,0 +1,277 @@
+import asyncio
+
+import msgspec
+import pytest
+
+from aiotgbot.api_methods import ParamType
+from aiotgbot.api_types import (
+    ChatId,
+    InlineKeyboardMarkup,
+    Message,
+    MessageId,
+    ResponseMessageId,
+)
+from aiotgbot.bot import PollBot
+from aiotgbot.coalescing import CoalescingApi
+from aiotgbot.constants import RequestMethod
+from aiotgbot.exceptions import MessageNotModified, TelegramError
+from aiotgbot.handler_table import HandlerTable
+from aiotgbot.storage_memory import MemoryStorage
+
+
+class FakeApi:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, dict[str, ParamType]]] = []
+
+    async def request(
+        self,
+        _: RequestMethod,
+        api_method: str,
+        type_: type[object],
+        **params: ParamType,
+    ) -> object:
+        await asyncio.sleep(0)
+        self.calls.append((api_method, params))
+        if api_method == "deleteMessages" and "13" in str(params["message_ids"]):
+            raise TelegramError(400, "Bad Request: message can't be deleted")
+        if api_method == "deleteMessage" and params["message_id"] == 13:
+            raise TelegramError(400, "Bad Request: message can't be deleted")
+        return msgspec.convert(True, type_)
+
+    async def safe_request(
+        self,
+        _: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        type_: type[object],
+        **params: ParamType,
+    ) -> object:
+        await asyncio.sleep(0)
+        self.calls.append((api_method, params))
+        if api_method == "copyMessages":
+            message_ids = msgspec.json.decode(str(params["message_ids"]))
+            # Messages that can't be copied are skipped
+            copied = [{"message_id": 100 + i} for i in message_ids if i != 7]
+            return msgspec.convert(copied, type_)
+        if api_method == "forwardMessages":
+            message_ids = msgspec.json.decode(str(params["message_ids"]))
+            return msgspec.convert(
+                [{"message_id": 200 + i} for i in message_ids], type_
+            )
+        if api_method == "forwardMessage":
+            message = {
+                "message_id": 300,
+                "date": 1,
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            return msgspec.convert(message, type_)
+        return msgspec.convert(
+            {"message_id": 100 + int(str(params["message_id"]))}, type_
+        )
+
+
+@pytest.mark.asyncio
+async def test_coalescing_delete() -> None:
+    api = FakeApi()
+    coalescing = CoalescingApi(api.request, api.safe_request, delay=0.01)
+    results = await asyncio.gather(
+        *(coalescing.delete_message(ChatId(1), MessageId(i)) for i in (3, 1, 2, 1)),
+        coalescing.delete_message(ChatId(2), MessageId(1)),
+    )
+    assert results == [True] * 5
+    assert sorted(api.calls, key=str) == [
+        ("deleteMessage", {"chat_id": 2, "message_id": 1}),
+        ("deleteMessages", {"chat_id": 1, "message_ids": "[1,2,3]"}),
+    ]
+
+    # A failed bulk call is retried one by one
+    api.calls.clear()
+    deleted, error = await asyncio.gather(
+        coalescing.delete_message(ChatId(1), MessageId(12)),
+        coalescing.delete_message(ChatId(1), MessageId(13)),
+        return_exceptions=True,
+    )
+    assert deleted is True
+    assert isinstance(error, TelegramError)
+    assert [api_method for api_method, _ in api.calls] == [
+        "deleteMessages",
+        "deleteMessage",
+        "deleteMessage",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_coalescing_copy_and_forward() -> None:
+    api = FakeApi()
+    coalescing = CoalescingApi(api.request, api.safe_request, delay=0.01)
+    copied = await asyncio.gather(
+        coalescing.copy_message(ChatId(1), ChatId(2), MessageId(5)),
+        coalescing.copy_message(ChatId(1), ChatId(2), MessageId(6)),
+        coalescing.copy_message(ChatId(1), ChatId(2), MessageId(8), caption="x"),
+    )
+    assert list(copied) == [ResponseMessageId(MessageId(i)) for i in (105, 106, 108)]
+    assert [api_method for api_method, _ in api.calls] == [
+        "copyMessage",
+        "copyMessages",
+    ]
+
+    # Results of a call that skipped messages can't be matched
+    api.calls.clear()
+    skipped = await asyncio.gather(
+        coalescing.copy_message(ChatId(1), ChatId(2), MessageId(6)),
+        coalescing.copy_message(ChatId(1), ChatId(2), MessageId(7)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, RuntimeError) for result in skipped)
+    assert [api_method for api_method, _ in api.calls] == ["copyMessages"]
+
+    api.calls.clear()
+    forwarded = await asyncio.gather(
+        *(
+            coalescing.forward_message_id(ChatId(1), ChatId(2), MessageId(i))
+            for i in range(150)
+        )
+    )
+    assert forwarded == [ResponseMessageId(MessageId(200 + i)) for i in range(150)]
+    assert [
+        len(msgspec.json.decode(str(params["message_ids"]))) for _, params in api.calls
+    ] == [100, 50]
+    single = await coalescing.forward_message_id(ChatId(1), ChatId(2), MessageId(1))
+    assert single == ResponseMessageId(MessageId(300))
+
+
+@pytest.mark.asyncio
+async def test_bot_coalescing() -> None:
+    table = HandlerTable()
+    table.freeze()
+    bot = PollBot("token", table, MemoryStorage())
+    assert isinstance(bot.coalescing, CoalescingApi)
+    assert bot.coalescing is bot.coalescing
+    await bot.client.close()
+    with pytest.raises(ValueError, match="delay"):
+        _ = CoalescingApi(
+            bot.coalescing.delete_message, bot.coalescing.delete_message, delay=-1
+        )
+
+
+class FakeEditApi:
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, dict[str, ParamType]]] = []
+        self.release: asyncio.Event = asyncio.Event()
+
+    async def request(
+        self,
+        _: RequestMethod,
+        api_method: str,
+        type_: type[object],
+        **params: ParamType,
+    ) -> object:
+        await self.release.wait()
+        self.calls.append((api_method, params))
+        if params.get("text") == "same":
+            raise MessageNotModified(400, "Bad Request: message is not modified")
+        if "inline_message_id" in params:
+            return msgspec.convert(True, type_)
+        message = {
+            "message_id": params["message_id"],
+            "date": 1,
+            "chat": {"id": params["chat_id"], "type": "private"},
+            "text": params.get("text"),
+        }
+        return msgspec.convert(message, type_)
+
+    async def safe_request(self, *_: object, **__: object) -> object:
+        raise AssertionError("unexpected request")
+
+
+@pytest.mark.asyncio
+async def test_coalescing_edits() -> None:
+    api = FakeEditApi()
+    coalescing = CoalescingApi(api.request, api.safe_request)
+    markup = InlineKeyboardMarkup(inline_keyboard=((),))
+    tasks = [
+        asyncio.create_task(
+            coalescing.edit_message_text(f"{i}%", ChatId(1), MessageId(2))
+        )
+        for i in range(3)
+    ]
+    tasks.append(
+        asyncio.create_task(
+            coalescing.edit_message_reply_markup(
+                ChatId(1), MessageId(2), reply_markup=markup
+            )
+        )
+    )
+    await asyncio.sleep(0)
+    api.release.set()
+    results = await asyncio.gather(*tasks)
+    # Edits made before the first is sent are merged into one
+    assert [params.get("text") for _, params in api.calls] == ["2%"]
+    assert api.calls[0][1]["reply_markup"] == '{"inline_keyboard":[[]]}'
+    assert isinstance(results[0], Message)
+    assert results[0].text == "2%"
+    assert results[0] == results[1] == results[2] == results[3]
+
+    # Unchanged content is not sent again while edits are in flight
+    api.calls.clear()
+    api.release.clear()
+    first = asyncio.create_task(
+        coalescing.edit_message_text("2%", ChatId(1), MessageId(2))
+    )
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(
+        coalescing.edit_message_text("2%", ChatId(1), MessageId(2))
+    )
+    await asyncio.sleep(0)
+    api.release.set()
+    unchanged = await asyncio.gather(first, second)
+    assert unchanged[0] == unchanged[1]
+    assert [params.get("text") for _, params in api.calls] == ["2%"]
+
+    # Later the message may have been edited elsewhere, so it is sent
+    api.calls.clear()
+    _ = await coalescing.edit_message_text("2%", ChatId(1), MessageId(2))
+    assert [params.get("text") for _, params in api.calls] == ["2%"]
+
+    # An edit sent while another is in flight waits for it
+    api.calls.clear()
+    api.release.clear()
+    first = asyncio.create_task(
+        coalescing.edit_message_text("first", inline_message_id="x")
+    )
+    await asyncio.sleep(0.01)
+    second = asyncio.create_task(
+        coalescing.edit_message_text("second", inline_message_id="x")
+    )
+    await asyncio.sleep(0)
+    api.release.set()
+    assert list(await asyncio.gather(first, second)) == [True, True]
+    assert [params["text"] for _, params in api.calls] == ["first", "second"]
+
+    api.calls.clear()
+    assert await coalescing.edit_message_text("same", inline_message_id="x") is True
+    assert await coalescing.edit_message_text("other", inline_message_id="x") is True
+    assert [params["text"] for _, params in api.calls] == ["same", "other"]
+    with pytest.raises(RuntimeError, match="required"):
+        _ = await coalescing.edit_message_text("text")
+
+
+@pytest.mark.asyncio
+async def test_coalescing_interrupted() -> None:
+    started = asyncio.Event()
+
+    async def request(*_: object, **__: ParamType) -> object:
+        started.set()
+        await asyncio.sleep(10)
+        return True
+
+    coalescing = CoalescingApi(request, request, delay=0)
+    deletes = asyncio.gather(
+        *(coalescing.delete_message(ChatId(1), MessageId(i)) for i in (1, 2)),
+        return_exceptions=True,
+    )
+    _ = await started.wait()
+    for task in coalescing._tasks:  # pyright: ignore[reportPrivateUsage]
+        _ = task.cancel()
+    results = await asyncio.wait_for(deletes, 1)
+    assert all(isinstance(result, RuntimeError) for result in results)
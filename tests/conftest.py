@@ -123,3 +123,10 @@ async def postgres_engine(postgres_url: str) -> AsyncIterator[AsyncEngine]:
         yield engine
     finally:
         await engine.dispose()
+
+
+@pytest.fixture
+def postgres_dsn(postgres_url: str) -> str:
+    """Plain libpq DSN for the live Postgres container."""
+
+    return postgres_url.replace("postgresql+asyncpg://", "postgresql://", 1)
@@ -1,10 +1,12 @@
 import asyncio
+import sys
 from collections.abc import Hashable
 from weakref import ref
 
 import pytest
 
-from aiotgbot.helpers import KeyLock
+from aiotgbot import helpers
+from aiotgbot.helpers import KeyLock, SortedKeys, prefix_successor
 
 
 class InspectableKeyLock(KeyLock):
@@ -102,3 +104,46 @@ async def test_key_lock_overlaps() -> None:
 
     key_lock = InspectableKeyLock()
     _ = await asyncio.gather(task1(key_lock), task2(key_lock), task3(key_lock))
+
+
+def test_prefix_successor() -> None:
+    max_char = chr(sys.maxunicode)
+    assert prefix_successor("") is None
+    assert prefix_successor("abc") == "abd"
+    assert prefix_successor(f"a{max_char}{max_char}") == "b"
+    assert prefix_successor(max_char) is None
+    assert prefix_successor("\ud7ff") == "\ue000"
+
+
+def test_sorted_keys(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(helpers, "SORTED_CHUNK_SIZE", 2)
+    keys = SortedKeys(["b|3", "a", "b|1"])
+    for key in ("c", "b|2", "b|0", "b|4", "a", "b|5", "d"):
+        keys.add(key)
+    assert len(keys) == 9
+    assert "b|2" in keys
+    assert "b" not in keys
+    assert "z" not in keys
+    assert keys.page("", None, 100) == [
+        "a",
+        "b|0",
+        "b|1",
+        "b|2",
+        "b|3",
+        "b|4",
+        "b|5",
+        "c",
+        "d",
+    ]
+    assert keys.page("b|", None, 2) == ["b|0", "b|1"]
+    assert keys.page("b|", "b|1", 10) == ["b|2", "b|3", "b|4", "b|5"]
+    assert keys.page("b|", "a", 1) == ["b|0"]
+    assert keys.page("b|", "b|5", 10) == []
+    assert keys.page("e", None, 10) == []
+    for key in ("b|2", "b|3", "a", "missing", "z"):
+        keys.discard(key)
+    assert len(keys) == 6
+    assert keys.page("", "a", 100) == ["b|0", "b|1", "b|4", "b|5", "c", "d"]
+    keys.clear()
+    assert len(keys) == 0
+    assert keys.page("", None, 10) == []
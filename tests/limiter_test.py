@@ -0,0 +1,157 @@
+import asyncio
+from pathlib import Path
+from typing import cast
+
+import pytest
+from aiofreqlimit import FreqLimitParams
+from aiofreqlimit.backends.memory import InMemoryBackend
+
+from aiotgbot.api_types import ChatId
+from aiotgbot.bot import PollBot
+from aiotgbot.handler_table import HandlerTable
+from aiotgbot.limiter import (
+    PAID_BROADCAST_LIMIT_PROFILE,
+    AdaptiveLimit,
+    MemoryLimitBackend,
+    StorageLimitBackend,
+)
+from aiotgbot.storage import StorageProtocol
+from aiotgbot.storage_memory import MemoryStorage
+from aiotgbot.storage_sqlite import SQLiteStorage
+
+
+def test_adaptive_limit_params() -> None:
+    params = FreqLimitParams(limit=10, period=1.0)
+    with pytest.raises(ValueError, match="decrease"):
+        _ = AdaptiveLimit(params, backend=InMemoryBackend(), decrease=1.0)
+    with pytest.raises(ValueError, match="increase"):
+        _ = AdaptiveLimit(params, backend=InMemoryBackend(), increase=0)
+    with pytest.raises(ValueError, match="min_factor"):
+        _ = AdaptiveLimit(params, backend=InMemoryBackend(), min_factor=0)
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limit_aimd() -> None:
+    params = FreqLimitParams(limit=10, period=1.0)
+    limit = AdaptiveLimit(params, backend=InMemoryBackend(), increase=0.5)
+    assert limit.params == params
+    limit.backoff("chat", 0.01)
+    assert limit.factor == pytest.approx(0.5)
+    # Callers of the same pause count once
+    limit.backoff("chat", 0.01)
+    assert limit.factor == pytest.approx(0.5)
+    for _ in range(10):
+        limit.success()
+    assert limit.factor == pytest.approx(1.0)
+    for _ in range(10):
+        await asyncio.sleep(0.02)
+        limit.backoff("chat", 0.01)
+    assert limit.factor == pytest.approx(0.05)
+    await limit.clear()
+    assert limit.factor == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limit_pause() -> None:
+    params = FreqLimitParams(limit=1000, period=1.0)
+    limit = AdaptiveLimit(params, backend=InMemoryBackend())
+    loop = asyncio.get_running_loop()
+
+    async def enter(key: str) -> float:
+        async with limit.resource(key):
+            return loop.time()
+
+    started = loop.time()
+    limit.backoff("chat", 0.1)
+    other, paused = await asyncio.gather(enter("other"), enter("chat"))
+    assert other - started < 0.05
+    assert paused - started >= 0.1
+
+    started = loop.time()
+    limit.backoff(None, 0.1)
+    assert await enter("other") - started >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limit_pause_after_delay() -> None:
+    params = FreqLimitParams(limit=1, period=0.05)
+    limit = AdaptiveLimit(params, backend=InMemoryBackend())
+    loop = asyncio.get_running_loop()
+
+    async def enter() -> float:
+        async with limit.resource("chat"):
+            return loop.time()
+
+    first = await enter()
+    delayed = asyncio.create_task(enter())
+    await asyncio.sleep(0.01)
+    # The pause arrives while the second caller sleeps out its delay
+    limit.backoff("chat", 0.2)
+    assert await delayed - first >= 0.2
+
+
+@pytest.mark.asyncio
+async def test_bot_backoff() -> None:
+    table = HandlerTable()
+    table.freeze()
+    bot = PollBot(
+        "token",
+        table,
+        MemoryStorage(),
+        limit_profile=PAID_BROADCAST_LIMIT_PROFILE,
+    )
+    broadcast = bot.broadcast("news", [ChatId(1)], lambda *_: asyncio.sleep(0))
+    assert broadcast.workers == 1000
+    backoff = bot._backoff  # pyright: ignore[reportPrivateUsage]
+    chat_limit = bot._chat_limit  # pyright: ignore[reportPrivateUsage]
+    message_limit = bot._message_limit  # pyright: ignore[reportPrivateUsage]
+    backoff(chat_limit, ChatId(1), 5)
+    backoff(chat_limit, ChatId(1), 5)
+    assert message_limit.factor == pytest.approx(1.0)
+    # A second chat flooded within the pause backs off globally
+    backoff(chat_limit, ChatId(2), 5)
+    assert message_limit.factor == pytest.approx(0.5)
+    await bot.client.close()
+
+
+@pytest.mark.asyncio
+async def test_storage_limit_backend(tmp_path: Path) -> None:
+    params = FreqLimitParams(limit=10, period=1.0)
+    path = tmp_path / "limits.sqlite"
+    first_storage = SQLiteStorage(path)
+    second_storage = SQLiteStorage(path)
+    await first_storage.connect()
+    await second_storage.connect()
+    # Two processes sending with one token share its limit
+    first = StorageLimitBackend(first_storage)
+    second = StorageLimitBackend(second_storage)
+    delays = [
+        await backend.reserve("message", 0, params)
+        for backend in (first, second, first, second)
+    ]
+    assert delays[0] == 0
+    assert delays[1:] == pytest.approx([0.1, 0.2, 0.3], abs=0.05)
+    assert await second.reserve("chat|1", 0, params) == 0
+    await first_storage.close()
+    await second_storage.close()
+
+    with pytest.raises(TypeError, match="atomic"):
+        _ = StorageLimitBackend(cast(StorageProtocol, object()))
+
+
+@pytest.mark.asyncio
+async def test_memory_limit_backend() -> None:
+    params = FreqLimitParams(limit=1, period=1.0)
+    backend = MemoryLimitBackend()
+    for chat_id in range(1000):
+        assert await backend.reserve(chat_id, 0, params) == 0
+    assert await backend.reserve(0, 0.5, params) == pytest.approx(0.5)
+    assert len(backend) == 1000
+    # Only the chat reserved again can still be delayed
+    assert await backend.reserve(1000, 1.0, params) == 0
+    assert len(backend) == 2
+    assert await backend.reserve(0, 1.5, params) == pytest.approx(0.5)
+    assert await backend.reserve(1001, 10.0, params) == 0
+    assert len(backend) == 1
+    await backend.clear()
+    assert len(backend) == 0
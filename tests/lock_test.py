@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from typing_extensions import override  # Python 3.11 compatibility
+
+from aiotgbot.helpers import Json, KeyLock
+from aiotgbot.lock import LockLostError, LockProviderProtocol, StorageLock
+from aiotgbot.storage_memory import MemoryStorage
+
+
+class FailingStorage(MemoryStorage):
+    def __init__(self) -> None:
+        super().__init__()
+        self.fail: bool = False
+
+    @override
+    async def compare_and_set(
+        self,
+        key: str,
+        expected: Json,
+        value: Json,
+        *,
+        ttl: float | None = None,
+    ) -> bool:
+        if self.fail:
+            raise ConnectionError("Storage is down")
+        return await super().compare_and_set(key, expected, value, ttl=ttl)
+
+
+def test_lock_provider_protocol() -> None:
+    assert isinstance(KeyLock(), LockProviderProtocol)
+    assert isinstance(StorageLock(MemoryStorage()), LockProviderProtocol)
+    with pytest.raises(ValueError, match="ttl"):
+        _ = StorageLock(MemoryStorage(), ttl=0)
+    with pytest.raises(ValueError, match="retry_interval"):
+        _ = StorageLock(MemoryStorage(), retry_interval=0)
+
+
+@pytest.mark.asyncio
+async def test_storage_lock() -> None:
+    storage = MemoryStorage()
+    # Two providers sharing one storage stand for two processes
+    first = StorageLock(storage, retry_interval=0.01)
+    second = StorageLock(storage, retry_interval=0.01)
+    events: list[str] = []
+
+    async def hold(lock: StorageLock, name: str) -> int:
+        async with lock.resource("key") as token:
+            events.append(f"{name} enter")
+            await asyncio.sleep(0.03)
+            events.append(f"{name} exit")
+            return token
+
+    tokens = await asyncio.gather(hold(first, "first"), hold(second, "second"))
+    assert sorted(tokens) == [1, 2]
+    assert events[0].endswith("enter")
+    assert events[1] == events[0].replace("enter", "exit")
+    assert await storage.get("lock|key") is None
+    assert await storage.get("lock_fence|key") == 2
+    async with first.resource("other") as token:
+        assert token == 1
+
+
+@pytest.mark.asyncio
+async def test_storage_lock_lease() -> None:
+    storage = MemoryStorage()
+    lock = StorageLock(storage, ttl=0.06, retry_interval=0.01)
+
+    async def hold() -> None:
+        async with lock.resource("key") as token:
+            assert token == 1
+            await asyncio.sleep(1)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0.1)
+    assert isinstance(await storage.get("lock|key"), str)
+    await storage.delete("lock|key")
+    other = StorageLock(storage, retry_interval=0.01)
+    async with other.resource("key") as other_token:
+        assert other_token == 2
+        with pytest.raises(LockLostError):
+            await holder
+    assert await storage.get("lock|key") is None
+
+
+@pytest.mark.asyncio
+async def test_storage_lock_lost() -> None:
+    storage = FailingStorage()
+    lock = StorageLock(storage, ttl=0.06, retry_interval=0.01)
+    with pytest.raises(LockLostError, match=r"lock\|key"):
+        async with lock.resource("key"):
+            await storage.set("lock|key", "other")
+            await asyncio.sleep(1)
+    assert await storage.get("lock|key") == "other"
+
+    await storage.delete("lock|key")
+    with pytest.raises(LockLostError):
+        async with lock.resource("key"):
+            storage.fail = True
+            await asyncio.sleep(1)
+    storage.fail = False
+
+    # Cancellation from outside is not reported as a lost lock
+    async def hold() -> None:
+        async with lock.resource("key"):
+            await asyncio.sleep(1)
+
+    await storage.delete("lock|key")
+    task = asyncio.create_task(hold())
+    await asyncio.sleep(0.05)
+    _ = task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await storage.get("lock|key") is None
@@ -0,0 +1,151 @@
+import asyncio
+
+import msgspec
+import pytest
+
+from aiotgbot import outbox as outbox_module
+from aiotgbot.api_methods import ParamType
+from aiotgbot.api_types import ChatId, LocalFile, Message, MessageThreadId
+from aiotgbot.bot import PollBot
+from aiotgbot.constants import RequestMethod
+from aiotgbot.exceptions import BotBlocked, RetryAfter
+from aiotgbot.handler_table import HandlerTable
+from aiotgbot.outbox import Outbox
+from aiotgbot.storage_memory import MemoryStorage
+from aiotgbot.storage_queue import StorageQueue
+
+
+class FakeApi:
+    def __init__(self) -> None:
+        self.sent: list[tuple[str, ChatId | str, dict[str, ParamType]]] = []
+
+    async def request(self, *_: object, **__: object) -> object:
+        raise AssertionError("unexpected request")
+
+    async def deliver(
+        self,
+        _: RequestMethod,
+        api_method: str,
+        chat_id: ChatId | str,
+        params: dict[str, ParamType],
+    ) -> msgspec.Raw:
+        self.sent.append((api_method, chat_id, params))
+        if chat_id == ChatId(13):
+            raise BotBlocked(403, "Forbidden: bot was blocked by the user")
+        if chat_id == ChatId(14):
+            raise RetryAfter(429, "Too Many Requests: retry after 7", 7)
+        message = {
+            "message_id": len(self.sent),
+            "date": 1,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text"),
+        }
+        return msgspec.Raw(msgspec.json.encode(message))
+
+
+def make_outbox(
+    storage: MemoryStorage, api: FakeApi, *, request_timeout: float = 1.0
+) -> Outbox:
+    queue = StorageQueue(storage, "outbox")
+    return Outbox(
+        queue,
+        api.request,
+        api.deliver,
+        PollBot._telegram_exception,  # pyright: ignore[reportPrivateUsage]
+        workers=2,
+        request_timeout=request_timeout,
+    )
+
+
+@pytest.mark.asyncio
+async def test_outbox() -> None:
+    storage = MemoryStorage()
+    api = FakeApi()
+    outbox = make_outbox(storage, api)
+    with pytest.raises(TypeError, match="Files"):
+        _ = await outbox.enqueue("sendDocument", ChatId(1), document=LocalFile("x"))
+    _ = await outbox.enqueue("sendMessage", ChatId(1), text="first")
+    await outbox.start()
+    with pytest.raises(RuntimeError, match="already started"):
+        await outbox.start()
+    message = await outbox.api.send_message(
+        ChatId(2), "second", message_thread_id=MessageThreadId(5)
+    )
+    assert isinstance(message, Message)
+    assert message.text == "second"
+    assert api.sent == [
+        ("sendMessage", ChatId(1), {"text": "first"}),
+        ("sendMessage", ChatId(2), {"text": "second", "message_thread_id": "5"}),
+    ]
+    with pytest.raises(BotBlocked):
+        _ = await outbox.request("sendMessage", ChatId(13), Message, text="blocked")
+    await outbox.stop()
+    assert [key async for key, _ in storage.iterate("outbox|item|")] == []
+
+
+@pytest.mark.asyncio
+async def test_outbox_restart(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(outbox_module, "OUTBOX_POLL_INTERVAL", 0.01)
+    storage = MemoryStorage()
+    api = FakeApi()
+    # Calls stored by a process that stopped before sending them
+    stopped = make_outbox(storage, api)
+    _ = await stopped.enqueue("sendMessage", ChatId(1), text="pending")
+    waiting = asyncio.create_task(
+        stopped.request("sendMessage", ChatId(2), Message, text="awaited")
+    )
+    blocked = asyncio.create_task(
+        stopped.request("sendMessage", ChatId(13), Message, text="blocked")
+    )
+    limited = asyncio.create_task(
+        stopped.request("sendMessage", ChatId(14), Message, text="limited")
+    )
+    await asyncio.sleep(0.02)
+    assert api.sent == []
+
+    worker = make_outbox(storage, api)
+    await worker.start()
+    message = await asyncio.wait_for(waiting, 1)
+    assert message.text == "awaited"
+    with pytest.raises(BotBlocked, match="blocked"):
+        await asyncio.wait_for(blocked, 1)
+    with pytest.raises(RetryAfter) as exc_info:
+        await asyncio.wait_for(limited, 1)
+    assert exc_info.value.retry_after == 7
+    assert [api_method for api_method, _, _ in api.sent] == ["sendMessage"] * 4
+    assert api.sent[0][2] == {"text": "pending"}
+    await worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_outbox_request_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(outbox_module, "OUTBOX_POLL_INTERVAL", 0.01)
+    storage = MemoryStorage()
+    api = FakeApi()
+    outbox = make_outbox(storage, api, request_timeout=0.03)
+    with pytest.raises(TimeoutError, match="not sent"):
+        _ = await outbox.request("sendMessage", ChatId(1), Message)
+    assert [key async for key, _ in storage.iterate("outbox|item|")] != []
+
+    # Another process sent the call and its result expired
+    outbox = make_outbox(storage, api)
+    request = asyncio.create_task(
+        outbox.request("sendMessage", ChatId(2), Message, text="lost")
+    )
+    await asyncio.sleep(0.02)
+    await storage.clear()
+    with pytest.raises(RuntimeError, match="lost"):
+        await request
+
+
+@pytest.mark.asyncio
+async def test_bot_outbox() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = MemoryStorage()
+    bot = PollBot("token", table, storage)
+    with pytest.raises(RuntimeError, match="disabled"):
+        _ = bot.outbox
+    bot = PollBot("token", table, storage, outbox=StorageQueue(storage, "outbox"))
+    assert isinstance(bot.outbox, Outbox)
+    await bot.client.close()
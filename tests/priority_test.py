@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from aiotgbot.priority import (
+    PriorityLane,
+    RequestPriority,
+    current_priority,
+    request_priority,
+)
+
+
+def test_request_priority() -> None:
+    assert current_priority() == RequestPriority.NORMAL
+    with request_priority(RequestPriority.BULK):
+        assert current_priority() == RequestPriority.BULK
+        with request_priority(RequestPriority.INTERACTIVE):
+            assert current_priority() == RequestPriority.INTERACTIVE
+        assert current_priority() == RequestPriority.BULK
+    assert current_priority() == RequestPriority.NORMAL
+
+
+@pytest.mark.asyncio
+async def test_priority_lane() -> None:
+    lane = PriorityLane()
+    order: list[str] = []
+    release = asyncio.Event()
+
+    async def hold() -> None:
+        async with lane.resource(RequestPriority.BULK):
+            await release.wait()
+
+    async def enter(name: str, priority: RequestPriority) -> None:
+        async with lane.resource(priority):
+            order.append(name)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    tasks = [
+        asyncio.create_task(enter("bulk1", RequestPriority.BULK)),
+        asyncio.create_task(enter("normal", RequestPriority.NORMAL)),
+        asyncio.create_task(enter("bulk2", RequestPriority.BULK)),
+        asyncio.create_task(enter("interactive", RequestPriority.INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert lane.waiting(RequestPriority.BULK) == 2
+    release.set()
+    await holder
+    _ = await asyncio.gather(*tasks)
+    assert order == ["interactive", "normal", "bulk1", "bulk2"]
+
+
+@pytest.mark.asyncio
+async def test_priority_lane_cancel() -> None:
+    lane = PriorityLane()
+    order: list[str] = []
+    release = asyncio.Event()
+
+    async def hold() -> None:
+        async with lane.resource(RequestPriority.NORMAL):
+            await release.wait()
+
+    async def enter(name: str, priority: RequestPriority) -> None:
+        async with lane.resource(priority):
+            order.append(name)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    cancelled = asyncio.create_task(enter("cancelled", RequestPriority.INTERACTIVE))
+    admitted = asyncio.create_task(enter("admitted", RequestPriority.BULK))
+    await asyncio.sleep(0)
+    _ = cancelled.cancel()
+    await asyncio.sleep(0)
+    assert lane.waiting(RequestPriority.INTERACTIVE) == 0
+
+    # Cancelled right after being admitted passes the lane on
+    late = asyncio.create_task(enter("late", RequestPriority.INTERACTIVE))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.sleep(0)
+    _ = late.cancel()
+    _ = await asyncio.gather(holder, late, admitted, return_exceptions=True)
+    assert late.cancelled()
+    assert order == ["admitted"]
+    async with asyncio.timeout(1):
+        await enter("last", RequestPriority.BULK)
+    assert order == ["admitted", "last"]
@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+
+from aiotgbot.storage import (
+    BatchStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
+from aiotgbot.storage_asyncpg import AsyncpgAdvisoryLock, AsyncpgStorage
+
+
+def test_storage_protocol() -> None:
+    storage = AsyncpgStorage("postgresql://localhost/test")
+    assert isinstance(storage, StorageProtocol)
+    assert isinstance(storage, TransactionalStorageProtocol)
+    assert isinstance(storage, BatchStorageProtocol)
+    with pytest.raises(ValueError, match="lock_pool_size"):
+        _ = AsyncpgAdvisoryLock(storage)
+    with pytest.raises(RuntimeError, match="disabled"):
+        _ = storage.lock_pool
+
+
+@pytest.mark.asyncio
+async def test_asyncpg_storage(postgres_dsn: str) -> None:
+    """Integration test: Postgres via asyncpg + testcontainers."""
+
+    storage = AsyncpgStorage(postgres_dsn, prefetch=2, lock_pool_size=2)
+    with pytest.raises(RuntimeError, match="Not connected"):
+        await storage.get("key1")
+    await storage.connect()
+    _ = await storage.pool.execute("DROP TABLE IF EXISTS kv")
+    await storage.close()
+    await storage.connect()
+    with pytest.raises(RuntimeError, match="Already connected"):
+        await storage.connect()
+    await storage.clear()
+
+    await storage.set("key1", {"key2": "value2"})
+    assert await storage.get("key1") == {"key2": "value2"}
+    assert await storage.get("missing") is None
+    await storage.set("key1", [1, 2.5, "three", None, True])
+    assert await storage.get("key1") == [1, 2.5, "three", None, True]
+
+    await storage.set_many((f"batch_{index}", index) for index in range(5))
+    await storage.set("key%", "percent")
+    assert [key async for key, _ in storage.iterate("key%")] == ["key%"]
+    assert [item async for item in storage.iterate("batch_")] == [
+        (f"batch_{index}", index) for index in range(5)
+    ]
+    await storage.delete_many(["batch_0", "batch_1"])
+    assert await storage.get_many(["batch_1", "batch_2"]) == {
+        "batch_1": None,
+        "batch_2": 2,
+    }
+    assert await storage.get_many([]) == {}
+    assert [key async for key, _ in storage.iterate("batch")] == [
+        "batch_2",
+        "batch_3",
+        "batch_4",
+    ]
+
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            await storage.set("key1", "changed")
+            raise RuntimeError("rollback")
+    assert await storage.get("key1") == [1, 2.5, "three", None, True]
+
+    await asyncio.gather(*(storage.set(f"key{index}", index) for index in range(10)))
+    await storage.delete("key1")
+    assert await storage.get("key1") is None
+
+    await storage.set("ttl1", 1, ttl=0.05)
+    await storage.set_many([("ttl2", 2), ("ttl3", 3)], ttl=0.05)
+    await storage.set("ttl3", 3)
+    await asyncio.sleep(0.06)
+    assert await storage.get("ttl1") is None
+    assert [item async for item in storage.iterate("ttl")] == [("ttl3", 3)]
+    assert await storage.delete_expired(1) == 1
+    assert await storage.delete_expired(10) == 1
+
+    await storage.clear()
+    await storage.set_many([
+        ("key%", 0),
+        ("keyA", 1),
+        ("key_1", 2),
+        ("key|1", 3),
+        ("key|2", 4),
+        ("key|3", 5),
+        ("key\U0010ffff", 6),
+        ("kez", 7),
+        ("kex", 8),
+    ])
+    assert [key async for key, _ in storage.iterate("key|")] == [
+        "key|1",
+        "key|2",
+        "key|3",
+    ]
+    assert [key async for key, _ in storage.iterate("key_")] == ["key_1"]
+    assert [key async for key, _ in storage.iterate("key%")] == ["key%"]
+    assert [key async for key, _ in storage.iterate("keya")] == []
+    assert [key async for key, _ in storage.iterate("key\U0010ffff")] == [
+        "key\U0010ffff"
+    ]
+    assert [item async for item in storage.iterate("key|", limit=2)] == [
+        ("key|1", 3),
+        ("key|2", 4),
+    ]
+    assert [
+        item async for item in storage.iterate("key|", start_after="key|2", limit=2)
+    ] == [("key|3", 5)]
+    assert [key async for key, _ in storage.iterate(start_after="key|3")] == [
+        "key\U0010ffff",
+        "kez",
+    ]
+
+    assert await storage.incr("counter") == 1
+    assert await storage.incr("counter", 5) == 6
+    assert await storage.get("counter") == 6
+    await storage.set("text", "value")
+    with pytest.raises(ValueError, match="integer"):
+        _ = await storage.incr("text")
+    await storage.set("null")
+    assert await storage.incr("null", 2) == 2
+    assert await storage.incr("window", ttl=0.05) == 1
+    assert await storage.incr("window", ttl=60) == 2
+    await asyncio.sleep(0.06)
+    assert await storage.incr("window") == 1
+    results = await asyncio.gather(*(storage.incr("concurrent") for _ in range(20)))
+    assert sorted(results) == list(range(1, 21))
+
+    assert await storage.set_if_absent("token", "a", ttl=0.05)
+    assert not await storage.set_if_absent("token", "b")
+    assert await storage.get("token") == "a"
+    await asyncio.sleep(0.06)
+    assert await storage.set_if_absent("token", "c")
+    assert await storage.get("token") == "c"
+
+    assert await storage.compare_and_set("cas", None, {"a": 1})
+    assert not await storage.compare_and_set("cas", None, {"a": 2})
+    assert not await storage.compare_and_set("cas", {"a": 2}, {"a": 3})
+    assert await storage.compare_and_set("cas", {"a": 1}, {"a": 3})
+    assert await storage.get("cas") == {"a": 3}
+    assert await storage.compare_and_set("null", 2, None)
+    assert not await storage.set_if_absent("null", 1)
+    assert await storage.compare_and_set("null", None, "x")
+
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            await storage.set("tx", 1)
+            assert await storage.incr("tx") == 2
+            assert await storage.get("tx") == 2
+            raise RuntimeError("rollback")
+    assert await storage.get("tx") is None
+    async with storage.transaction():
+        await storage.set("tx", 1)
+        await storage.delete("counter")
+        assert await storage.compare_and_set("tx", 1, 2)
+        assert await storage.get("counter") is None
+    assert await storage.get("tx") == 2
+    assert await storage.get("counter") is None
+
+    # Two lock providers on one pool stand for two processes
+    locks = (AsyncpgAdvisoryLock(storage), AsyncpgAdvisoryLock(storage))
+    events: list[str] = []
+
+    async def hold(lock: AsyncpgAdvisoryLock, name: str) -> int:
+        async with lock.resource("user|chat") as token:
+            events.append(f"{name} enter")
+            await asyncio.sleep(0.05)
+            events.append(f"{name} exit")
+            return token
+
+    tokens = await asyncio.gather(hold(locks[0], "first"), hold(locks[1], "second"))
+    assert sorted(tokens) == [1, 2]
+    assert events[1] == events[0].replace("enter", "exit")
+    assert await storage.get("lock_fence|user|chat") == 2
+
+    assert await storage.set_many_fenced("fence", 2, [("state", "first")], ttl=60)
+    assert not await storage.set_many_fenced("fence", 1, [("state", "stale")])
+    assert await storage.get_many(["fence", "state"]) == {
+        "fence": 2,
+        "state": "first",
+    }
+    assert list(await storage.get_expiry_many(["fence", "tx"])) == ["fence"]
+
+    await storage.clear()
+    assert [item async for item in storage.iterate()] == []
+    await storage.close()
@@ -0,0 +1,140 @@
+import asyncio
+from collections.abc import Iterable
+
+import pytest
+from typing_extensions import override  # Python 3.11 compatibility
+
+from aiotgbot import StorageProtocol
+from aiotgbot.helpers import Json
+from aiotgbot.storage import BatchStorageProtocol
+from aiotgbot.storage_cached import CachedStorage
+from aiotgbot.storage_memory import MemoryStorage
+
+KeyValue = tuple[str, Json]
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self) -> None:
+        super().__init__()
+        self.gets: int = 0
+        self.batches: int = 0
+
+    @override
+    async def get(self, key: str) -> Json:
+        self.gets += 1
+        return await super().get(key)
+
+    @override
+    async def set_many(
+        self, items: Iterable[tuple[str, Json]], *, ttl: float | None = None
+    ) -> None:
+        self.batches += 1
+        await super().set_many(items, ttl=ttl)
+
+
+def test_storage_protocol() -> None:
+    storage = CachedStorage(MemoryStorage())
+    assert isinstance(storage, StorageProtocol)
+    assert isinstance(storage, BatchStorageProtocol)
+
+
+@pytest.mark.asyncio
+async def test_cached_storage() -> None:
+    backend = CountingStorage()
+    storage = CachedStorage(backend, max_size=2, max_staleness=0.05)
+    await storage.connect()
+    with pytest.raises(RuntimeError, match="Already connected"):
+        await storage.connect()
+
+    await storage.set("key1", {"key2": "value2"})
+    assert await backend.get("key1") is None
+    assert await storage.get("key1") == {"key2": "value2"}
+    value = await storage.get("key1")
+    assert isinstance(value, dict)
+    value["key2"] = "mutated"
+    assert await storage.get("key1") == {"key2": "value2"}
+
+    await asyncio.sleep(0.1)
+    assert await backend.get("key1") == {"key2": "value2"}
+    assert backend.batches == 1
+
+    backend.gets = 0
+    assert await storage.get("missing") is None
+    assert await storage.get("missing") is None
+    assert backend.gets == 1
+
+    await storage.set("key2", 2)
+    await storage.set("key3", 3)
+    assert await storage.get("key1") == {"key2": "value2"}
+    assert backend.gets == 2
+
+    await storage.delete("key1")
+    assert await storage.get("key1") is None
+    backend.gets = 0
+    await backend.set("other", 5)
+    assert await storage.get_many(["key1", "key2", "other"]) == {
+        "key1": None,
+        "key2": 2,
+        "other": 5,
+    }
+    assert await storage.get("other") == 5
+    assert backend.gets == 0
+    items: list[KeyValue] = [item async for item in storage.iterate("key")]
+    assert items == [("key2", 2), ("key3", 3)]
+
+    await storage.set("key4", 4)
+    await storage.close()
+    assert await backend.get("key4") == 4
+    with pytest.raises(RuntimeError, match="Not connected"):
+        await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_storage_max_dirty() -> None:
+    backend = CountingStorage()
+    storage = CachedStorage(backend, max_staleness=60, max_dirty=3)
+    await storage.connect()
+    await storage.set_many([("key1", 1), ("key2", 2)])
+    assert await backend.get("key1") is None
+    await storage.set("key3", 3)
+    assert await backend.get("key1") == 1
+    assert await backend.get("key3") == 3
+
+    await storage.clear()
+    assert await storage.get("key1") is None
+    assert [item async for item in backend.iterate()] == []
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_storage_ttl() -> None:
+    backend = MemoryStorage()
+    storage = CachedStorage(backend, max_staleness=60)
+    await storage.connect()
+    await storage.set("key1", 1, ttl=0.05)
+    await storage.set_many([("key2", 2)], ttl=0.05)
+    await storage.set("key3", 3)
+    await storage.flush()
+    assert await backend.get("key1") == 1
+    await asyncio.sleep(0.06)
+    assert await storage.get("key1") is None
+    assert await storage.delete_expired(10) == 2
+    assert [item async for item in storage.iterate()] == [("key3", 3)]
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_storage_fenced() -> None:
+    backend = CountingStorage()
+    storage = CachedStorage(backend, max_staleness=10.0)
+    await storage.connect()
+    await storage.set("state", "buffered")
+    assert await storage.set_many_fenced("fence", 2, [("state", "fenced")])
+    assert await backend.get_many(["fence", "state"]) == {
+        "fence": 2,
+        "state": "fenced",
+    }
+    await backend.set("state", "newer")
+    assert not await storage.set_many_fenced("fence", 1, [("state", "stale")])
+    assert await storage.get("state") == "newer"
+    await storage.close()
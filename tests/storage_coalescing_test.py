@@ -0,0 +1,142 @@
+import asyncio
+from collections.abc import Iterable
+
+import pytest
+from typing_extensions import override  # Python 3.11 compatibility
+
+from aiotgbot import StorageProtocol
+from aiotgbot.helpers import Json
+from aiotgbot.storage import BatchStorageProtocol, TransactionalStorageProtocol
+from aiotgbot.storage_coalescing import CoalescingStorage
+from aiotgbot.storage_memory import MemoryStorage
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self) -> None:
+        super().__init__()
+        self.batches: list[list[str]] = []
+        self.gets: int = 0
+        self.release: asyncio.Event = asyncio.Event()
+        self.release.set()
+
+    @override
+    async def get(self, key: str) -> Json:
+        self.gets += 1
+        return await super().get(key)
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        key_list = list(keys)
+        self.batches.append(key_list)
+        _ = await self.release.wait()
+        return await super().get_many(key_list)
+
+
+def test_storage_protocol() -> None:
+    storage = CoalescingStorage(MemoryStorage())
+    assert isinstance(storage, StorageProtocol)
+    assert isinstance(storage, BatchStorageProtocol)
+    assert isinstance(storage, TransactionalStorageProtocol)
+    with pytest.raises(ValueError, match="max_batch_size"):
+        _ = CoalescingStorage(MemoryStorage(), max_batch_size=0)
+
+
+@pytest.mark.asyncio
+async def test_coalescing_storage() -> None:
+    backend = CountingStorage()
+    storage = CoalescingStorage(backend, max_batch_size=3)
+    await storage.connect()
+    await storage.set_many([("key1", 1), ("key2", 2), ("key3", 3), ("key4", 4)])
+
+    values = await asyncio.gather(
+        storage.get("key1"),
+        storage.get("key1"),
+        storage.get("key2"),
+        storage.get_many(["key3", "key1", "missing"]),
+        storage.get("key4"),
+    )
+    assert list(values) == [
+        1,
+        1,
+        2,
+        {"key3": 3, "key1": 1, "missing": None},
+        4,
+    ]
+    assert backend.batches == [["key1", "key2", "key3"], ["missing", "key4"]]
+    assert backend.gets == 0
+
+    async with storage.transaction():
+        await storage.set("key1", 10)
+        assert await storage.get("key1") == 10
+        assert await storage.get_many(["key1", "key2"]) == {"key1": 10, "key2": 2}
+    assert backend.gets == 1
+    assert len(backend.batches) == 3
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_coalescing_storage_write() -> None:
+    backend = CountingStorage()
+    storage = CoalescingStorage(backend)
+    await storage.set("key", 1)
+    backend.release.clear()
+    stale = asyncio.create_task(storage.get("key"))
+    await asyncio.sleep(0.01)
+    assert backend.batches == [["key"]]
+    await storage.set("key", 2)
+    fresh = asyncio.create_task(storage.get("key"))
+    await asyncio.sleep(0.01)
+    assert len(backend.batches) == 2
+    backend.release.set()
+    assert await stale in (1, 2)
+    assert await fresh == 2
+    assert await storage.incr("counter") == 1
+    assert await storage.get("counter") == 1
+
+
+@pytest.mark.asyncio
+async def test_coalescing_storage_copies() -> None:
+    storage = CoalescingStorage(MemoryStorage())
+    await storage.set("key", {"items": [1]})
+    first, second, many = await asyncio.gather(
+        storage.get("key"), storage.get("key"), storage.get_many(["key"])
+    )
+    assert isinstance(first, dict)
+    first["items"] = [2]
+    assert second == {"items": [1]}
+    assert many == {"key": {"items": [1]}}
+
+
+@pytest.mark.asyncio
+async def test_coalescing_storage_error() -> None:
+    class FailingStorage(CountingStorage):
+        @override
+        async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+            raise RuntimeError("failed")
+
+    storage = CoalescingStorage(FailingStorage())
+    results = await asyncio.gather(
+        storage.get("key"), storage.get("key"), return_exceptions=True
+    )
+    assert [str(result) for result in results] == ["failed", "failed"]
+    cancelled = asyncio.create_task(storage.get("key"))
+    await asyncio.sleep(0)
+    _ = cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    await asyncio.sleep(0)
+    with pytest.raises(RuntimeError, match="failed"):
+        await storage.get("key")
+
+
+@pytest.mark.asyncio
+async def test_coalescing_storage_fenced() -> None:
+    storage = CoalescingStorage(MemoryStorage())
+    assert await storage.get("state") is None
+    assert await storage.set_many_fenced("fence", 2, [("state", "fenced")])
+    assert await storage.get_many(["fence", "state"]) == {
+        "fence": 2,
+        "state": "fenced",
+    }
+    assert not await storage.set_many_fenced("fence", 1, [("state", "stale")])
+    assert await storage.get("state") == "fenced"
@@ -1,3 +1,6 @@
+import asyncio
+from pathlib import Path
+
 import pytest
 
 from aiotgbot import StorageProtocol
@@ -54,3 +57,205 @@ async def test_sqlite_storage() -> None:
     assert storage.raw_connection() is None
 
     await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_batch() -> None:
+    storage = MemoryStorage()
+    await storage.set_many([("key1", 1), ("key2", 2), ("key3", 3)])
+    await storage.delete_many(["key1", "key3", "missing"])
+    assert [item async for item in storage.iterate()] == [("key2", 2)]
+    assert await storage.get_many(["key2", "key1", "missing"]) == {
+        "key2": 2,
+        "key1": None,
+        "missing": None,
+    }
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_ttl() -> None:
+    storage = MemoryStorage()
+    with pytest.raises(ValueError, match="ttl"):
+        await storage.set("key", 1, ttl=0)
+    await storage.set("key1", 1, ttl=0.05)
+    await storage.set_many([("key2", 2), ("key3", 3)], ttl=0.05)
+    await storage.set("key3", 3)
+    await storage.set("key4", 4, ttl=60)
+    assert await storage.get("key1") == 1
+    await asyncio.sleep(0.06)
+    assert await storage.get("key2") is None
+    assert [item async for item in storage.iterate()] == [("key3", 3), ("key4", 4)]
+    await storage.set("key5", 5, ttl=0.01)
+    await storage.set("key6", 6, ttl=0.01)
+    await asyncio.sleep(0.02)
+    assert await storage.delete_expired(1) == 1
+    assert await storage.delete_expired(10) == 1
+    assert await storage.delete_expired(10) == 0
+    assert [key async for key, _ in storage.iterate()] == ["key3", "key4"]
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_expiry_heap_compaction() -> None:
+    storage = MemoryStorage()
+    for _ in range(1000):
+        await storage.set("key", 1, ttl=60)
+    assert len(storage._expiry_heap) < 100  # pyright: ignore[reportPrivateUsage]
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_iterate_range() -> None:
+    storage = MemoryStorage()
+    await storage.set("key|0", 0, ttl=0.01)
+    await asyncio.sleep(0.02)
+
+    await storage.set_many([
+        ("key%", 0),
+        ("keyA", 1),
+        ("key_1", 2),
+        ("key|1", 3),
+        ("key|2", 4),
+        ("key|3", 5),
+        ("key\U0010ffff", 6),
+        ("kez", 7),
+        ("kex", 8),
+    ])
+    assert [key async for key, _ in storage.iterate("key|")] == [
+        "key|1",
+        "key|2",
+        "key|3",
+    ]
+    assert [key async for key, _ in storage.iterate("key_")] == ["key_1"]
+    assert [key async for key, _ in storage.iterate("key%")] == ["key%"]
+    assert [key async for key, _ in storage.iterate("keya")] == []
+    assert [key async for key, _ in storage.iterate("key\U0010ffff")] == [
+        "key\U0010ffff"
+    ]
+    assert [item async for item in storage.iterate("key|", limit=2)] == [
+        ("key|1", 3),
+        ("key|2", 4),
+    ]
+    assert [
+        item async for item in storage.iterate("key|", start_after="key|2", limit=2)
+    ] == [("key|3", 5)]
+    assert [key async for key, _ in storage.iterate(start_after="key|3")] == [
+        "key\U0010ffff",
+        "kez",
+    ]
+    assert "key|0" not in storage._keys  # pyright: ignore[reportPrivateUsage]
+    await storage.delete_many(["key|1", "kez"])
+    assert [key async for key, _ in storage.iterate("key|")] == ["key|2", "key|3"]
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_atomic() -> None:
+    storage = MemoryStorage()
+    assert await storage.incr("counter") == 1
+    assert await storage.incr("counter", 5) == 6
+    assert await storage.get("counter") == 6
+    await storage.set("text", "value")
+    with pytest.raises(ValueError, match="integer"):
+        _ = await storage.incr("text")
+    await storage.set("null")
+    assert await storage.incr("null", 2) == 2
+    assert await storage.incr("window", ttl=0.05) == 1
+    assert await storage.incr("window", ttl=60) == 2
+    await asyncio.sleep(0.06)
+    assert await storage.incr("window") == 1
+    results = await asyncio.gather(*(storage.incr("concurrent") for _ in range(20)))
+    assert sorted(results) == list(range(1, 21))
+
+    assert await storage.set_if_absent("token", "a", ttl=0.05)
+    assert not await storage.set_if_absent("token", "b")
+    assert await storage.get("token") == "a"
+    await asyncio.sleep(0.06)
+    assert await storage.set_if_absent("token", "c")
+    assert await storage.get("token") == "c"
+
+    assert await storage.compare_and_set("cas", None, {"a": 1})
+    assert not await storage.compare_and_set("cas", None, {"a": 2})
+    assert not await storage.compare_and_set("cas", {"a": 2}, {"a": 3})
+    assert await storage.compare_and_set("cas", {"a": 1}, {"a": 3})
+    assert await storage.get("cas") == {"a": 3}
+    assert await storage.compare_and_set("null", 2, None)
+    assert not await storage.set_if_absent("null", 1)
+    assert await storage.compare_and_set("null", None, "x")
+
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            await storage.set("tx", 1)
+            assert await storage.incr("tx") == 2
+            assert await storage.get("tx") == 2
+            raise RuntimeError("rollback")
+    assert await storage.get("tx") is None
+    async with storage.transaction():
+        await storage.set("tx", 1)
+        await storage.delete("counter")
+        assert await storage.compare_and_set("tx", 1, 2)
+        assert await storage.get("counter") is None
+    assert await storage.get("tx") == 2
+    assert await storage.get("counter") is None
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_persistence(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="sync_interval"):
+        _ = MemoryStorage(tmp_path, sync_interval=0)
+    storage = MemoryStorage(tmp_path)
+    with pytest.raises(RuntimeError, match="Not connected"):
+        await storage.set("key", 1)
+    await storage.connect()
+    with pytest.raises(RuntimeError, match="Already connected"):
+        await storage.connect()
+    await storage.set("cleared", 0)
+    await storage.clear()
+    await storage.set("key1", {"a": [1, 2.5, None]})
+    await storage.set_many([("key2", 2), ("key3", 3)], ttl=60)
+    await storage.delete("key2")
+    async with storage.transaction():
+        await storage.set("key4", "four")
+        _ = await storage.incr("key5")
+    await storage.close()
+
+    storage = MemoryStorage(tmp_path)
+    await storage.connect()
+    assert [item async for item in storage.iterate()] == [
+        ("key1", {"a": [1, 2.5, None]}),
+        ("key3", 3),
+        ("key4", "four"),
+        ("key5", 1),
+    ]
+    assert storage._expires.keys() == {"key3"}  # pyright: ignore[reportPrivateUsage]
+    await storage.set("key6", 6)
+    await storage.sync()
+    await storage.set("unsynced", 0)
+    (log_path,) = tmp_path.glob("log-*.msgpack")
+    with log_path.open("ab") as log_file:
+        _ = log_file.write(b"\x00\x00\x01\x00torn")
+
+    recovered = MemoryStorage(tmp_path)
+    await recovered.connect()
+    assert await recovered.get("key6") == 6
+    assert await recovered.get("unsynced") is None
+    assert await recovered.get("key1") == {"a": [1, 2.5, None]}
+    await recovered.close()
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_memory_storage_snapshot(tmp_path: Path) -> None:
+    storage = MemoryStorage(tmp_path, sync_interval=0.01, snapshot_interval=0.01)
+    await storage.connect()
+    await storage.set("key1", 1)
+    await asyncio.sleep(0.05)
+    await storage.set("key2", 2)
+    await asyncio.sleep(0.05)
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert len(files) == 2
+    assert files[0].startswith("log-")
+    assert files[1].startswith("snapshot-")
+    assert files[0][4:] == files[1][9:]
+    await storage.close()
+    storage = MemoryStorage(tmp_path)
+    await storage.connect()
+    assert [item async for item in storage.iterate()] == [("key1", 1), ("key2", 2)]
+    await storage.close()
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+
+from aiotgbot.storage_memory import MemoryStorage
+from aiotgbot.storage_migrate import (
+    copy_storage,
+    main,
+    open_storage,
+    verify_storage,
+)
+from aiotgbot.storage_mmap import MmapStorage
+from aiotgbot.storage_sqlite import SQLiteStorage
+
+
+@pytest.mark.asyncio
+async def test_copy_storage() -> None:
+    source = MemoryStorage()
+    destination = MemoryStorage()
+    await source.set_many((f"key|{index:03}", index) for index in range(25))
+    await source.set("other", 1)
+    checkpoints: list[str] = []
+    with pytest.raises(ValueError, match="batch_size"):
+        _ = await copy_storage(source, destination, batch_size=0)
+    assert (
+        await copy_storage(
+            source,
+            destination,
+            prefix="key|",
+            batch_size=10,
+            checkpoint=checkpoints.append,
+        )
+        == 25
+    )
+    assert checkpoints == ["key|009", "key|019", "key|024"]
+    assert await destination.get("other") is None
+    assert await verify_storage(source, destination, batch_size=7) == ["other"]
+
+    await destination.clear()
+    assert await copy_storage(source, destination, start_after="key|019") == 6
+    assert [key async for key, _ in destination.iterate()] == [
+        "key|020",
+        "key|021",
+        "key|022",
+        "key|023",
+        "key|024",
+        "other",
+    ]
+    await destination.set("key|024", "changed")
+    assert await verify_storage(source, destination, prefix="key|02") == ["key|024"]
+
+
+@pytest.mark.asyncio
+async def test_copy_storage_ttl(tmp_path: Path) -> None:
+    source = SQLiteStorage(tmp_path / "source.sqlite3")
+    destination = MemoryStorage()
+    await source.connect()
+    await source.set("lease", 1, ttl=60)
+    await source.set("short", 2, ttl=0.01)
+    await source.set("state", 3)
+    await asyncio.sleep(0.02)
+    assert await copy_storage(source, destination) == 2
+    expiry = await destination.get_expiry_many(["lease", "state"])
+    assert list(expiry) == ["lease"]
+    assert expiry["lease"] == pytest.approx(time.time() + 60, abs=1)
+    assert await destination.get("state") == 3
+    await source.close()
+
+
+def test_open_storage(tmp_path: Path) -> None:
+    assert isinstance(open_storage("memory:"), MemoryStorage)
+    assert isinstance(open_storage(f"sqlite://{tmp_path / 'kv.db'}"), SQLiteStorage)
+    assert isinstance(open_storage(f"mmap:{tmp_path / 'kv'}"), MmapStorage)
+    with pytest.raises(ValueError, match="Unsupported"):
+        _ = open_storage("redis://localhost")
+
+
+async def fill_source(path: Path) -> None:
+    source = SQLiteStorage(path)
+    await source.connect()
+    await source.set_many((f"key{index:02}", {"index": index}) for index in range(30))
+    await source.close()
+
+
+def test_migrate_cli(tmp_path: Path) -> None:
+    source_path = tmp_path / "source.sqlite3"
+    asyncio.run(fill_source(source_path))
+
+    checkpoint = tmp_path / "checkpoint.json"
+    _ = checkpoint.write_text('"key19"')
+    destination = f"memory:{tmp_path / 'destination'}"
+    arguments = [f"sqlite:{source_path}", destination, "--batch-size", "4"]
+    assert main([*arguments, "--checkpoint", str(checkpoint)]) == 0
+    assert checkpoint.read_text() == '"key29"'
+    assert main([*arguments, "--checkpoint", str(checkpoint), "--verify"]) == 1
+    checkpoint.unlink()
+    assert main([*arguments, "--checkpoint", str(checkpoint), "--verify"]) == 0
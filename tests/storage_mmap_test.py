@@ -0,0 +1,210 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from aiotgbot.storage import (
+    AtomicStorageProtocol,
+    BatchStorageProtocol,
+    ExpiringStorageProtocol,
+    StorageProtocol,
+)
+from aiotgbot.storage_mmap import MmapStorage
+
+
+def test_storage_protocol(tmp_path: Path) -> None:
+    storage = MmapStorage(tmp_path)
+    assert isinstance(storage, StorageProtocol)
+    assert isinstance(storage, BatchStorageProtocol)
+    assert isinstance(storage, ExpiringStorageProtocol)
+    assert isinstance(storage, AtomicStorageProtocol)
+
+
+@pytest.mark.asyncio
+async def test_mmap_storage(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="compact_ratio"):
+        _ = MmapStorage(tmp_path, compact_ratio=0)
+    storage = MmapStorage(tmp_path)
+    with pytest.raises(RuntimeError, match="Not connected"):
+        await storage.set("key1", "value1")
+    await storage.connect()
+    with pytest.raises(RuntimeError, match="Already connected"):
+        await storage.connect()
+    await storage.set("key1", {"key2": "value2"})
+    assert await storage.get("key1") == {"key2": "value2"}
+    assert await storage.get("key2") is None
+    await storage.set("key2", [1, 2.5, "three", None, True])
+    await storage.set_many([("batch1", 1), ("batch2", 2)])
+    await storage.delete_many(["batch1", "missing"])
+    assert await storage.get_many(["batch1", "batch2"]) == {
+        "batch1": None,
+        "batch2": 2,
+    }
+    await storage.delete("key1")
+    await storage.set("key3")
+    assert [item async for item in storage.iterate()] == [
+        ("batch2", 2),
+        ("key2", [1, 2.5, "three", None, True]),
+        ("key3", None),
+    ]
+    assert [key async for key, _ in storage.iterate("key", start_after="key2")] == [
+        "key3"
+    ]
+    assert [key async for key, _ in storage.iterate(limit=2)] == ["batch2", "key2"]
+    await storage.close()
+
+    storage = MmapStorage(tmp_path)
+    await storage.connect()
+    assert [item async for item in storage.iterate()] == [
+        ("batch2", 2),
+        ("key2", [1, 2.5, "three", None, True]),
+        ("key3", None),
+    ]
+    await storage.clear()
+    assert [item async for item in storage.iterate()] == []
+    await storage.close()
+    storage = MmapStorage(tmp_path)
+    await storage.connect()
+    assert [item async for item in storage.iterate()] == []
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_storage_ttl(tmp_path: Path) -> None:
+    storage = MmapStorage(tmp_path)
+    await storage.connect()
+    await storage.set("key1", 1, ttl=0.05)
+    await storage.set_many([("key2", 2), ("key3", 3)], ttl=0.05)
+    await storage.set("key3", 3)
+    await storage.set("key4", 4, ttl=60)
+    assert await storage.get("key1") == 1
+    await asyncio.sleep(0.06)
+    assert await storage.get("key1") is None
+    assert await storage.delete_expired(1) == 1
+    assert await storage.delete_expired(10) == 0
+    assert [key async for key, _ in storage.iterate()] == ["key3", "key4"]
+    await storage.set("key5", 5, ttl=0.01)
+    await storage.close()
+    await asyncio.sleep(0.02)
+    storage = MmapStorage(tmp_path)
+    await storage.connect()
+    assert [key async for key, _ in storage.iterate()] == ["key3", "key4"]
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_storage_atomic(tmp_path: Path) -> None:
+    storage = MmapStorage(tmp_path)
+    await storage.connect()
+    assert await storage.incr("counter") == 1
+    assert await storage.incr("counter", 5) == 6
+    assert await storage.get("counter") == 6
+    await storage.set("text", "value")
+    with pytest.raises(ValueError, match="integer"):
+        _ = await storage.incr("text")
+    await storage.set("null")
+    assert await storage.incr("null", 2) == 2
+    assert await storage.incr("window", ttl=0.05) == 1
+    assert await storage.incr("window", ttl=60) == 2
+    await asyncio.sleep(0.06)
+    assert await storage.incr("window") == 1
+    results = await asyncio.gather(*(storage.incr("concurrent") for _ in range(20)))
+    assert sorted(results) == list(range(1, 21))
+
+    assert await storage.set_if_absent("token", "a", ttl=0.05)
+    assert not await storage.set_if_absent("token", "b")
+    assert await storage.get("token") == "a"
+    await asyncio.sleep(0.06)
+    assert await storage.set_if_absent("token", "c")
+    assert await storage.get("token") == "c"
+
+    assert await storage.compare_and_set("cas", None, {"a": 1})
+    assert not await storage.compare_and_set("cas", None, {"a": 2})
+    assert not await storage.compare_and_set("cas", {"a": 2}, {"a": 3})
+    assert await storage.compare_and_set("cas", {"a": 1}, {"a": 3})
+    assert await storage.get("cas") == {"a": 3}
+    assert await storage.compare_and_set("null", 2, None)
+    assert not await storage.set_if_absent("null", 1)
+    assert await storage.compare_and_set("null", None, "x")
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_storage_recovery(tmp_path: Path) -> None:
+    storage = MmapStorage(tmp_path)
+    await storage.connect()
+    await storage.set("key1", 1)
+    await storage.set("key2", 2)
+    segment = storage._segments[-1]  # pyright: ignore[reportPrivateUsage]
+    # Tear the last record as if the process died halfway through it
+    segment.map[segment.end - 1 : segment.end] = b"\xff"
+    await storage.sync()
+
+    recovered = MmapStorage(tmp_path)
+    await recovered.connect()
+    assert [item async for item in recovered.iterate()] == [("key1", 1)]
+    await recovered.set("key3", 3)
+    await recovered.close()
+    recovered = MmapStorage(tmp_path)
+    await recovered.connect()
+    assert [item async for item in recovered.iterate()] == [("key1", 1), ("key3", 3)]
+    await recovered.close()
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_storage_concurrent_rotation(tmp_path: Path) -> None:
+    storage = MmapStorage(tmp_path, segment_size=256)
+    await storage.connect()
+    # New segments are opened in a thread while other writers wait
+    _ = await asyncio.gather(
+        *(storage.set(f"key{index:02d}", "x" * index) for index in range(40)),
+        *(storage.incr("counter") for _ in range(40)),
+    )
+    assert await storage.get("counter") == 40
+    await storage.close()
+    storage = MmapStorage(tmp_path, segment_size=256)
+    await storage.connect()
+    assert await storage.get_many(["key39", "counter"]) == {
+        "key39": "x" * 39,
+        "counter": 40,
+    }
+    assert len([key async for key, _ in storage.iterate("key")]) == 40
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_mmap_storage_compaction(tmp_path: Path) -> None:
+    storage = MmapStorage(tmp_path, segment_size=256)
+    await storage.connect()
+    for index in range(20):
+        await storage.set(f"key{index % 4}", index)
+    await storage.set("large", "x" * 1000)
+    await storage.delete("key0")
+    assert len(list(tmp_path.glob("segment-*.data"))) > 2
+    await storage.compact()
+    assert len(list(tmp_path.glob("compact-*.data"))) == 1
+    assert len(list(tmp_path.glob("segment-*.data"))) == 1
+    expected = [
+        ("key1", 17),
+        ("key2", 18),
+        ("key3", 19),
+        ("large", "x" * 1000),
+    ]
+    assert [item async for item in storage.iterate()] == expected
+    for index in range(20):
+        await storage.set(f"key{index % 4 + 1}", index)
+    await storage.compact()
+    expected = [
+        ("key1", 16),
+        ("key2", 17),
+        ("key3", 18),
+        ("key4", 19),
+        ("large", "x" * 1000),
+    ]
+    assert [item async for item in storage.iterate()] == expected
+    await storage.close()
+    storage = MmapStorage(tmp_path, segment_size=256)
+    await storage.connect()
+    assert [item async for item in storage.iterate()] == expected
+    await storage.close()
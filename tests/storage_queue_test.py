@@ -0,0 +1,119 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+
+import pytest
+from typing_extensions import override  # Python 3.11 compatibility
+
+from aiotgbot.helpers import Json
+from aiotgbot.storage_cached import CachedStorage
+from aiotgbot.storage_memory import MemoryStorage
+from aiotgbot.storage_queue import QueueItem, StorageQueue
+
+
+class HookStorage(MemoryStorage):
+    def __init__(self) -> None:
+        super().__init__()
+        self.hook: Callable[[], Awaitable[None]] | None = None
+
+    @override
+    async def get_many(self, keys: Iterable[str]) -> dict[str, Json]:
+        values = await super().get_many(keys)
+        if self.hook is not None:
+            hook, self.hook = self.hook, None
+            await hook()
+        return values
+
+
+def test_storage_queue_arguments() -> None:
+    with pytest.raises(TypeError, match="atomic"):
+        _ = StorageQueue(CachedStorage(MemoryStorage()), "inbox")
+    with pytest.raises(ValueError, match="lease_ttl"):
+        _ = StorageQueue(MemoryStorage(), "inbox", lease_ttl=0)
+    with pytest.raises(ValueError, match="page_size"):
+        _ = StorageQueue(MemoryStorage(), "inbox", page_size=0)
+
+
+@pytest.mark.asyncio
+async def test_storage_queue() -> None:
+    storage = MemoryStorage()
+    queue = StorageQueue(storage, "inbox", lease_ttl=0.05, page_size=2)
+    # A second queue on the same storage stands for another process
+    other = StorageQueue(storage, "inbox", lease_ttl=0.05, page_size=2)
+    assert await queue.claim() is None
+    for index in range(5):
+        _ = await queue.put({"index": index})
+
+    first = await queue.claim()
+    second = await other.claim()
+    third = await queue.claim()
+    assert first is not None and second is not None and third is not None
+    assert [first.data, second.data, third.data] == [
+        {"index": 0},
+        {"index": 1},
+        {"index": 2},
+    ]
+    await queue.ack(first)
+    await other.release(second)
+    assert await queue.renew(third)
+    retried = await queue.claim()
+    assert retried is not None
+    assert retried.key == second.key
+
+    await asyncio.sleep(0.06)
+    assert not await queue.renew(third)
+    expired = await other.claim()
+    assert expired is not None
+    assert expired.key == second.key
+    assert [item.data async for item in _drain(queue)] == [
+        {"index": 2},
+        {"index": 3},
+        {"index": 4},
+    ]
+    assert await queue.claim() is None
+    await queue.ack(expired)
+    assert [key async for key, _ in storage.iterate("inbox|item|")] == []
+    assert [key async for key, _ in storage.iterate("inbox|lease|")] == []
+
+
+@pytest.mark.asyncio
+async def test_storage_queue_ack_before_claim() -> None:
+    storage = HookStorage()
+    queue = StorageQueue(storage, "inbox")
+    other = StorageQueue(storage, "inbox")
+    _ = await queue.put(None)
+
+    async def claim_and_ack() -> None:
+        item = await queue.claim()
+        assert item is not None
+        await queue.ack(item)
+
+    # The item is acked after the other consumer read its lease
+    storage.hook = claim_and_ack
+    assert await other.claim() is None
+    assert [key async for key, _ in storage.iterate("inbox|")] == ["inbox|sequence"]
+
+    key = await queue.put(None)
+    item = await other.claim()
+    assert item is not None
+    assert item.key == key
+
+
+async def _drain(queue: StorageQueue) -> AsyncIterator[QueueItem]:
+    while (item := await queue.claim()) is not None:
+        await queue.ack(item)
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_storage_queue_wait() -> None:
+    queue = StorageQueue(MemoryStorage(), "inbox")
+    assert await queue.claim() is None
+    waiter = asyncio.create_task(queue.wait(1))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    _ = await queue.put("update")
+    await asyncio.wait_for(waiter, 0.1)
+    item = await queue.claim()
+    assert item is not None
+    assert item.data == "update"
+    await asyncio.wait_for(queue.wait(0.01), 0.1)
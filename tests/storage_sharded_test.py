@@ -0,0 +1,135 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from aiotgbot import PollBot
+from aiotgbot.api_types import ChatId, UserId
+from aiotgbot.handler_table import HandlerTable
+from aiotgbot.lock import StorageLock
+from aiotgbot.storage import (
+    AtomicStorageProtocol,
+    FencedStorageProtocol,
+    StorageProtocol,
+    TransactionalStorageProtocol,
+)
+from aiotgbot.storage_memory import MemoryStorage
+from aiotgbot.storage_sharded import ShardedStorage, shard_key
+from aiotgbot.storage_sqlite import SQLiteStorage
+
+
+def test_storage_protocol() -> None:
+    storage = ShardedStorage([MemoryStorage(), MemoryStorage()])
+    assert isinstance(storage, StorageProtocol)
+    assert isinstance(storage, TransactionalStorageProtocol)
+    assert isinstance(storage, AtomicStorageProtocol)
+    assert isinstance(storage, FencedStorageProtocol)
+    with pytest.raises(ValueError, match="shard"):
+        _ = ShardedStorage([])
+
+
+def test_shard_key() -> None:
+    assert shard_key("state|1|2") == "1|2"
+    assert shard_key("state_index|state|1|2") == "1|2"
+    assert shard_key("context||2") == "|2"
+    assert shard_key("key") == "key"
+    assert shard_key("prefix|key") == "prefix|key"
+    storage = ShardedStorage([MemoryStorage() for _ in range(8)])
+    for user_id in range(100):
+        indexes = {
+            storage.shard_index(f"{prefix}|{user_id}|{user_id + 1}")
+            for prefix in ("state", "context", "state_index|state")
+        }
+        assert len(indexes) == 1
+
+
+@pytest.mark.asyncio
+async def test_sharded_storage(tmp_path: Path) -> None:
+    storage = ShardedStorage([
+        SQLiteStorage(tmp_path / f"shard{index}.sqlite") for index in range(4)
+    ])
+    await storage.connect()
+    await storage.set_many((f"key|{index}|{index}", index) for index in range(20))
+    await storage.set("ttl|1|1", 1, ttl=0.01)
+    assert await storage.get("key|3|3") == 3
+    assert len({storage.shard_index(f"key|{i}|{i}") for i in range(20)}) == 4
+    keys = sorted(f"key|{index}|{index}" for index in range(20))
+    assert [key async for key, _ in storage.iterate("key|")] == keys
+    assert [key async for key, _ in storage.iterate("key|1")] == [
+        key for key in keys if key.startswith("key|1")
+    ]
+    assert [key async for key, _ in storage.iterate(limit=3)] == keys[:3]
+    assert [
+        key async for key, _ in storage.iterate(start_after=keys[10], limit=4)
+    ] == keys[11:15]
+    await storage.delete("key|0|0")
+    await storage.delete_many([f"key|{index}|{index}" for index in range(1, 10)])
+    assert await storage.get_many(["key|9|9", "key|12|12", "key|15|15"]) == {
+        "key|9|9": None,
+        "key|12|12": 12,
+        "key|15|15": 15,
+    }
+    assert [key async for key, _ in storage.iterate("key|")] == sorted(
+        f"key|{index}|{index}" for index in range(10, 20)
+    )
+    await asyncio.sleep(0.02)
+    assert await storage.delete_expired(10) == 1
+    assert await storage.incr("counter|1|2", 2) == 2
+    await storage.clear()
+    assert [item async for item in storage.iterate()] == []
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sharded_storage_transaction() -> None:
+    shards = [MemoryStorage() for _ in range(4)]
+    storage = ShardedStorage(shards)
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            for index in range(10):
+                await storage.set(f"key|{index}|{index}", index)
+            assert await storage.get("key|1|1") == 1
+            raise RuntimeError("rollback")
+    assert [item async for item in storage.iterate()] == []
+    async with storage.transaction():
+        await storage.set("state|1|2", "state")
+        await storage.set("context|1|2", {})
+    index = storage.shard_index("state|1|2")
+    assert [key async for key, _ in shards[index].iterate()] == [
+        "context|1|2",
+        "state|1|2",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_sharded_storage_bot_state() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = ShardedStorage([MemoryStorage() for _ in range(4)])
+    bot = PollBot("token", table, storage, state_index=True)
+    for user_id in range(10):
+        async with bot.state_context(UserId(user_id), ChatId(1)) as state_context:
+            state_context.state = "state"
+    assert [item async for item in bot.iterate_state("state")] == [
+        (UserId(user_id), ChatId(1)) for user_id in range(10)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_sharded_storage_fenced() -> None:
+    table = HandlerTable()
+    table.freeze()
+    storage = ShardedStorage([MemoryStorage() for _ in range(4)])
+    lock = StorageLock(storage, retry_interval=0.01)
+    bot = PollBot("token", table, storage, lock_provider=lock)
+    async with bot.state_context(UserId(1), ChatId(2)) as state_context:
+        state_context.state = "state"
+    assert await storage.get_many(["fence|1|2", "state|1|2"]) == {
+        "fence|1|2": 1,
+        "state|1|2": "state",
+    }
+    assert not await storage.set_many_fenced("fence|1|2", 0, [("state|1|2", "")])
+    with pytest.raises(ValueError, match="shard"):
+        _ = await storage.set_many_fenced(
+            "fence|1|2", 2, [(f"state|{user_id}|2", "") for user_id in range(10)]
+        )
@@ -1,7 +1,9 @@
+import asyncio
+
 import pytest
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncEngine
 
-from aiotgbot.storage import StorageProtocol
 from aiotgbot.storage_sqlalchemy import SqlalchemyStorage
 
 pytestmark = pytest.mark.asyncio
@@ -10,7 +12,9 @@ pytestmark = pytest.mark.asyncio
 async def test_sqlalchemy_postgres_storage(postgres_engine: AsyncEngine) -> None:
     """Integration test: Postgres via SQLAlchemy + testcontainers."""
 
-    storage: StorageProtocol = SqlalchemyStorage(postgres_engine)
+    async with postgres_engine.begin() as connection:
+        _ = await connection.execute(text("DROP TABLE IF EXISTS kv"))
+    storage = SqlalchemyStorage(postgres_engine)
 
     await storage.connect()
     await storage.clear()
@@ -36,6 +40,94 @@ async def test_sqlalchemy_postgres_storage(postgres_engine: AsyncEngine) -> None
     await storage.delete("key1")
     assert await storage.get("key2") == {"key3": "value3"}
 
+    await storage.clear()
+    await storage.set_many([
+        ("key%", 0),
+        ("keyA", 1),
+        ("key_1", 2),
+        ("key|1", 3),
+        ("key|2", 4),
+        ("key|3", 5),
+        ("key\U0010ffff", 6),
+        ("kez", 7),
+        ("kex", 8),
+    ])
+    assert [key async for key, _ in storage.iterate("key|")] == [
+        "key|1",
+        "key|2",
+        "key|3",
+    ]
+    assert [key async for key, _ in storage.iterate("key_")] == ["key_1"]
+    assert [key async for key, _ in storage.iterate("key%")] == ["key%"]
+    assert [key async for key, _ in storage.iterate("keya")] == []
+    assert [key async for key, _ in storage.iterate("key\U0010ffff")] == [
+        "key\U0010ffff"
+    ]
+    assert [item async for item in storage.iterate("key|", limit=2)] == [
+        ("key|1", 3),
+        ("key|2", 4),
+    ]
+    assert [
+        item async for item in storage.iterate("key|", start_after="key|2", limit=2)
+    ] == [("key|3", 5)]
+    assert [key async for key, _ in storage.iterate(start_after="key|3")] == [
+        "key\U0010ffff",
+        "kez",
+    ]
+
+    assert await storage.incr("counter") == 1
+    assert await storage.incr("counter", 5) == 6
+    assert await storage.get("counter") == 6
+    await storage.set("text", "value")
+    with pytest.raises(ValueError, match="integer"):
+        _ = await storage.incr("text")
+    await storage.set("null")
+    assert await storage.incr("null", 2) == 2
+    assert await storage.incr("window", ttl=0.05) == 1
+    assert await storage.incr("window", ttl=60) == 2
+    await asyncio.sleep(0.06)
+    assert await storage.incr("window") == 1
+    results = await asyncio.gather(*(storage.incr("concurrent") for _ in range(20)))
+    assert sorted(results) == list(range(1, 21))
+
+    assert await storage.set_if_absent("token", "a", ttl=0.05)
+    assert not await storage.set_if_absent("token", "b")
+    assert await storage.get("token") == "a"
+    await asyncio.sleep(0.06)
+    assert await storage.set_if_absent("token", "c")
+    assert await storage.get("token") == "c"
+
+    assert await storage.compare_and_set("cas", None, {"a": 1})
+    assert not await storage.compare_and_set("cas", None, {"a": 2})
+    assert not await storage.compare_and_set("cas", {"a": 2}, {"a": 3})
+    assert await storage.compare_and_set("cas", {"a": 1}, {"a": 3})
+    assert await storage.get("cas") == {"a": 3}
+    assert await storage.compare_and_set("null", 2, None)
+    assert not await storage.set_if_absent("null", 1)
+    assert await storage.compare_and_set("null", None, "x")
+
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            await storage.set("tx", 1)
+            assert await storage.incr("tx") == 2
+            assert await storage.get("tx") == 2
+            raise RuntimeError("rollback")
+    assert await storage.get("tx") is None
+    async with storage.transaction():
+        await storage.set("tx", 1)
+        await storage.delete("counter")
+        assert await storage.compare_and_set("tx", 1, 2)
+        assert await storage.get("counter") is None
+    assert await storage.get("tx") == 2
+    assert await storage.get("counter") is None
+
+    assert await storage.set_many_fenced("fence", 2, [("state", "first")])
+    assert not await storage.set_many_fenced("fence", 1, [("state", "stale")])
+    assert await storage.get("state") == "first"
+    await storage.set("fence", "text")
+    assert await storage.set_many_fenced("fence", 1, [("state", "second")])
+    assert await storage.get("state") == "second"
+
     await storage.clear()
     assert [item async for item in storage.iterate()] == []
 
@@ -1,8 +1,13 @@
+import asyncio
+from pathlib import Path
+
 import pytest
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
 from aiotgbot import StorageProtocol
 from aiotgbot.helpers import Json
+from aiotgbot.storage import TransactionalStorageProtocol
 from aiotgbot.storage_sqlalchemy import SqlalchemyStorage
 
 KeyValue = tuple[str, Json]
@@ -62,3 +67,184 @@ async def test_sqlalchemy_storage() -> None:
     assert isinstance(storage.raw_connection(), AsyncEngine)
 
     await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_transaction() -> None:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    storage = SqlalchemyStorage(engine)
+    assert isinstance(storage, TransactionalStorageProtocol)
+    await storage.connect()
+
+    async with storage.transaction():
+        await storage.set("key1", 1)
+        async with storage.transaction():
+            await storage.set("key2", 2)
+        assert await storage.get("key1") == 1
+    assert await storage.get("key2") == 2
+
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            await storage.set("key1", 10)
+            await storage.delete("key2")
+            raise RuntimeError("rollback")
+    assert await storage.get("key1") == 1
+    assert await storage.get("key2") == 2
+
+    await storage.close()
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_batch() -> None:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    storage = SqlalchemyStorage(engine)
+    await storage.connect()
+    await storage.set("key1", "old")
+    await storage.set_many([("key1", 1), ("key2", 2), ("key3", 3)])
+    await storage.delete_many(["key1", "key3", "missing"])
+    assert [item async for item in storage.iterate()] == [("key2", 2)]
+    assert await storage.get_many(["key2", "key1", "missing"]) == {
+        "key2": 2,
+        "key1": None,
+        "missing": None,
+    }
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_ttl(tmp_path: Path) -> None:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'kv.sqlite3'}")
+    async with engine.begin() as connection:
+        _ = await connection.execute(
+            text("CREATE TABLE kv (key TEXT NOT NULL PRIMARY KEY, value JSON)")
+        )
+        _ = await connection.execute(text("INSERT INTO kv VALUES ('legacy', '1')"))
+    storage = SqlalchemyStorage(engine)
+    await storage.connect()
+    assert await storage.get("legacy") == 1
+    await storage.set("key1", 1, ttl=0.05)
+    await storage.set_many([("key2", 2), ("key3", 3)], ttl=0.05)
+    await storage.set("key3", 3)
+    assert await storage.get("key1") == 1
+    await asyncio.sleep(0.06)
+    assert await storage.get("key1") is None
+    assert [item async for item in storage.iterate("key")] == [("key3", 3)]
+    assert await storage.delete_expired(1) == 1
+    assert await storage.delete_expired(10) == 1
+    assert await storage.delete_expired(10) == 0
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_iterate_range() -> None:
+    storage = SqlalchemyStorage(create_async_engine("sqlite+aiosqlite://"))
+    await storage.connect()
+    await storage.set_many([
+        ("key%", 0),
+        ("keyA", 1),
+        ("key_1", 2),
+        ("key|1", 3),
+        ("key|2", 4),
+        ("key|3", 5),
+        ("key\U0010ffff", 6),
+        ("kez", 7),
+        ("kex", 8),
+    ])
+    assert [key async for key, _ in storage.iterate("key|")] == [
+        "key|1",
+        "key|2",
+        "key|3",
+    ]
+    assert [key async for key, _ in storage.iterate("key_")] == ["key_1"]
+    assert [key async for key, _ in storage.iterate("key%")] == ["key%"]
+    assert [key async for key, _ in storage.iterate("keya")] == []
+    assert [key async for key, _ in storage.iterate("key\U0010ffff")] == [
+        "key\U0010ffff"
+    ]
+    assert [item async for item in storage.iterate("key|", limit=2)] == [
+        ("key|1", 3),
+        ("key|2", 4),
+    ]
+    assert [
+        item async for item in storage.iterate("key|", start_after="key|2", limit=2)
+    ] == [("key|3", 5)]
+    assert [key async for key, _ in storage.iterate(start_after="key|3")] == [
+        "key\U0010ffff",
+        "kez",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_atomic(tmp_path: Path) -> None:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+    storage = SqlalchemyStorage(engine)
+    await storage.connect()
+    assert await storage.incr("counter") == 1
+    assert await storage.incr("counter", 5) == 6
+    assert await storage.get("counter") == 6
+    await storage.set("text", "value")
+    with pytest.raises(ValueError, match="integer"):
+        _ = await storage.incr("text")
+    await storage.set("null")
+    assert await storage.incr("null", 2) == 2
+    assert await storage.incr("window", ttl=0.05) == 1
+    assert await storage.incr("window", ttl=60) == 2
+    await asyncio.sleep(0.06)
+    assert await storage.incr("window") == 1
+    results = await asyncio.gather(*(storage.incr("concurrent") for _ in range(20)))
+    assert sorted(results) == list(range(1, 21))
+
+    assert await storage.set_if_absent("token", "a", ttl=0.05)
+    assert not await storage.set_if_absent("token", "b")
+    assert await storage.get("token") == "a"
+    await asyncio.sleep(0.06)
+    assert await storage.set_if_absent("token", "c")
+    assert await storage.get("token") == "c"
+
+    assert await storage.compare_and_set("cas", None, {"a": 1})
+    assert not await storage.compare_and_set("cas", None, {"a": 2})
+    assert not await storage.compare_and_set("cas", {"a": 2}, {"a": 3})
+    assert await storage.compare_and_set("cas", {"a": 1}, {"a": 3})
+    assert await storage.get("cas") == {"a": 3}
+    assert await storage.compare_and_set("null", 2, None)
+    assert not await storage.set_if_absent("null", 1)
+    assert await storage.compare_and_set("null", None, "x")
+
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            await storage.set("tx", 1)
+            assert await storage.incr("tx") == 2
+            assert await storage.get("tx") == 2
+            raise RuntimeError("rollback")
+    assert await storage.get("tx") is None
+    async with storage.transaction():
+        await storage.set("tx", 1)
+        await storage.delete("counter")
+        assert await storage.compare_and_set("tx", 1, 2)
+        assert await storage.get("counter") is None
+    assert await storage.get("tx") == 2
+    assert await storage.get("counter") is None
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlalchemy_storage_fenced(tmp_path: Path) -> None:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+    storage = SqlalchemyStorage(engine)
+    await storage.connect()
+    assert await storage.set_many_fenced("fence", 1, [("state", "first")])
+    assert await storage.set_many_fenced("fence", 2, [("state", "second")])
+    assert not await storage.set_many_fenced("fence", 1, [("state", "stale")])
+    assert await storage.set_many_fenced("fence", 2, [])
+    assert await storage.get_many(["fence", "state"]) == {
+        "fence": 2,
+        "state": "second",
+    }
+    await storage.set("fence", 5, ttl=0.05)
+    await asyncio.sleep(0.06)
+    assert await storage.set_many_fenced("fence", 3, [("state", "third")], ttl=60)
+    assert await storage.get("state") == "third"
+    await storage.set("fence", "text")
+    assert await storage.set_many_fenced("fence", 1, [])
+    await engine.dispose()
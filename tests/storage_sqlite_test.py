@@ -1,9 +1,13 @@
+import asyncio
+from pathlib import Path
+from typing import cast
+
 import aiosqlite
 import pytest
 
-from aiotgbot import StorageProtocol
+from aiotgbot import StorageProtocol, storage_sqlite
 from aiotgbot.helpers import Json
-from aiotgbot.storage_sqlite import SQLiteStorage
+from aiotgbot.storage_sqlite import JournalMode, SQLiteStorage
 
 KeyValue = tuple[str, Json]
 
@@ -61,3 +65,274 @@ async def test_sqlite_storage() -> None:
     assert isinstance(storage.raw_connection(), aiosqlite.Connection)
 
     await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_group_commit(tmp_path: Path) -> None:
+    database = tmp_path / "storage.sqlite3"
+    storage = SQLiteStorage(
+        database,
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        commit_delay=0.01,
+        commit_batch_size=50,
+    )
+    await storage.connect()
+    async with storage.connection.execute("PRAGMA journal_mode") as cursor:
+        row = await cursor.fetchone()
+    assert row is not None
+    assert row[0] == "wal"
+
+    _ = await asyncio.gather(
+        *(storage.set(f"key{index:03}", {"index": index}) for index in range(120))
+    )
+    assert await storage.get("key007") == {"index": 7}
+    await asyncio.gather(storage.delete("key000"), storage.set("key001", None))
+    await storage.close()
+
+    storage = SQLiteStorage(database)
+    await storage.connect()
+    items = [item async for item in storage.iterate("key")]
+    assert len(items) == 119
+    assert items[0] == ("key001", None)
+    assert items[-1] == ("key119", {"index": 119})
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_commit_loop_stopped(tmp_path: Path) -> None:
+    storage = SQLiteStorage(tmp_path / "storage.sqlite3", commit_delay=10.0)
+    await storage.connect()
+    write = asyncio.create_task(storage.set("key1", 1))
+    await asyncio.sleep(0)
+    commit_task = storage._commit_task  # pyright: ignore[reportPrivateUsage]
+    assert commit_task is not None
+    _ = commit_task.cancel()
+    with pytest.raises(RuntimeError, match="Commit loop stopped"):
+        await write
+    with pytest.raises(RuntimeError, match="Commit loop stopped"):
+        await storage.set("key2", 2)
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_fenced(tmp_path: Path) -> None:
+    database = tmp_path / "storage.sqlite3"
+    first = SQLiteStorage(database, journal_mode="WAL")
+    second = SQLiteStorage(database, journal_mode="WAL")
+    await first.connect()
+    await second.connect()
+    assert await first.set_many_fenced("fence", 1, [("state", "first")])
+    assert await second.set_many_fenced("fence", 2, [("state", "second")])
+    assert not await first.set_many_fenced("fence", 1, [("state", "stale")])
+    assert await first.get_many(["fence", "state"]) == {
+        "fence": 2,
+        "state": "second",
+    }
+    await first.close()
+    await second.close()
+
+
+def test_sqlite_storage_invalid_options() -> None:
+    with pytest.raises(ValueError, match="Group commit"):
+        _ = SQLiteStorage(":memory:", isolation_level="DEFERRED", commit_delay=0.1)
+    with pytest.raises(ValueError, match="journal mode"):
+        _ = SQLiteStorage(":memory:", journal_mode=cast(JournalMode, "BAD"))
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_read_connections(tmp_path: Path) -> None:
+    storage = SQLiteStorage(
+        tmp_path / "storage.sqlite3",
+        journal_mode="WAL",
+        commit_delay=0.0,
+        read_connections=2,
+    )
+    await storage.connect()
+    await storage.set("key1", 1)
+    await storage.set("key2", 2)
+
+    async def scan() -> list[KeyValue]:
+        return [item async for item in storage.iterate("key")]
+
+    results = await asyncio.gather(
+        scan(), scan(), storage.get("key1"), storage.set("key3", 3)
+    )
+    # Scans run beside the write and may see it or not
+    assert results[0] in (
+        [("key1", 1), ("key2", 2)],
+        [("key1", 1), ("key2", 2), ("key3", 3)],
+    )
+    assert results[2] == 1
+    assert await storage.get("key3") == 3
+    assert storage.raw_connection() is storage.connection
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_nested_reads(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(storage_sqlite, "ITERATE_PAGE_SIZE", 2)
+    storage = SQLiteStorage(
+        tmp_path / "storage.sqlite3", journal_mode="WAL", read_connections=1
+    )
+    await storage.connect()
+    await storage.set_many((f"key{index}", index) for index in range(5))
+    # The only reader is free while the loop body reads
+    nested = [
+        (key, await asyncio.wait_for(storage.get(key), 1))
+        async for key, _ in storage.iterate("key")
+    ]
+    assert nested == [(f"key{index}", index) for index in range(5)]
+    assert [key async for key, _ in storage.iterate("key", limit=3)] == [
+        "key0",
+        "key1",
+        "key2",
+    ]
+    await storage.close()
+
+
+def test_sqlite_storage_read_connections_memory() -> None:
+    with pytest.raises(ValueError, match="file database"):
+        _ = SQLiteStorage(":memory:", read_connections=2)
+    with pytest.raises(ValueError, match="WAL"):
+        _ = SQLiteStorage("storage.sqlite3", read_connections=2)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_batch() -> None:
+    storage = SQLiteStorage(":memory:")
+    await storage.connect()
+    await storage.set_many([("key1", 1), ("key2", 2), ("key3", 3)])
+    await storage.delete_many(["key1", "key3", "missing"])
+    assert [item async for item in storage.iterate()] == [("key2", 2)]
+    assert await storage.get_many(["key2", "key1", "missing"]) == {
+        "key2": 2,
+        "key1": None,
+        "missing": None,
+    }
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_ttl(tmp_path: Path) -> None:
+    database = tmp_path / "storage.sqlite3"
+    async with aiosqlite.connect(database) as connection:
+        _ = await connection.execute(
+            "CREATE TABLE kv (key TEXT NOT NULL PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        _ = await connection.execute("INSERT INTO kv VALUES ('legacy', '1')")
+        await connection.commit()
+
+    storage = SQLiteStorage(database, commit_delay=0.0)
+    await storage.connect()
+    assert await storage.get("legacy") == 1
+    await storage.set("key1", 1, ttl=0.05)
+    await storage.set_many([("key2", 2), ("key3", 3)], ttl=0.05)
+    await storage.set("key3", 3)
+    assert await storage.get("key1") == 1
+    await asyncio.sleep(0.06)
+    assert await storage.get("key1") is None
+    assert [item async for item in storage.iterate("key")] == [("key3", 3)]
+    assert await storage.delete_expired(1) == 1
+    assert await storage.delete_expired(10) == 1
+    assert await storage.delete_expired(10) == 0
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_iterate_range() -> None:
+    storage = SQLiteStorage(":memory:")
+    await storage.connect()
+    await storage.set_many([
+        ("key%", 0),
+        ("keyA", 1),
+        ("key_1", 2),
+        ("key|1", 3),
+        ("key|2", 4),
+        ("key|3", 5),
+        ("key\U0010ffff", 6),
+        ("kez", 7),
+        ("kex", 8),
+    ])
+    assert [key async for key, _ in storage.iterate("key|")] == [
+        "key|1",
+        "key|2",
+        "key|3",
+    ]
+    assert [key async for key, _ in storage.iterate("key_")] == ["key_1"]
+    assert [key async for key, _ in storage.iterate("key%")] == ["key%"]
+    assert [key async for key, _ in storage.iterate("keya")] == []
+    assert [key async for key, _ in storage.iterate("key\U0010ffff")] == [
+        "key\U0010ffff"
+    ]
+    assert [item async for item in storage.iterate("key|", limit=2)] == [
+        ("key|1", 3),
+        ("key|2", 4),
+    ]
+    assert [
+        item async for item in storage.iterate("key|", start_after="key|2", limit=2)
+    ] == [("key|3", 5)]
+    assert [key async for key, _ in storage.iterate(start_after="key|3")] == [
+        "key\U0010ffff",
+        "kez",
+    ]
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_storage_atomic(tmp_path: Path) -> None:
+    storage = SQLiteStorage(tmp_path / "db.sqlite")
+    await storage.connect()
+    assert await storage.incr("counter") == 1
+    assert await storage.incr("counter", 5) == 6
+    assert await storage.get("counter") == 6
+    await storage.set("text", "value")
+    with pytest.raises(ValueError, match="integer"):
+        _ = await storage.incr("text")
+    await storage.set("null")
+    assert await storage.incr("null", 2) == 2
+    assert await storage.incr("window", ttl=0.05) == 1
+    assert await storage.incr("window", ttl=60) == 2
+    await asyncio.sleep(0.06)
+    assert await storage.incr("window") == 1
+    results = await asyncio.gather(*(storage.incr("concurrent") for _ in range(20)))
+    assert sorted(results) == list(range(1, 21))
+
+    assert await storage.set_if_absent("token", "a", ttl=0.05)
+    assert not await storage.set_if_absent("token", "b")
+    assert await storage.get("token") == "a"
+    await asyncio.sleep(0.06)
+    assert await storage.set_if_absent("token", "c")
+    assert await storage.get("token") == "c"
+
+    assert await storage.compare_and_set("cas", None, {"a": 1})
+    assert not await storage.compare_and_set("cas", None, {"a": 2})
+    assert not await storage.compare_and_set("cas", {"a": 2}, {"a": 3})
+    assert await storage.compare_and_set("cas", {"a": 1}, {"a": 3})
+    assert await storage.get("cas") == {"a": 3}
+    assert await storage.compare_and_set("null", 2, None)
+    assert not await storage.set_if_absent("null", 1)
+    assert await storage.compare_and_set("null", None, "x")
+
+    with pytest.raises(RuntimeError, match="rollback"):
+        async with storage.transaction():
+            await storage.set("tx", 1)
+            assert await storage.incr("tx") == 2
+            assert await storage.get("tx") == 2
+            raise RuntimeError("rollback")
+    assert await storage.get("tx") is None
+    async with storage.transaction():
+        await storage.set("tx", 1)
+        await storage.delete("counter")
+        assert await storage.compare_and_set("tx", 1, 2)
+        assert await storage.get("counter") is None
+        assert await storage.get_many(["tx", "counter", "cas"]) == {
+            "tx": 2,
+            "counter": None,
+            "cas": {"a": 3},
+        }
+    assert await storage.get("tx") == 2
+    assert await storage.get("counter") is None
+    await storage.close()